@@ -20,8 +20,12 @@
 """
 
 import re
+import operator
+from bisect import bisect_right
+from itertools import accumulate, compress, repeat
 import tkinter as tk
 import Pmw
+from Tracing import traced
 # from types import *
 
 
@@ -110,8 +114,7 @@ def isnumber(v1, v2):
 
 def regex(v1, v2):
     """Apply a regular expression"""
-    print(re.findall(v1, v2))
-    return
+    return re.search(v1, v2) is not None
 
 operatornames = {'=': equals,
                  '!=': notequals,
@@ -122,22 +125,158 @@ operatornames = {'=': equals,
                  'starts with': startswith,
                  'ends with': endswith,
                  'has length': haslength,
-                 'is number': isnumber}
+                 'is number': isnumber,
+                 'regex': regex}
 
+# operators that compare as numbers when both sides can be converted
+floatops = ['=', '>', '<']
 
-def doFiltering(searchfunc, filters=None):
+
+def toNumber(v):
+    """Return v as a float or None if it can't be converted"""
+    try:
+        return float(v)
+    except (ValueError, TypeError):
+        return None
+
+
+def batchCompare(func, values, value):
+    """Apply a comparison operator from the operator module to a whole
+       list in one map call, returns a 0/1 bytearray"""
+    return bytearray(map(func, values, repeat(value)))
+
+
+def batchNumeric(func, cells, value):
+    """Compare as floats where the cell and value are numbers and fall back
+       to comparing strings elsewhere, as filterBy always did"""
+    v = toNumber(value)
+    if v is None:
+        return batchCompare(func, map(str, cells), value)
+    if set(map(type, cells)) <= {float, type(None)}:
+        # typed column, missing cells are masked out later
+        nums = [0.0 if c is None else c for c in cells]
+        return batchCompare(func, nums, v)
+    nums = list(map(toNumber, cells))
+    return bytearray(func(n, v) if n is not None else func(str(c), value)
+                     for n, c in zip(nums, cells))
+
+
+def batchHasLength(strs, value):
+    v = toNumber(value)
+    if v is None:
+        return bytearray(len(strs))
+    return batchCompare(operator.gt, map(len, strs), v)
+
+
+def batchRegex(strs, value):
+    try:
+        search = re.compile(value).search
+    except re.error:
+        return bytearray(len(strs))
+    return bytearray(s is not None for s in map(search, strs))
+
+
+def notMask(mask):
+    """Invert a 0/1 mask"""
+    return mask.translate(bytes([1, 0]) + bytes(254))
+
+
+def combineMasks(mask1, mask2, boolean='AND'):
+    """Combine two 0/1 masks of equal length with a boolean operator,
+       done on whole integers so there is no per item loop"""
+    size = len(mask1)
+    a = int.from_bytes(mask1, 'little')
+    b = int.from_bytes(mask2, 'little')
+    if boolean == 'OR':
+        c = a | b
+    elif boolean == 'NOT':
+        c = a & ~b
+    else:
+        c = a & b
+    return bytearray(c.to_bytes(size, 'little'))
+
+
+def filterMask(cells, value, op='contains', names=None):
+    """Batch version of the operators in operatornames.
+       cells is the list of column values in record order with None for
+       records that don't have the field. If names is given the record names
+       are matched instead of the cell values.
+       returns: a bytearray with 1 for every matching record"""
+
+    present = bytearray(map(operator.is_not, cells, repeat(None)))
+    if op in floatops and names is None:
+        func = {'=': operator.eq, '>': operator.gt, '<': operator.lt}[op]
+        return combineMasks(batchNumeric(func, cells, value), present)
+    if names is not None:
+        strs = list(names)
+    else:
+        strs = list(map(str, cells))
+    if op == '=':
+        mask = batchCompare(operator.eq, strs, value)
+    elif op == '>':
+        mask = batchCompare(operator.gt, strs, value)
+    elif op == '<':
+        mask = batchCompare(operator.lt, strs, value)
+    elif op == '!=':
+        mask = batchCompare(operator.ne, strs, value)
+    elif op == 'contains':
+        mask = batchCompare(operator.contains, strs, value)
+    elif op == 'excludes':
+        mask = notMask(batchCompare(operator.contains, strs, value))
+    elif op == 'starts with':
+        mask = batchCompare(str.startswith, strs, value)
+    elif op == 'ends with':
+        mask = batchCompare(str.endswith, strs, value)
+    elif op == 'has length':
+        mask = batchHasLength(strs, value)
+    elif op == 'is number':
+        mask = bytearray(toNumber(s) is not None for s in strs)
+    elif op == 'regex':
+        mask = batchRegex(strs, value)
+    else:
+        func = operatornames[op]
+        mask = bytearray(bool(func(value, s)) for s in strs)
+    return combineMasks(mask, present)
+
+
+def doMaskFiltering(maskfunc, names, filters=None):
+    """Module level method. Filter recs by several filters in a single pass
+       over boolean masks.
+       maskfunc(col, value, op) must return a 0/1 mask aligned with names,
+       filters is a list of tuples of the form (key,value,operator,bool)
+       returns: found record keys, in the same order as names"""
+
+    if filters is None:
+        return list(names)
+    mask = None
+    for f in filters:
+        col, val, op, boolean = f
+        m = maskfunc(col, val, op)
+        if mask is None:
+            mask = m
+        else:
+            mask = combineMasks(mask, m, boolean)
+    if mask is None:
+        return list(names)
+    return list(compress(names, mask))
+
+
+def doFiltering(searchfunc, filters=None, order=None):
     """Module level method. Filter recs by several filters using a user provided
        search function.
        filters is a list of tuples of the form (key,value,operator,bool)
+       order is an optional list of all record keys giving the result order
        returns: found record keys"""
 
     if filters is None:
         return
     F = filters
     sets = []
+    found = []
     for f in F:
         col, val, op, boolean = f
         names = searchfunc(col, val, op)
+        found.append(names)
         sets.append((set(names), boolean))
     names = sets[0][0]
     for s in sets[1:]:
@@ -149,8 +288,191 @@ def doFiltering(searchfunc, filters=None):
         elif b == 'NOT':
             names = names - s[0]
         # print len(names)
-    names = list(names)
-    return names
+    # keep the order the records were found in rather than set order
+    if order is None:
+        order = [n for l in found for n in l]
+    result = []
+    for n in order:
+        if n in names:
+            result.append(n)
+            names.discard(n)
+    return result
+
+
+class SearchIndex(object):
+    """The text shown in the cells of a table model, kept for searching.
+       Each column is cached as the text of its cells in row order and
+       joined into one string, so a plain search runs at the speed of
+       str.find rather than testing cells one by one. The cache follows
+       the model's change events: an edited cell updates its entry and
+       changes that move rows drop the cache, which is rebuilt when next
+       searched. Setting or clearing a filter also drops it. Matches
+       are (row, col) pairs in the order they are shown, across each row
+       and then down"""
+
+    def __init__(self, model):
+        self.model = model
+        self.texts = {}     # colname -> text of the cell in each row
+        self.blobs = {}     # (colname, case) -> joined text, row starts
+        self.names = None   # the record names the cache follows
+        model.addListener(self.modelChanged)
+        return
+
+    def close(self):
+        """Stop following the model"""
+        self.model.removeListener(self.modelChanged)
+        self.clear()
+        return
+
+    def clear(self):
+        self.texts = {}
+        self.blobs = {}
+        self.names = None
+        return
+
+    def checkNames(self):
+        """Drop the cache if the rows shown are another list, as when a
+           filter is set or cleared without notifying the model"""
+        names = self.getNames()
+        if names is not self.names:
+            self.clear()
+            self.names = names
+        return
+
+    def modelChanged(self, kind, recname=None, colname=None):
+        """Model listener, keeps the cached text up to date"""
+        if kind == 'cell':
+            self.checkNames()
+            texts = self.texts.get(colname)
+            if texts is None:
+                return
+            row = self.model.getRecordRow(recname)
+            if row is None or row >= len(texts):
+                self.clear()
+                return
+            text = self.model.getDisplayValues(colname, [recname])[0]
+            texts[row] = str(text)
+            self.blobs.pop((colname, True), None)
+            self.blobs.pop((colname, False), None)
+        elif kind == 'column':
+            self.texts.pop(colname, None)
+            self.blobs.pop((colname, True), None)
+            self.blobs.pop((colname, False), None)
+        else:
+            self.clear()
+        return
+
+    def getNames(self):
+        """Record names in the order their rows are shown"""
+        model = self.model
+        if model.filteredrecs is not None:
+            return model.filteredrecs
+        return model.reclist
+
+    def getTexts(self, colname):
+        """Text of each row in a column"""
+        self.checkNames()
+        texts = self.texts.get(colname)
+        if texts is None:
+            values = self.model.getDisplayValues(colname, self.getNames())
+            texts = self.texts[colname] = [str(v) for v in values]
+        return texts
+
+    def getBlob(self, colname, case):
+        """The texts of a column joined by newlines, lower case unless case
+           is True, and the position where each row starts"""
+        self.checkNames()
+        blob = self.blobs.get((colname, case))
+        if blob is not None:
+            return blob
+        texts = self.getTexts(colname)
+        text = '\n'.join(texts)
+        if text.count('\n') != len(texts) - 1:
+            # cells can't hold the separator
+            texts = [t.replace('\n', ' ') for t in texts]
+            text = '\n'.join(texts)
+        if not case:
+            lower = text.lower()
+            if len(lower) != len(text):
+                # a few characters change length in lower case
+                texts = [t.lower() for t in texts]
+                lower = '\n'.join(texts)
+            text = lower
+        starts = [0]
+        starts.extend(accumulate(len(t) + 1 for t in texts))
+        blob = self.blobs[(colname, case)] = (text, starts)
+        return blob
+
+    def findInColumn(self, colname, text, start=0, case=False,
+                     pattern=None):
+        """First row from start on whose cell holds text, or matches the
+           compiled regular expression pattern. returns: None if none do"""
+        if pattern is not None:
+            texts = self.getTexts(colname)
+            search = pattern.search
+            for row in range(start, len(texts)):
+                if search(texts[row]):
+                    return row
+            return None
+        blob, starts = self.getBlob(colname, case)
+        if start >= len(starts) - 1:
+            return None
+        pos = blob.find(text, starts[start])
+        if pos == -1:
+            return None
+        return bisect_right(starts, pos) - 1
+
+    def compile(self, text, regex, case):
+        """The text to look for and the pattern if it is a regex"""
+        if regex:
+            return text, re.compile(text, 0 if case else re.IGNORECASE)
+        if not case:
+            text = text.lower()
+        return text, None
+
+    @traced('search.findNext')
+    def findNext(self, text, row=-1, col=-1, regex=False, case=False):
+        """The first cell after row, col holding text or, if regex, matching
+           it as a regular expression. returns: (row, col) or None"""
+        if text == '' or (not regex and '\n' in text):
+            return None
+        text, pattern = self.compile(text, regex, case)
+        found = None
+        for c, colname in enumerate(self.model.columnNames):
+            start = row if c > col else row + 1
+            if found is not None and start >= found[0]:
+                continue
+            r = self.findInColumn(colname, text, max(start, 0), case,
+                                  pattern)
+            if r is None:
+                continue
+            if found is None or (r, c) < found:
+                found = (r, c)
+        return found
+
+    @traced('search.findAll')
+    def findAll(self, text, regex=False, case=False, progress=None,
+                cancel=None):
+        """Every cell holding text, or matching it if regex.
+           progress and cancel are used when run in the background, see
+           TableCanvas.runInBackground. returns: a list of (row, col)"""
+        if text == '' or (not regex and '\n' in text):
+            return []
+        text, pattern = self.compile(text, regex, case)
+        colnames = self.model.columnNames
+        found = []
+        for c, colname in enumerate(colnames):
+            if cancel is not None and cancel():
+                return None
+            row = self.findInColumn(colname, text, 0, case, pattern)
+            while row is not None:
+                found.append((row, c))
+                row = self.findInColumn(colname, text, row + 1, case,
+                                        pattern)
+            if progress is not None:
+                progress((c + 1) / len(colnames))
+        found.sort()
+        return found
 
 
 class FilterFrame(tk.Frame):
@@ -195,11 +517,16 @@ class FilterFrame(tk.Frame):
         self.destroy()
         return
 
-    def doFiltering(self, searchfunc):
-        """ Do a filter """
+    def getFilters(self):
+        """Get the (col, value, operator, boolean) tuples for all bars"""
         F = []
         for f in self.filters:
             F.append(f.getFilter())
+        return F
+
+    def doFiltering(self, searchfunc):
+        """ Do a filter """
+        F = self.getFilters()
         names = doFiltering(searchfunc, F)
         self.updateResults(len(names))
         return names
@@ -213,7 +540,7 @@ class FilterFrame(tk.Frame):
 class FilterBar(tk.Frame):
     """Class providing filter widgets"""
     operators = ['contains', 'excludes', '=', '!=', '>', '<', 'starts with',
-                 'ends with', 'has length', 'is number']
+                 'ends with', 'has length', 'is number', 'regex']
     booleanops = ['AND', 'OR', 'NOT']
 
     def __init__(self, parent, index, fields):
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+    Module implements a watchdog that measures how quickly the Tk main
+    loop responds and records the times it stalled.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# The main loop runs a heartbeat with after() every interval. How late
+# each beat runs is the time the loop was busy before it could get to it.
+# Nothing on the main thread can notice that it is blocked, so a sampling
+# thread checks the beats: once one is overdue by more than threshold it
+# takes the stack of the main thread and the tracing spans it is in, the
+# operation being done. The stall is recorded, with its length, when the
+# late beat finally runs. The sampling thread never calls Tk.
+
+import sys
+import json
+import time
+import threading
+import traceback
+from collections import deque
+from time import perf_counter
+import tkinter as tk
+import Tracing
+
+
+class StallMonitor(object):
+    """Measures the responsiveness of the main loop of a Tk widget,
+       see the module comment.
+       interval: seconds between heartbeats
+       threshold: how late in seconds a beat must be to count as a stall
+       Tracing is enabled, without keeping events, while the monitor runs
+       so that stalls can be put down to the operation in progress"""
+
+    def __init__(self, widget, interval=0.05, threshold=0.2, maxstalls=100):
+        self.widget = widget
+        self.interval = interval
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.lateness = Tracing.Histogram()
+        self.stalls = deque(maxlen=maxstalls)
+        self.stallcount = 0
+        self.stalltime = 0.0
+        self.longest = 0.0
+        self.current = None     # a stall seen by the sampler, not over yet
+        self.due = None         # when the next beat should run
+        self.pending = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.tracing = False    # if the monitor turned tracing on
+        return
+
+    def isRunning(self):
+        return self.thread is not None
+
+    def start(self):
+        """Start the heartbeat and the sampling thread"""
+        if self.isRunning():
+            return
+        if not Tracing.tracer.enabled:
+            Tracing.enable(events=False)
+            self.tracing = True
+        self.mainthread = threading.get_ident()
+        self.stopped.clear()
+        self.due = perf_counter() + self.interval
+        self.pending = self.widget.after(int(self.interval * 1000),
+                                         self.beat)
+        self.thread = threading.Thread(target=self.sample,
+                                       name='stallmonitor', daemon=True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        if not self.isRunning():
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        if self.pending is not None:
+            try:
+                self.widget.after_cancel(self.pending)
+            except tk.TclError:
+                pass
+            self.pending = None
+        if self.tracing:
+            Tracing.disable()
+            self.tracing = False
+        return
+
+    def beat(self):
+        """Heartbeat, run by the main loop"""
+        now = perf_counter()
+        with self.lock:
+            late = max(now - self.due, 0.0)
+            self.lateness.add(late)
+            stall = self.current
+            self.current = None
+            if stall is None and late > self.threshold:
+                # over before the sampler looked, so without a stack
+                stall = self.getStall(now, None)
+            if stall is not None:
+                stall['duration'] = late
+                self.stalls.append(stall)
+                self.stallcount += 1
+                self.stalltime += late
+                self.longest = max(self.longest, late)
+            self.due = now + self.interval
+        if self.stopped.is_set():
+            return
+        try:
+            self.pending = self.widget.after(int(self.interval * 1000),
+                                             self.beat)
+        except tk.TclError:
+            # the widget was destroyed
+            self.pending = None
+            self.stopped.set()
+        return
+
+    def getStall(self, now, frame):
+        """A record of a stall that began when the last beat fell due"""
+        operations = list(Tracing.tracer.active.get(self.mainthread, ()))
+        stack = None
+        if frame is not None:
+            stack = ''.join(traceback.format_stack(frame)[-30:])
+        return {'time': time.time() - (now - self.due),
+                'duration': now - self.due,
+                'operation': operations[-1] if operations else None,
+                'operations': operations,
+                'stack': stack}
+
+    def sample(self):
+        """Sampling thread, watches for overdue heartbeats"""
+        while not self.stopped.wait(self.interval):
+            now = perf_counter()
+            with self.lock:
+                if self.current is not None or \
+                        now - self.due <= self.threshold:
+                    continue
+                frame = sys._current_frames().get(self.mainthread)
+                self.current = self.getStall(now, frame)
+        return
+
+    def getStats(self):
+        """Responsiveness so far: the heartbeat lateness histogram, the
+           number, total and longest time of stalls, the last few stalls
+           and one going on now if any. Times are in seconds"""
+        with self.lock:
+            return {'running': self.isRunning(),
+                    'interval': self.interval,
+                    'threshold': self.threshold,
+                    'lateness': self.lateness.toDict(),
+                    'stalls': self.stallcount,
+                    'stalltime': self.stalltime,
+                    'longest': self.longest,
+                    'laststall': self.stalls[-1] if self.stalls else None,
+                    'recent': list(self.stalls),
+                    'current': dict(self.current) if self.current else None}
+
+    def saveJSON(self, filename):
+        with open(filename, 'w') as fd:
+            json.dump(self.getStats(), fd, indent=2)
+        return
+
+
+class StatusHUD(object):
+    """A small label in the corner of a frame showing the last redraw
+       time and canvas item count of a table and the last stall.
+       gettable returns the table to describe, which may change"""
+
+    def __init__(self, parent, monitor, gettable, every=1000):
+        self.monitor = monitor
+        self.gettable = gettable
+        self.every = every
+        self.label = tk.Label(parent, bg='black', fg='#A0FFA0',
+                              font=('Courier', 9), justify='left')
+        self.label.place(relx=1.0, rely=1.0, anchor='se')
+        self.pending = None
+        self.update()
+        return
+
+    def getText(self):
+        stats = Tracing.tracer.stats.get('redraw')
+        lines = ['redraw {0:.1f} ms'.format(
+            stats.last * 1000 if stats is not None else 0.0)]
+        table = self.gettable()
+        try:
+            lines.append('items {0:d}'.format(len(table.find_all())))
+        except (AttributeError, tk.TclError):
+            # no table, or it was closed
+            pass
+        stall = self.monitor.getStats()['laststall']
+        if stall is not None:
+            lines.append('stall {0:.0f} ms {1}'.format(
+                stall['duration'] * 1000, stall['operation'] or ''))
+        return '\n'.join(lines)
+
+    def update(self):
+        try:
+            self.label.configure(text=self.getText())
+            self.pending = self.label.after(self.every, self.update)
+        except tk.TclError:
+            self.pending = None
+        return
+
+    def close(self):
+        if self.pending is not None:
+            self.label.after_cancel(self.pending)
+            self.pending = None
+        self.label.destroy()
+        return
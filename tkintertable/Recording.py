@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+    Module implements a Tk root that records widget commands instead of
+    drawing them, so that tables can be run without a display and the
+    canvas work of a redraw counted.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# tkinter widgets do everything through their root's Tcl interpreter,
+# root.tk. RecordingRoot starts Tcl without Tk and puts a RecordingTcl in
+# front of it: commands Tcl knows itself, such as after and update, and
+# the Python callbacks tkinter registers go to the real interpreter, so
+# after_idle and update_idletasks work as usual. Tk commands are logged
+# and answered from a small model of the widgets, in which canvases keep
+# their items, tags and scroll position. Widgets are made on the root in
+# the usual way, e.g.
+#     root = RecordingRoot()
+#     frame = tk.Frame(root)
+#     table = TableCanvas(frame, model)
+#     table.createTableFrame()
+#     with root.recording() as calls:
+#         table.redrawVisible()
+#     countOps(calls, table)
+
+import tkinter as tk
+from collections import Counter
+from contextlib import contextmanager
+
+# Tk commands that make a widget, ttk ones start with ttk::
+WIDGETCLASSES = {'button', 'canvas', 'checkbutton', 'entry', 'frame',
+                 'label', 'labelframe', 'listbox', 'menu', 'menubutton',
+                 'message', 'panedwindow', 'radiobutton', 'scale',
+                 'scrollbar', 'spinbox', 'text', 'toplevel'}
+
+# canvas commands that cost Tk work, as counted by countOps
+CANVAS_OPS = ('create', 'delete', 'itemconfigure', 'coords', 'move',
+              'lower', 'raise', 'bind', 'addtag', 'dtag')
+
+
+def isOption(value):
+    """True for an option name such as -fill, rather than a number"""
+    return (isinstance(value, str) and len(value) > 1 and
+            value[0] == '-' and value[1].isalpha())
+
+
+def splitOptions(args):
+    """Split arguments ending in -option value pairs.
+       returns: the leading arguments and a dict of the options"""
+    args = list(args)
+    for i, arg in enumerate(args):
+        if isOption(arg):
+            return args[:i], dict(zip(args[i::2], args[i + 1::2]))
+    return args, {}
+
+
+class Widget(object):
+    """What is known of a widget: its class and options"""
+
+    def __init__(self, path, widgetclass, options):
+        self.path = path
+        self.widgetclass = widgetclass
+        self.options = options
+        return
+
+
+class Canvas(Widget):
+    """A canvas widget with its items and scrolled view"""
+
+    def __init__(self, path, widgetclass, options):
+        Widget.__init__(self, path, widgetclass, options)
+        self.items = {}     # id -> [type, coords, options, tags]
+        self.lastid = 0
+        self.view = [0.0, 0.0]      # first fraction shown in x and y
+        return
+
+    def find(self, tag):
+        """Ids of the items tag names, a tag, an id or 'all'"""
+        if isinstance(tag, int) or (isinstance(tag, str) and tag.isdigit()):
+            return [int(tag)] if int(tag) in self.items else []
+        if tag == 'all':
+            return list(self.items)
+        return [i for i, item in self.items.items() if tag in item[3]]
+
+
+class RecordingTcl(object):
+    """Stands in for a root's Tcl interpreter, see the module comment.
+       calls lists every Tk command made as a tuple of its arguments"""
+
+    def __init__(self, interp, width=800, height=600):
+        self.interp = interp
+        self.width = width      # size of widgets not given one
+        self.height = height
+        self.calls = []
+        self.captures = []
+        self.widgets = {'.': Widget('.', 'toplevel', {})}
+        self.fonts = {}
+        self.tclcommands = set(interp.splitlist(interp.call('info',
+                                                            'commands')))
+        return
+
+    def __getattr__(self, name):
+        # createcommand, globalsetvar, mainloop and the like
+        return getattr(self.interp, name)
+
+    # --- conversions tkinter asks the interpreter for ---
+
+    def splitlist(self, value):
+        if isinstance(value, (tuple, list)):
+            return tuple(value)
+        return self.interp.splitlist(value)
+
+    def getint(self, value):
+        if isinstance(value, (int, float)):
+            return int(value)
+        return self.interp.getint(value)
+
+    def getdouble(self, value):
+        if isinstance(value, (int, float)):
+            return float(value)
+        return self.interp.getdouble(value)
+
+    def getboolean(self, value):
+        if isinstance(value, (int, bool)):
+            return bool(value)
+        return self.interp.getboolean(value)
+
+    # --- commands ---
+
+    def call(self, *args):
+        if len(args) == 1 and isinstance(args[0], tuple):
+            args = args[0]
+        command = args[0]
+        if command in self.tclcommands or command not in self.widgets and \
+                self.isTclCommand(command):
+            return self.interp.call(*args)
+        self.calls.append(args)
+        for capture in self.captures:
+            capture.append(args)
+        if command in self.widgets:
+            return self.widgetCommand(self.widgets[command], args[1:])
+        handler = getattr(self, 'tk_' + command.replace('::', '_'), None)
+        if handler is not None:
+            return handler(*args[1:])
+        if command in WIDGETCLASSES or (command.startswith('ttk::') and
+                                        command != 'ttk::style'):
+            return self.createWidget(command, args[1], args[2:])
+        return ''
+
+    def isTclCommand(self, command):
+        """Commands made since starting, e.g. tkinter callbacks"""
+        if self.interp.call('info', 'commands', command):
+            self.tclcommands.add(command)
+            return True
+        return False
+
+    def createWidget(self, widgetclass, path, args):
+        options = splitOptions(args)[1]
+        if widgetclass == 'canvas':
+            self.widgets[path] = Canvas(path, widgetclass, options)
+        else:
+            self.widgets[path] = Widget(path, widgetclass, options)
+        return path
+
+    def widgetCommand(self, widget, args):
+        if not args:
+            return ''
+        sub = args[0]
+        if sub in ('configure', 'config'):
+            return self.configure(widget.options, args[1:])
+        if sub == 'cget':
+            return widget.options.get(args[1], '')
+        if isinstance(widget, Canvas):
+            handler = getattr(self, 'canvas_' + sub, None)
+            if handler is not None:
+                return handler(widget, *args[1:])
+        if sub == 'get' and widget.widgetclass.endswith('scrollbar'):
+            return (0.0, 1.0)
+        return ''
+
+    def configure(self, options, args):
+        """Set options, or query them as Tk does"""
+        if len(args) == 1:
+            name = args[0]
+            return (name, name[1:], name[1:].title(), '',
+                    options.get(name, ''))
+        if not args:
+            return tuple((k, k[1:], k[1:].title(), '', v)
+                         for k, v in options.items())
+        options.update(splitOptions(args)[1])
+        return ''
+
+    def getSize(self, path, option):
+        widget = self.widgets.get(path)
+        default = self.width if option == '-width' else self.height
+        if widget is None:
+            return default
+        try:
+            size = int(float(widget.options.get(option, default)))
+        except (TypeError, ValueError):
+            return default
+        return size if size > 1 else default
+
+    def tk_destroy(self, *paths):
+        for path in paths:
+            for name in list(self.widgets):
+                if name == path or name.startswith(path + '.') or \
+                        path == '.':
+                    if name != '.':
+                        del self.widgets[name]
+        return ''
+
+    def tk_winfo(self, sub, *args):
+        if sub in ('width', 'reqwidth'):
+            return self.getSize(args[0], '-width')
+        if sub in ('height', 'reqheight'):
+            return self.getSize(args[0], '-height')
+        if sub in ('exists', 'ismapped', 'viewable'):
+            return int(args[0] in self.widgets)
+        if sub == 'class':
+            widget = self.widgets.get(args[0])
+            return widget.widgetclass.title() if widget else ''
+        if sub in ('toplevel', 'parent'):
+            return '.'
+        if sub == 'children':
+            return ()
+        if sub == 'screenwidth':
+            return 1920
+        if sub == 'screenheight':
+            return 1080
+        if sub == 'fpixels':
+            return float(args[-1])
+        if sub == 'pixels':
+            return int(float(args[-1]))
+        if sub == 'pointerxy':
+            return (0, 0)
+        return 0
+
+    # --- fonts, measured as if every character had the same width ---
+
+    def getFontSize(self, name):
+        options = self.fonts.get(name, {})
+        try:
+            return abs(int(options.get('-size', 12))) or 12
+        except (TypeError, ValueError):
+            return 12
+
+    def tk_font(self, sub, *args):
+        if sub == 'actual':
+            font = args[0]
+            if font in self.fonts:
+                options = self.fonts[font]
+                return tuple(v for k in options for v in (k, options[k]))
+            parts = self.splitlist(font)
+            family = parts[0] if parts else 'TkDefaultFont'
+            size = parts[1] if len(parts) > 1 else 12
+            return ('-family', family, '-size', size, '-weight', 'normal',
+                    '-slant', 'roman', '-underline', 0, '-overstrike', 0)
+        if sub == 'create':
+            name = args[0]
+            self.fonts[name] = splitOptions(args[1:])[1]
+            return name
+        if sub == 'configure':
+            if len(args) > 1 and len(args) % 2 == 1:
+                self.fonts.setdefault(args[0], {}).update(
+                    splitOptions(args[1:])[1])
+                return ''
+            return self.tk_font('actual', args[0])
+        if sub == 'delete':
+            for name in args:
+                self.fonts.pop(name, None)
+            return ''
+        if sub == 'measure':
+            return len(str(args[-1])) * max(1, round(
+                self.getFontSize(args[0]) * 0.6))
+        if sub == 'metrics':
+            size = self.getFontSize(args[0])
+            metrics = {'-ascent': size, '-descent': size // 4,
+                       '-linespace': size + size // 4, '-fixed': 1}
+            if isOption(args[-1]) and args[-1] != '-displayof':
+                return metrics[args[-1]]
+            return tuple(v for k in metrics for v in (k, metrics[k]))
+        if sub == 'families':
+            return ('Arial', 'Courier', 'Helvetica', 'Times')
+        if sub == 'names':
+            return tuple(self.fonts)
+        return ''
+
+    # --- canvases ---
+
+    def canvas_create(self, canvas, itemtype, *args):
+        coords, options = splitOptions(args)
+        if len(coords) == 1 and isinstance(coords[0], (tuple, list)):
+            coords = list(coords[0])
+        # Tk takes any unique abbreviation of an option, -tag is common
+        tags = options.pop('-tags', options.pop('-tag', ()))
+        if isinstance(tags, str):
+            tags = self.splitlist(tags)
+        canvas.lastid += 1
+        canvas.items[canvas.lastid] = [itemtype, [float(c) for c in coords],
+                                       options, list(tags)]
+        return canvas.lastid
+
+    def canvas_delete(self, canvas, *tags):
+        for tag in tags:
+            for item in canvas.find(tag):
+                del canvas.items[item]
+        return ''
+
+    def canvas_itemconfigure(self, canvas, tag, *args):
+        for item in canvas.find(tag):
+            options = canvas.items[item][2]
+            if len(args) < 2:
+                return self.configure(options, args)
+            options = dict(splitOptions(args)[1])
+            tags = options.pop('-tags', options.pop('-tag', None))
+            if tags is not None:
+                canvas.items[item][3] = list(self.splitlist(tags))
+            canvas.items[item][2].update(options)
+        return ''
+    canvas_itemconfig = canvas_itemconfigure
+
+    def canvas_itemcget(self, canvas, tag, option):
+        for item in canvas.find(tag):
+            return canvas.items[item][2].get(option, '')
+        return ''
+
+    def canvas_coords(self, canvas, tag, *coords):
+        items = canvas.find(tag)
+        if not coords:
+            return tuple(canvas.items[items[0]][1]) if items else ()
+        if len(coords) == 1 and isinstance(coords[0], (tuple, list)):
+            coords = coords[0]
+        for item in items[:1]:
+            canvas.items[item][1] = [float(c) for c in coords]
+        return ''
+
+    def canvas_move(self, canvas, tag, dx, dy):
+        for item in canvas.find(tag):
+            coords = canvas.items[item][1]
+            for i in range(len(coords)):
+                coords[i] += float(dx) if i % 2 == 0 else float(dy)
+        return ''
+
+    def canvas_find(self, canvas, how, *args):
+        if how == 'all':
+            return tuple(canvas.items)
+        if how == 'withtag':
+            return tuple(canvas.find(args[0]))
+        if how in ('overlapping', 'enclosed'):
+            x1, y1, x2, y2 = map(float, args[:4])
+            found = []
+            for item, (itemtype, coords, options, tags) in \
+                    canvas.items.items():
+                xs, ys = coords[0::2], coords[1::2]
+                if xs and min(xs) <= x2 and max(xs) >= x1 and \
+                        min(ys) <= y2 and max(ys) >= y1:
+                    found.append(item)
+            return tuple(found)
+        return ()
+
+    def canvas_gettags(self, canvas, tag):
+        for item in canvas.find(tag):
+            return tuple(canvas.items[item][3])
+        return ()
+
+    def canvas_addtag(self, canvas, newtag, how, *args):
+        for item in self.canvas_find(canvas, how, *args):
+            if newtag not in canvas.items[item][3]:
+                canvas.items[item][3].append(newtag)
+        return ''
+
+    def canvas_dtag(self, canvas, tag, *args):
+        remove = args[0] if args else tag
+        for item in canvas.find(tag):
+            tags = canvas.items[item][3]
+            if remove in tags:
+                tags.remove(remove)
+        return ''
+
+    def canvas_type(self, canvas, tag):
+        for item in canvas.find(tag):
+            return canvas.items[item][0]
+        return ''
+
+    def canvas_bbox(self, canvas, *tags):
+        xs, ys = [], []
+        for tag in tags:
+            for item in canvas.find(tag):
+                coords = canvas.items[item][1]
+                xs.extend(coords[0::2])
+                ys.extend(coords[1::2])
+        if not xs:
+            return ''
+        return (int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys)))
+
+    def getRegion(self, canvas):
+        """Width and height of the scroll region of a canvas"""
+        region = canvas.options.get('-scrollregion', '')
+        region = [float(v) for v in self.splitlist(region)]
+        if len(region) != 4:
+            return (self.getSize(canvas.path, '-width'),
+                    self.getSize(canvas.path, '-height'))
+        return (max(region[2] - region[0], 1), max(region[3] - region[1], 1))
+
+    def scroll(self, canvas, axis, args):
+        region = self.getRegion(canvas)[axis]
+        shown = self.getSize(canvas.path, ('-width', '-height')[axis])
+        shown = min(float(shown) / region, 1.0)
+        if not args:
+            first = canvas.view[axis]
+            return (first, min(first + shown, 1.0))
+        if args[0] == 'moveto':
+            first = float(args[1])
+        else:
+            step = shown if args[2].startswith('page') else 0.1 * shown
+            first = canvas.view[axis] + int(args[1]) * step
+        canvas.view[axis] = max(0.0, min(first, 1.0 - shown))
+        return ''
+
+    def canvas_xview(self, canvas, *args):
+        return self.scroll(canvas, 0, args)
+
+    def canvas_yview(self, canvas, *args):
+        return self.scroll(canvas, 1, args)
+
+    def canvas_canvasx(self, canvas, x, *args):
+        return float(x) + canvas.view[0] * self.getRegion(canvas)[0]
+
+    def canvas_canvasy(self, canvas, y, *args):
+        return float(y) + canvas.view[1] * self.getRegion(canvas)[1]
+
+
+class RecordingRoot(tk.Tk):
+    """A Tk root that needs no display, widgets made on it record what
+       they do instead of drawing. See the module comment"""
+
+    def __init__(self, width=800, height=600):
+        super().__init__(useTk=False)
+        self.tk = RecordingTcl(self.tk, width, height)
+        # as a Tk root does, for variables and fonts made without a master
+        if tk._support_default_root and tk._default_root is None:
+            tk._default_root = self
+        return
+
+    @contextmanager
+    def recording(self):
+        """Collect the Tk commands made in the with block into a list"""
+        calls = []
+        self.tk.captures.append(calls)
+        try:
+            yield calls
+        finally:
+            self.tk.captures.remove(calls)
+        return
+
+    def getItems(self, canvas):
+        """The items on a canvas widget, a dict of id -> [type, coords,
+           options, tags]"""
+        return self.tk.widgets[canvas._w].items
+
+
+def countOps(calls, canvas=None, ops=CANVAS_OPS):
+    """Count the canvas commands in a list of recorded calls, on one
+       canvas widget if given. returns: a Counter of command -> count"""
+    path = None if canvas is None else canvas._w
+    counts = Counter()
+    for args in calls:
+        if len(args) < 2 or not args[0].startswith('.'):
+            continue
+        if path is not None and args[0] != path:
+            continue
+        op = 'itemconfigure' if args[1] == 'itemconfig' else args[1]
+        if op in ops:
+            counts[op] += 1
+    return counts
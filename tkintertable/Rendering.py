@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""
+    Module implements helpers for drawing tables on a tkinter canvas.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from weakref import WeakKeyDictionary
+import tkinter.font as Font
+from Tracing import span
+
+
+class ItemPool(object):
+    """A set of canvas items of one type that are recycled between redraws
+       instead of being deleted and created again.
+       Items are placed by key, usually a (row, col) tuple. A redraw is
+       wrapped in begin() and end(): keys drawn in the last frame keep their
+       item, so cells that stay in view cost nothing, new keys take the
+       items of keys that left the view and any left over are hidden.
+       Only coordinates and options that differ from what the item already
+       shows are sent to Tk"""
+
+    def __init__(self, canvas, itemtype, tags=()):
+        self.canvas = canvas
+        self.itemtype = itemtype
+        self.tags = tuple(tags)
+        self.keys = {}      # key -> item
+        self.options = {}   # item -> options last sent to Tk
+        self.free = []      # hidden items ready for reuse
+        self.old = None     # keys of the last frame while drawing one
+        self.pending = []
+        return
+
+    def __len__(self):
+        return len(self.options)
+
+    def begin(self):
+        """Start drawing a new frame"""
+        if self.old is not None:
+            self.end()
+        self.old = self.keys
+        self.keys = {}
+        self.pending = []
+        return
+
+    def end(self):
+        """Finish a frame, giving unclaimed items to the new keys and
+           hiding the rest"""
+        if self.old is None:
+            return
+        leftover = list(self.old.values())
+        self.old = None
+        for key, coords, options in self.pending:
+            item = self.keys.get(key)
+            if item is None:
+                item = leftover.pop() if leftover else self.spare()
+            self.keys[key] = self.apply(item, coords, options)
+        self.pending = []
+        for item in leftover:
+            self.hide(item)
+        return
+
+    def place(self, key, coords, **options):
+        """Show an item for key at coords with the given options"""
+        if self.old is None:
+            item = self.keys.get(key)
+            if item is None:
+                item = self.spare()
+            self.keys[key] = self.apply(item, coords, options)
+            return
+        item = self.keys.get(key)
+        if item is None:
+            item = self.old.pop(key, None)
+        if item is None:
+            # wait until the frame ends to see which items are free
+            self.pending.append((key, coords, options))
+            return
+        self.keys[key] = self.apply(item, coords, options)
+        return
+
+    def get(self, key):
+        """The item shown for key, or None"""
+        return self.keys.get(key)
+
+    def release(self, key):
+        """Hide the item for key, if any"""
+        item = self.keys.pop(key, None)
+        if item is None and self.old is not None:
+            item = self.old.pop(key, None)
+        if item is not None:
+            self.hide(item)
+        if self.old is not None:
+            self.pending = [p for p in self.pending if p[0] != key]
+        return
+
+    def spare(self):
+        """A hidden item, None if one has to be created"""
+        if self.free:
+            return self.free.pop()
+        return None
+
+    def apply(self, item, coords, options):
+        """Send the changed coords and options of an item to Tk, creating
+           the item if needed. returns: the item"""
+        coords = tuple(coords)
+        if item is None:
+            create = getattr(self.canvas, 'create_' + self.itemtype)
+            item = create(*coords, tags=self.tags, **options)
+            last = dict(options)
+            last['coords'] = coords
+            self.options[item] = last
+            return item
+        last = self.options[item]
+        if last['coords'] != coords:
+            self.canvas.coords(item, *coords)
+            last['coords'] = coords
+        changed = {k: v for k, v in options.items() if last.get(k) != v}
+        if last.get('state') == 'hidden':
+            changed['state'] = 'normal'
+        if changed:
+            self.canvas.itemconfigure(item, **changed)
+            last.update(changed)
+        return item
+
+    def hide(self, item):
+        last = self.options[item]
+        if last.get('state') != 'hidden':
+            self.canvas.itemconfigure(item, state='hidden')
+            last['state'] = 'hidden'
+        self.free.append(item)
+        return
+
+    def hideAll(self):
+        """Hide every item, e.g. when the table is empty"""
+        self.end()
+        for item in self.keys.values():
+            self.hide(item)
+        self.keys = {}
+        return
+
+    def clear(self):
+        """Delete all the items from the canvas"""
+        if self.options:
+            self.canvas.delete(*self.options.keys())
+        self.keys = {}
+        self.options = {}
+        self.free = []
+        self.old = None
+        self.pending = []
+        return
+
+
+class Axis(object):
+    """Positions of the rows or columns of a table along one axis.
+       Each of count spans starting at start is size wide unless given
+       another size in sizes, a dict of index -> size. Only the spans with
+       their own size are stored, with the prefix sums of their extra size,
+       so an axis of a million rows of the default height costs nothing to
+       build. Lookups in both directions use bisect"""
+
+    def __init__(self, start, size, count, sizes=None):
+        self.start = start
+        self.size = size
+        self.count = count
+        self.sizes = {}
+        if sizes:
+            self.sizes = {i: s for i, s in sizes.items()
+                          if 0 <= i < count and s != size}
+        self.indices = sorted(self.sizes)
+        self.extra = [0]    # extra size of the spans before each index
+        self.starts = []    # position of each index with its own size
+        self.ends = []
+        for i in self.indices:
+            pos = start + i * size + self.extra[-1]
+            self.starts.append(pos)
+            self.ends.append(pos + self.sizes[i])
+            self.extra.append(self.extra[-1] + self.sizes[i] - size)
+        self.positions = None
+        return
+
+    def __len__(self):
+        return self.count
+
+    def getPosition(self, i):
+        """Start of span i, getPosition(count) is the end of the axis"""
+        j = bisect_left(self.indices, i)
+        return self.start + i * self.size + self.extra[j]
+
+    def getSize(self, i):
+        return self.sizes.get(i, self.size)
+
+    def getSpan(self, i):
+        """Start and end of span i"""
+        pos = self.getPosition(i)
+        return pos, pos + self.sizes.get(i, self.size)
+
+    def getEnd(self):
+        return self.start + self.count * self.size + self.extra[-1]
+
+    def getPositions(self):
+        """List of the start of every span and the end of the last"""
+        if self.positions is None:
+            pos = self.start
+            size = self.size
+            sizes = self.sizes
+            positions = [pos]
+            for i in range(self.count):
+                pos += sizes.get(i, size)
+                positions.append(pos)
+            self.positions = positions
+        return self.positions
+
+    def getIndex(self, x):
+        """Index of the span holding position x, this is below 0 or not
+           less than count when x is outside the axis"""
+        j = bisect_right(self.starts, x) - 1
+        if j < 0:
+            base, pos = 0, self.start
+        elif x < self.ends[j]:
+            return self.indices[j]
+        else:
+            base, pos = self.indices[j] + 1, self.ends[j]
+        return base + int((x - pos) // self.size)
+
+
+class TextWidths(object):
+    """Pixel widths of text in one font, taken from a table of glyph widths
+       so that Tk measures each character only once. Kerning is ignored,
+       which is close enough for fitting text into cells"""
+
+    # Tk root -> font -> TextWidths, shared by the tables of each root.
+    # A Font belongs to one Tk interpreter, and a root's entry goes when
+    # the root does
+    fonts = WeakKeyDictionary()
+
+    def __init__(self, font, root=None):
+        self.font = Font.Font(root=root, font=font)
+        self.widths = {}
+        return
+
+    @classmethod
+    def forFont(cls, font, widget):
+        """The widths of a font, e.g. ('Arial', 12), shared by the widgets
+           of the Tk root of widget"""
+        root = widget._root()
+        fonts = cls.fonts.get(root)
+        if fonts is None:
+            fonts = cls.fonts[root] = {}
+        widths = fonts.get(font)
+        if widths is None:
+            widths = fonts[font] = cls(font, root)
+        return widths
+
+    def measure(self, text):
+        """Width of text in pixels"""
+        widths = self.widths
+        try:
+            return sum(map(widths.__getitem__, text))
+        except KeyError:
+            for c in set(text).difference(widths):
+                widths[c] = self.font.measure(c)
+        return sum(map(widths.__getitem__, text))
+
+    def fit(self, text, width):
+        """The longest start of text that is at most width pixels wide"""
+        if self.measure(text) <= width:
+            return text
+        widths = self.widths
+        total = 0
+        for i, c in enumerate(text):
+            total += widths[c]
+            if total > width:
+                return text[:i]
+        return text
+
+
+class RedrawScheduler(object):
+    """Collects the parts of a table that need redrawing and draws them
+       once when Tk is next idle, so a run of edits costs one redraw.
+       Parts are single cells, row ranges, columns, the headers or the
+       whole table, a full redraw covers all the others. Inside batch()
+       nothing is drawn until the outermost batch exits. After close(),
+       when the table is destroyed, nothing is drawn at all"""
+
+    def __init__(self, table):
+        self.table = table
+        self.pending = None     # after_idle id
+        self.depth = 0          # nesting of batch()
+        self.closed = False
+        self.reset()
+        return
+
+    def reset(self):
+        self.full = False
+        self.header = False
+        self.regions = []       # (rows, cols) pairs, None means all
+        return
+
+    def isDirty(self):
+        return self.full or self.header or len(self.regions) > 0
+
+    def markAll(self):
+        """Redraw the whole table"""
+        self.full = True
+        self.regions = []
+        self.schedule()
+        return
+
+    def markCells(self, rows, cols):
+        """Redraw the cells at every row and column given"""
+        if not self.full:
+            self.regions.append((set(rows), set(cols)))
+        self.schedule()
+        return
+
+    def markCell(self, row, col):
+        self.markCells([row], [col])
+        return
+
+    def markRows(self, start, end):
+        """Redraw rows start to end-1 in all columns"""
+        if not self.full:
+            self.regions.append((set(range(start, end)), None))
+        self.schedule()
+        return
+
+    def markColumn(self, col):
+        """Redraw all rows of a column"""
+        if not self.full:
+            self.regions.append((None, {col}))
+        self.schedule()
+        return
+
+    def markHeader(self):
+        """Redraw the row and column headers"""
+        self.header = True
+        self.schedule()
+        return
+
+    def schedule(self):
+        if self.depth > 0 or self.pending is not None or self.closed:
+            return
+        self.pending = self.table.after_idle(self.idle)
+        return
+
+    def idle(self):
+        self.pending = None
+        self.flush()
+        return
+
+    def cancel(self):
+        if self.pending is not None:
+            self.table.after_cancel(self.pending)
+            self.pending = None
+        return
+
+    def close(self):
+        """Drop anything marked and stop drawing"""
+        self.cancel()
+        self.reset()
+        self.closed = True
+        return
+
+    def flush(self):
+        """Draw everything marked so far"""
+        self.cancel()
+        if self.closed or not self.isDirty():
+            return
+        full, header, regions = self.full, self.header, self.regions
+        self.reset()
+        table = self.table
+        if full:
+            table.redrawVisible()
+            return
+        if regions and table.visiblerows is not None:
+            visiblerows = table.visiblerows
+            visiblecols = table.visiblecols
+            with span('redraw.cells'):
+                for rows, cols in regions:
+                    if rows is not None:
+                        rows = [r for r in visiblerows if r in rows]
+                    else:
+                        rows = visiblerows
+                    if cols is not None:
+                        cols = [c for c in visiblecols if c in cols]
+                    else:
+                        cols = visiblecols
+                    for row in rows:
+                        for col in cols:
+                            table.redrawCell(row, col)
+        if header:
+            with span('redraw.headers'):
+                table.tablecolheader.redraw()
+                table.tablerowheader.redraw(
+                    align=table.align, showkeys=table.showkeynamesinheader)
+        return
+
+    @contextmanager
+    def batch(self):
+        """Defer all drawing until the with block exits"""
+        self.depth += 1
+        self.cancel()
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.flush()
+        return
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+    Module implements cached sort orders for the TableModel class.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from itertools import filterfalse
+from TableFormula import Formula
+
+# types whose values sort as numbers without conversion
+numerictypes = {float, int, bool, type(None)}
+
+
+def sortKey(value):
+    """Typed key for a cell in a column that is not all numbers,
+       numbers sort before text and blanks count as zero"""
+    if value is None or value == '':
+        return (0, 0.0)
+    try:
+        return (0, float(value))
+    except (ValueError, TypeError):
+        return (1, str(value))
+
+
+def getSortKeys(values):
+    """Sort keys for a list of cell values. Numeric columns give plain
+       floats, anything else gives (0, number) or (1, text) tuples.
+       returns: the keys and 'number' or 'mixed'"""
+    types = set(map(type, values))
+    if types <= numerictypes:
+        if type(None) in types:
+            values = [0.0 if v is None else v for v in values]
+        return values, 'number'
+    try:
+        return [0.0 if v is None or v == '' else float(v)
+                for v in values], 'number'
+    except (ValueError, TypeError):
+        return list(map(sortKey, values)), 'mixed'
+
+
+class SortIndex(object):
+    """Sort orders of the records in a ColumnStore.
+       Typed keys are cached per store slot for each column and each set
+       of sort columns, they are dropped when a column changes. Records
+       edited or added since the last sort are kept in dirty, so resorting
+       a list that this class sorted before only has to move those records
+       into place. A full sort is stable, records with equal keys keep
+       their order in the list sorted, moved records go after their
+       equals"""
+
+    # above this fraction of dirty records a full sort is cheaper
+    maxdirty = 0.01
+
+    def __init__(self, data, formulas=None):
+        self.data = data
+        self.formulas = formulas
+        self.keys = {}      # colname -> sort key per store slot
+        self.kinds = {}     # colname -> 'number' or 'mixed'
+        self.combined = {}  # colnames -> sort key tuple per store slot
+        self.dirty = set()
+        self.current = None     # (colnames, reverse) of the last sort
+        self.results = []       # lists returned by the last sort
+        data.addListener(self.dataChanged)
+        return
+
+    def getValue(self, name, colname):
+        """The value a cell sorts by, formulas give their result"""
+        cell = self.data.getCell(name, colname)
+        if isinstance(cell, dict):
+            if Formula.isFormula(cell) and self.formulas is not None:
+                return self.formulas.getValue(name, colname)
+            return ''
+        return cell
+
+    def getKeys(self, colname):
+        """Sort keys of a column for every store slot"""
+        if colname in self.keys:
+            return self.keys[colname]
+        values = self.data.getColumnValues(colname)
+        if any(issubclass(t, dict) for t in set(map(type, values))):
+            if self.formulas is not None:
+                self.formulas.evaluateColumn(colname, self.data.names)
+            values = [self.getValue(n, colname) if isinstance(v, dict) else v
+                      for n, v in zip(self.data.names, values)]
+        keys, kind = getSortKeys(values)
+        self.keys[colname] = keys
+        self.kinds[colname] = kind
+        return keys
+
+    def getKey(self, name, colnames):
+        """Sort key of one record, None if it does not fit the cached
+           key type of a column"""
+        key = []
+        for colname in colnames:
+            value = self.getValue(name, colname)
+            if self.kinds.get(colname) == 'mixed':
+                key.append(sortKey(value))
+                continue
+            if value is None or value == '':
+                key.append(0.0)
+                continue
+            try:
+                key.append(float(value))
+            except (ValueError, TypeError):
+                return None
+        if len(key) == 1:
+            return key[0]
+        return tuple(key)
+
+    def getSlotKeys(self, colnames):
+        """Sort keys of a set of columns for every store slot"""
+        if len(colnames) == 1:
+            return self.getKeys(colnames[0])
+        keys = self.combined.get(colnames)
+        if keys is None:
+            keys = self.combined[colnames] = list(
+                zip(*[self.getKeys(c) for c in colnames]))
+        return keys
+
+    def sort(self, names, colnames, reverse=False):
+        """Return names sorted by the cached keys of the columns, records
+           with equal keys stay in the order they have in names"""
+        keys = self.getSlotKeys(colnames)
+        index = self.data.index
+        known = list(filter(index.__contains__, names))
+        listkeys = list(map(keys.__getitem__, map(index.__getitem__, known)))
+        order = sorted(range(len(known)), key=listkeys.__getitem__,
+                       reverse=reverse)
+        # keep the list type, e.g. a RecordList
+        result = type(names)(map(known.__getitem__, order))
+        # names the store doesn't know about go last
+        if len(known) < len(names):
+            result.extend(filterfalse(index.__contains__, names))
+        return result
+
+    def resort(self, names, colnames, reverse=False):
+        """Move the dirty records of an already sorted list into place,
+           returns False if that can't be done"""
+        moved = list(filter(self.dirty.__contains__, names))
+        keys = [self.getKey(n, colnames) for n in moved]
+        if None in keys:
+            return False
+        if moved:
+            names[:] = filterfalse(self.dirty.__contains__, names)
+        for i, (name, key) in enumerate(zip(moved, keys)):
+            # binary search for the position after any equal keys
+            lo, hi = 0, len(names)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                k = self.getKey(names[mid], colnames)
+                if k is None:
+                    # put back what is left, the caller sorts it all
+                    names.extend(moved[i:])
+                    return False
+                if (key > k) if reverse else (key < k):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            names.insert(lo, name)
+        return True
+
+    def sortLists(self, lists, colnames, reverse=False):
+        """Sort several lists of record names by one or more columns.
+           Lists returned by the previous call with the same columns are
+           updated in place when only a few records changed since"""
+        colnames = tuple(colnames)
+        reverse = bool(reverse)
+        incremental = (self.current == (colnames, reverse) and
+                       len(self.dirty) <= self.maxdirty * len(self.data))
+        result = []
+        for names in lists:
+            if (incremental and any(names is r for r in self.results) and
+                    self.resort(names, colnames, reverse)):
+                result.append(names)
+            else:
+                result.append(self.sort(names, colnames, reverse))
+        self.current = (colnames, reverse)
+        self.results = result
+        self.dirty = set()
+        return result
+
+    def dropKeys(self, colname):
+        """Forget the cached keys that use a column"""
+        self.keys.pop(colname, None)
+        for colnames in list(self.combined):
+            if colname in colnames:
+                del self.combined[colnames]
+        return
+
+    def dropColumn(self, colname):
+        """Forget all that is cached for a column that was replaced or
+           removed, including the kind of its keys"""
+        self.dropKeys(colname)
+        self.kinds.pop(colname, None)
+        return
+
+    def dataChanged(self, recname=None, colname=None):
+        """Store listener, invalidates the cached keys of changed columns
+           and remembers the records that may be out of order"""
+        if recname is None:
+            if colname is None:
+                self.clear()
+            else:
+                self.dropColumn(colname)
+                self.current = None
+            return
+        if colname is None:
+            # records were added or removed so store slots have moved
+            self.keys = {}
+            self.combined = {}
+            if recname in self.data:
+                self.dirty.add(recname)
+            return
+        changed = [(recname, colname)]
+        if self.formulas is not None:
+            changed.extend(self.formulas.getDependents(recname, colname))
+        sortcols = self.current[0] if self.current is not None else ()
+        for rec, col in changed:
+            # the kind is kept, so getKey can still place edited records
+            self.dropKeys(col)
+            if col in sortcols:
+                self.dirty.add(rec)
+        return
+
+    def clear(self):
+        """Drop everything that is cached"""
+        self.keys = {}
+        self.kinds = {}
+        self.combined = {}
+        self.dirty = set()
+        self.current = None
+        self.results = []
+        return
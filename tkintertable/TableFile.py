@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+    Module implements the binary file format for tables and projects.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# A file holds one or more sheets, each a table model. The layout is
+#   header: magic, format version, offset and length of the index
+#   blocks: one zlib compressed block per column and sheet
+#   index: zlib compressed json listing the sheets, their settings and
+#          where the blocks of their columns are
+# A column block is a presence byte per record followed by either the
+# float values as doubles or, for any other column, a json list of the
+# values that are present. Blocks are only read when a column is first
+# used, through a memory map of the file.
+
+import os
+import json
+import mmap
+import pickle
+import struct
+import weakref
+import zlib
+from array import array
+from TableStorage import (Column, ColumnStore, DeferredColumn, LazyColumns,
+                          MISSING)
+from Tracing import traced
+
+MAGIC = b'TKTABLE\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sHHQQ')
+
+# table files open for reading, see TableWriter.close
+openfiles = weakref.WeakSet()
+
+
+def isTableFile(filename):
+    """True if filename is in this format rather than a pickle"""
+    with open(filename, 'rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+def encodeColumn(column, slots=None):
+    """Block contents for a Column, with its values in the order of slots
+       if given. returns: the kind of column and the block"""
+    if column.kind == 'float':
+        present = column.present
+        values = column.values
+        if slots is not None:
+            present = bytearray(map(present.__getitem__, slots))
+            values = array('d', map(values.__getitem__, slots))
+        return 'float', bytes(present) + values.tobytes()
+    values = column.values
+    if slots is not None:
+        values = list(map(values.__getitem__, slots))
+    if MISSING not in values:
+        present = b'\x01' * len(values)
+    else:
+        present = bytes(v is not MISSING for v in values)
+        values = [v for v in values if v is not MISSING]
+    text = json.dumps(values, separators=(',', ':'), default=str)
+    return 'object', present + text.encode('utf-8')
+
+
+@traced('io.readColumn')
+def decodeColumn(kind, count, block):
+    """Column for a block written by encodeColumn"""
+    column = Column.__new__(Column)
+    column.kind = kind
+    present = bytearray(block[:count])
+    if kind == 'float':
+        column.values = array('d')
+        column.values.frombytes(block[count:])
+        column.present = present
+        return column
+    values = iter(json.loads(block[count:].decode('utf-8')))
+    column.values = [next(values) if p else MISSING for p in present]
+    column.present = None
+    return column
+
+
+class TableWriter(object):
+    """Writes sheets to a new file, one column at a time so that saving
+       needs little memory beyond the tables themselves. The file is
+       written under a temporary name and moved into place when closed"""
+
+    def __init__(self, filename, level=1):
+        self.filename = filename
+        self.level = level
+        self.temp = filename + '.tmp'
+        self.fd = open(self.temp, 'wb')
+        self.fd.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        self.sheets = []
+        return
+
+    def writeBlock(self, data):
+        """Compress and write a block. returns: its offset and length"""
+        data = zlib.compress(data, self.level)
+        offset = self.fd.tell()
+        self.fd.write(data)
+        return [offset, len(data)]
+
+    @traced('io.writeSheet')
+    def addModel(self, name, model):
+        """Write a sheet holding a table model"""
+        names = list(model.reclist)
+        store = model.data
+        colnames = store.getColumnNames()
+        # dicts are kept as lists of pairs as json keys can only be text
+        colors = {k: list(v.items()) for k, v in model.colors.items()}
+        sheet = {'name': name,
+                 'count': len(names),
+                 'names': self.writeBlock(json.dumps(names).encode('utf-8')),
+                 'columnnames': model.columnNames,
+                 'columntypes': list(model.columntypes.items()),
+                 'columnlabels': list(model.columnlabels.items()),
+                 'colors': colors,
+                 'columns': []}
+        longest = model.longesttext
+        # records are written in reclist order
+        slots = None
+        if names != store.names:
+            slots = [store.index[n] for n in names]
+        for colname in colnames:
+            kind, block = encodeColumn(store.getColumn(colname), slots)
+            entry = {'name': colname, 'kind': kind,
+                     'block': self.writeBlock(block)}
+            if colname in longest:
+                entry['longest'] = longest[colname]
+            sheet['columns'].append(entry)
+        self.sheets.append(sheet)
+        return
+
+    def copyBlock(self, tablefile, block):
+        """Write a block of another file as it is. returns: its offset
+           and length here"""
+        offset, length = block
+        start = self.fd.tell()
+        self.fd.write(tablefile.map[offset:offset + length])
+        return [start, length]
+
+    def copySheet(self, tablefile, name, newname=None):
+        """Write a sheet of another file without decoding its columns"""
+        sheet = dict(tablefile.sheets[name])
+        if newname is not None:
+            sheet['name'] = newname
+        sheet['names'] = self.copyBlock(tablefile, sheet['names'])
+        sheet['columns'] = [dict(e, block=self.copyBlock(tablefile,
+                                                         e['block']))
+                            for e in sheet['columns']]
+        self.sheets.append(sheet)
+        return
+
+    def discard(self):
+        """Give up writing, removing the partly written file"""
+        self.fd.close()
+        os.remove(self.temp)
+        return
+
+    def close(self):
+        """Write the index and header and move the file into place"""
+        index = json.dumps({'sheets': self.sheets}, default=str)
+        offset, length = self.writeBlock(index.encode('utf-8'))
+        self.fd.seek(0)
+        self.fd.write(HEADER.pack(MAGIC, VERSION, 0, offset, length))
+        self.fd.close()
+        # a file that is mapped can't be replaced on Windows, so open
+        # copies of the old file are read into memory and let go first
+        path = os.path.realpath(self.filename)
+        for tablefile in list(openfiles):
+            if os.path.realpath(tablefile.filename) == path:
+                tablefile.close(keep=True)
+        os.replace(self.temp, self.filename)
+        return
+
+
+def writeTables(filename, sheets):
+    """Save table models to a file, sheets is a dict of name -> model"""
+    writer = TableWriter(filename)
+    try:
+        for name, model in sheets.items():
+            writer.addModel(name, model)
+    except BaseException:
+        writer.discard()
+        raise
+    writer.close()
+    return
+
+
+class TableFile(object):
+    """A file in this format opened for reading. Only the header and
+       index are read when it is opened, sheets are built when asked for
+       and their columns read when first used. The file stays open while
+       models built from it are in use, close it once they are done with
+       or use it as a context manager.
+       delete: remove the file when it is closed, for temporary files"""
+
+    def __init__(self, filename, delete=False):
+        self.filename = filename
+        self.delete = delete
+        self.fd = open(filename, 'rb')
+        self.map = None
+        try:
+            self.map = mmap.mmap(self.fd.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            magic, version, flags, offset, length = HEADER.unpack(
+                self.map[:HEADER.size])
+            if magic != MAGIC:
+                raise ValueError('{0} is not a table file'.format(filename))
+            if version > VERSION:
+                raise ValueError('{0} was written by a newer version'.format(
+                    filename))
+            self.version = version
+            index = json.loads(
+                self.readBlock([offset, length]).decode('utf-8'))
+        except BaseException:
+            self.close()
+            raise
+        self.sheets = {s['name']: s for s in index['sheets']}
+        openfiles.add(self)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def close(self, keep=False):
+        """Release the file and its memory map. keep: read the file into
+           memory first, so that columns not used yet can still be read"""
+        if self.fd is None:
+            return
+        data = None
+        if self.map is not None:
+            if keep:
+                data = self.map[:]
+            self.map.close()
+        self.map = data
+        self.fd.close()
+        self.fd = None
+        openfiles.discard(self)
+        if self.delete:
+            os.remove(self.filename)
+        return
+
+    def getSheetNames(self):
+        return list(self.sheets.keys())
+
+    def readBlock(self, block):
+        if self.map is None:
+            raise ValueError('{0} is closed'.format(self.filename))
+        offset, length = block
+        return zlib.decompress(self.map[offset:offset + length])
+
+    def loadStore(self, sheet):
+        """A ColumnStore for a sheet whose columns are read when used"""
+        names = json.loads(self.readBlock(sheet['names']).decode('utf-8'))
+        count = len(names)
+        store = ColumnStore()
+        store.names = names
+        store.index = dict(zip(names, range(count)))
+        columns = LazyColumns()
+        for entry in sheet['columns']:
+            def load(kind=entry['kind'], block=entry['block']):
+                return decodeColumn(kind, count, self.readBlock(block))
+            dict.__setitem__(columns, entry['name'], DeferredColumn(load))
+        store.columns = columns
+        return store, names
+
+    @traced('io.loadSheet')
+    def loadModel(self, name, model=None):
+        """Build the table model of a sheet, or set up model with it"""
+        from TableModels import TableModel
+        sheet = self.sheets[name]
+        store, names = self.loadStore(sheet)
+        colors = {k: dict(map(tuple, v)) for k, v in sheet['colors'].items()}
+        newdict = {'columnnames': sheet['columnnames'],
+                   'columntypes': dict(map(tuple, sheet['columntypes'])),
+                   'columnlabels': dict(map(tuple, sheet['columnlabels'])),
+                   'colors': colors,
+                   'reclist': names,
+                   # columnnames is already in order
+                   'columnorder': None}
+        if model is None:
+            model = TableModel()
+        model.setupModel(newdict, store=store)
+        # saves scanning every column to fit the column widths
+        for entry in sheet['columns']:
+            if 'longest' in entry:
+                model.longesttext[entry['name']] = entry['longest']
+        return model
+
+    def loadAll(self):
+        """Build the models of all the sheets. returns: a dict of them"""
+        return {name: self.loadModel(name) for name in self.sheets}
+
+
+def readTables(filename):
+    """Load the sheets of a file in this format or of an older pickle.
+       returns: a dict of sheet name -> table model for this format, the
+       pickled dict for a pickle"""
+    if isTableFile(filename):
+        return TableFile(filename).loadAll()
+    with open(filename, 'rb') as fd:
+        return pickle.load(fd)
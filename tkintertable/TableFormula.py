@@ -23,6 +23,10 @@
 # import tkinter as tk
 # from types import *
 import re
+import ast
+import operator
+from itertools import repeat
+from Tracing import traced
 
 
 class Formula(object):
@@ -68,9 +72,11 @@ class Formula(object):
             if i == '':
                 vals.append(i)
             else:
+                # only literals are read, never arbitrary code
                 try:
-                    vals.append(eval(i))
-                except NameError:
+                    vals.append(ast.literal_eval(i.strip()))
+                except (ValueError, SyntaxError, TypeError, MemoryError,
+                        RecursionError):
                     vals.append(0)
 
         # print ops, vals
@@ -111,36 +117,379 @@ class Formula(object):
     def doFormula(cls, cellformula, data):
         """Evaluate the formula for a cell and return the result
            takes a formula dict or just the string as input"""
-        # if type(cellformula) == dict:
-        if isinstance(cellformula, dict):
-            cellformula = cellformula['formula']
+        # a one off engine, so it must not stay registered with the data
+        return FormulaEngine(data, watch=False).evaluate(cellformula)
 
-        vals = []
-        cells, ops = cls.readExpression(cellformula)
-
-        # get cell records into their values
-        for i in cells:
-            if isinstance(i, list):
-                recname, col = i
-                if recname in data:
-                    if col in data[recname]:
-                        v = data[recname][col]
-                        if cls.isFormula(v):
-                            # recursive
-                            v = cls.doFormula(cls.getFormula(v), data)
-                        vals.append(v)
-                    else:
-                        return ''
-                else:
-                    return ''
-            elif i == '' or isinstance(i, (int, float)):
-                vals.append(i)
+    @classmethod
+    def parse(cls, expr):
+        """Parse a formula string once into a ParsedFormula, results are
+           cached by the formula text"""
+        if isinstance(expr, dict):
+            expr = expr['formula']
+        if expr not in cls.parsed:
+            cls.parsed[expr] = ParsedFormula(expr)
+        return cls.parsed[expr]
+
+
+# cache of formula text -> ParsedFormula, shared by all models
+Formula.parsed = {}
+
+# value shown in cells that take part in a circular reference
+CYCLE = '#CYCLE'
+
+binaryops = {ast.Add: operator.add, ast.Sub: operator.sub,
+             ast.Mult: operator.mul, ast.Div: operator.truediv}
+unaryops = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+
+class ParsedFormula(object):
+    """The syntax tree and cell references of one formula string.
+       The grammar is numbers, cell references written as [recname, colname],
+       the operators + - * / and parentheses. The tree is checked against
+       this grammar and compiled into closures, so evaluating never goes
+       through eval and nothing but arithmetic can run.
+       func takes the operand values in the order of refs and returns the
+       result, batch does the same for whole lists of operand values"""
+
+    # cache of formula template -> compiled closures
+    compiled = {}
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.refs = []
+        self.template = None
+        try:
+            self.tree = ast.parse(expr.strip(), mode='eval').body
+            self.template = self.check(self.tree)
+        except (SyntaxError, ValueError, TypeError, MemoryError,
+                RecursionError):
+            # not a formula we can read, its cell shows empty
+            self.tree = None
+            self.refs = []
+        if self.tree is None:
+            return
+        # the closures only depend on the template, so fill down copies
+        # of a formula share them
+        if self.template not in self.compiled:
+            self.compiled[self.template] = (self.compile(self.tree),
+                                            self.compileBatch(self.tree))
+        self.func, self.batch = self.compiled[self.template]
+        return
+
+    def check(self, node):
+        """Make sure only the formula grammar is used and collect the
+           referenced cells. Returns a template string that is the same for
+           formulas differing only in the records they refer to, such as
+           those made by fill down"""
+        if isinstance(node, ast.BinOp) and type(node.op) in binaryops:
+            left = self.check(node.left)
+            right = self.check(node.right)
+            return '({0}{1}{2})'.format(left, type(node.op).__name__, right)
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in unaryops:
+            operand = self.check(node.operand)
+            return '({0}{1})'.format(type(node.op).__name__, operand)
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            if all(isinstance(e, ast.Constant) for e in node.elts):
+                ref = tuple(e.value for e in node.elts)
             else:
+                ref = tuple(ast.literal_eval(node))
+            if (len(ref) != 2 or
+                    not all(isinstance(i, (str, int, float)) for i in ref)):
+                raise ValueError('bad cell reference')
+            if ref not in self.refs:
+                self.refs.append(ref)
+            node.ref = self.refs.index(ref)
+            return '[{0}:{1!r}]'.format(node.ref, ref[1])
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)):
+                raise ValueError('bad constant')
+            return repr(node.value)
+        elif isinstance(node, ast.Name):
+            return '0'
+        raise ValueError('not allowed in a formula')
+
+    def compile(self, node):
+        """Turn a checked tree into a closure taking the operand values"""
+        if isinstance(node, ast.BinOp):
+            func = binaryops[type(node.op)]
+            left = self.compile(node.left)
+            right = self.compile(node.right)
+            return lambda v: func(left(v), right(v))
+        elif isinstance(node, ast.UnaryOp):
+            func = unaryops[type(node.op)]
+            operand = self.compile(node.operand)
+            return lambda v: func(operand(v))
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            return operator.itemgetter(node.ref)
+        # unknown names count as zero, as they always have
+        const = node.value if isinstance(node, ast.Constant) else 0
+        return lambda v: const
+
+    def compileBatch(self, node):
+        """Turn a checked tree into a closure taking one list of values per
+           operand and returning the list of results. Every operator is
+           applied to the whole lists with a single map call"""
+        if isinstance(node, ast.BinOp):
+            func = binaryops[type(node.op)]
+            left = self.compileBatch(node.left)
+            right = self.compileBatch(node.right)
+            return lambda cols, n: map(func, left(cols, n), right(cols, n))
+        elif isinstance(node, ast.UnaryOp):
+            func = unaryops[type(node.op)]
+            operand = self.compileBatch(node.operand)
+            return lambda cols, n: map(func, operand(cols, n))
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            index = node.ref
+            return lambda cols, n: cols[index]
+        const = node.value if isinstance(node, ast.Constant) else 0
+        return lambda cols, n: repeat(const, n)
+
+    def evaluate(self, values):
+        """Compute the result from the operand values, in refs order"""
+        return self.func(values)
+
+    def evaluateMany(self, columns, size):
+        """Compute size results at once, columns holds a list of operand
+           values for every ref"""
+        return list(self.batch(columns, size))
+
+
+class FormulaEngine(object):
+    """Evaluates the formula cells of a table.
+       Formulas are parsed once and their results cached. A dependency graph
+       keyed by (recname, colname) records which formulas use which cells,
+       so that a change only clears the cached values downstream of it.
+       Evaluation uses an explicit stack so long chains of formulas can't
+       overflow the interpreter stack, and circular references show CYCLE.
+       watch: follow changes to the data, without it the cached results
+       are only right until the data changes"""
+
+    def __init__(self, data, watch=True):
+        self.data = data
+        self.values = {}        # formula cell -> cached result
+        self.formulas = {}      # formula cell -> ParsedFormula
+        self.dependents = {}    # cell -> set of formula cells using it
+        self.cycles = set()
+        # a plain dict of dicts works too, but is not watched for changes
+        self.columnar = hasattr(data, 'addListener')
+        if self.columnar and watch:
+            data.addListener(self.cellChanged)
+        return
+
+    def getCell(self, key):
+        """Raw content of a cell or None if there is no such cell"""
+        recname, colname = key
+        try:
+            if self.columnar:
+                return self.data.getCell(recname, colname)
+            return self.data[recname][colname]
+        except (KeyError, TypeError):
+            return None
+
+    def register(self, key):
+        """Parse the formula at key and add its edges to the graph,
+           returns None if the cell does not hold a formula"""
+        if key in self.formulas:
+            return self.formulas[key]
+        cell = self.getCell(key)
+        if not Formula.isFormula(cell):
+            return None
+        parsed = Formula.parse(cell)
+        self.formulas[key] = parsed
+        for ref in parsed.refs:
+            self.dependents.setdefault(ref, set()).add(key)
+        return parsed
+
+    def forget(self, key):
+        """Remove a formula cell from the graph"""
+        parsed = self.formulas.pop(key, None)
+        self.values.pop(key, None)
+        self.cycles.discard(key)
+        if parsed is None:
+            return
+        for ref in parsed.refs:
+            users = self.dependents.get(ref)
+            if users is not None:
+                users.discard(key)
+                if not users:
+                    del self.dependents[ref]
+        return
+
+    def getValue(self, recname, colname):
+        """Get the value of the formula at this cell, computing it and any
+           formulas it depends on that are not cached yet"""
+        key = (recname, colname)
+        if key in self.values:
+            return self.values[key]
+        stack = [key]
+        visiting = set()
+        while stack:
+            k = stack[-1]
+            if k in self.values:
+                stack.pop()
+                continue
+            parsed = self.register(k)
+            if parsed is None:
+                stack.pop()
+                continue
+            if k in visiting:
+                # everything this formula uses has been computed
+                self.values[k] = self.compute(k, parsed)
+                visiting.discard(k)
+                stack.pop()
+                continue
+            visiting.add(k)
+            for ref in parsed.refs:
+                if ref in self.values:
+                    continue
+                if ref in visiting:
+                    self.cycles.add(ref)
+                    continue
+                if self.register(ref) is not None:
+                    stack.append(ref)
+        return self.values.get(key, '')
+
+    def compute(self, key, parsed):
+        """Compute one formula from the cached values of its references"""
+        if parsed.tree is None:
+            return ''
+        values = []
+        for ref in parsed.refs:
+            if ref in self.formulas:
+                v = self.values.get(ref, CYCLE)
+            else:
+                v = self.getCell(ref)
+            if v == CYCLE:
+                if key is not None:
+                    self.cycles.add(key)
+                return CYCLE
+            if v is None or v == '':
+                return ''
+            try:
+                values.append(float(v))
+            except (ValueError, TypeError):
                 return ''
-        if vals == '':
+        try:
+            result = parsed.evaluate(values)
+        except (ZeroDivisionError, OverflowError, TypeError):
             return ''
-        # print vals, ops
-        expr = cls.doExpression(vals, ops)
-        # print 'expr', expr
-        result = eval(expr)
         return str(round(result, 3))
+
+    @traced('formula.evaluate')
+    def evaluate(self, cellformula):
+        """Evaluate a formula that is not stored in a cell, e.g. from the
+           formula dialog, using the cached values of any formulas it uses"""
+        parsed = Formula.parse(cellformula)
+        for ref in parsed.refs:
+            if Formula.isFormula(self.getCell(ref)):
+                self.getValue(*ref)
+        return self.compute(None, parsed)
+
+    @traced('formula.column')
+    def evaluateColumn(self, colname, names):
+        """Compute the uncached formulas of a column for the given records.
+           Formulas that only differ in the records they refer to, as made
+           by fill down, are evaluated together with one batch call per
+           operator. Formulas using other formulas or non numeric cells go
+           through getValue one at a time"""
+        groups = {}
+        for recname in names:
+            key = (recname, colname)
+            if key in self.values:
+                continue
+            parsed = self.register(key)
+            if parsed is None:
+                continue
+            if parsed.tree is None:
+                self.values[key] = ''
+                continue
+            groups.setdefault(parsed.template, []).append((key, parsed))
+        for items in groups.values():
+            self.evaluateGroup(items)
+        return
+
+    def getCells(self, refs):
+        """Raw contents of several cells in the same field"""
+        if self.columnar:
+            try:
+                return self.data.getColumnValues(refs[0][1],
+                                                 [r[0] for r in refs])
+            except KeyError:
+                pass
+        return [self.getCell(r) for r in refs]
+
+    def evaluateGroup(self, items):
+        """Evaluate (key, parsed) pairs sharing one template in a batch"""
+        parsed = items[0][1]
+        cells = [self.getCells([p.refs[i] for k, p in items])
+                 for i in range(len(parsed.refs))]
+        keys = []
+        operands = []
+        for (key, p), row in zip(items, zip(*cells) if cells else
+                                 [()] * len(items)):
+            try:
+                operands.append(tuple(map(float, row)))
+            except (ValueError, TypeError):
+                # formulas, blanks and text are left to the scalar path
+                self.getValue(*key)
+                continue
+            keys.append(key)
+        if not keys:
+            return
+        try:
+            results = parsed.evaluateMany(list(zip(*operands)), len(keys))
+        except (ZeroDivisionError, OverflowError, TypeError):
+            # let the scalar path decide which cells fail
+            for key in keys:
+                self.values[key] = self.compute(key, self.formulas[key])
+            return
+        for key, result in zip(keys, results):
+            self.values[key] = str(round(result, 3))
+        return
+
+    def getDependents(self, recname, colname):
+        """All formula cells that depend directly or indirectly on a cell"""
+        found = set()
+        todo = [(recname, colname)]
+        while todo:
+            k = todo.pop()
+            for d in self.dependents.get(k, ()):
+                if d not in found:
+                    found.add(d)
+                    todo.append(d)
+        return found
+
+    def cellChanged(self, recname=None, colname=None):
+        """Store listener, clears the cached values affected by a change"""
+        if not self.formulas:
+            return
+        if recname is None and colname is None:
+            self.clear()
+            return
+        if recname is None:
+            keys = [k for k in self.dependents if k[1] == colname]
+            keys += [k for k in self.formulas if k[1] == colname]
+        elif colname is None:
+            keys = [k for k in self.dependents if k[0] == recname]
+            keys += [k for k in self.formulas if k[0] == recname]
+        else:
+            keys = [(recname, colname)]
+        dirty = set()
+        for key in keys:
+            dirty.add(key)
+            dirty.update(self.getDependents(*key))
+        for key in dirty:
+            self.values.pop(key, None)
+            self.cycles.discard(key)
+        # the changed cells themselves may no longer be the same formula
+        for key in keys:
+            self.forget(key)
+        return
+
+    def clear(self):
+        """Drop all cached values and the dependency graph"""
+        self.values = {}
+        self.formulas = {}
+        self.dependents = {}
+        self.cycles = set()
+        return
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+    Module implements undo and redo of the changes made to a table model.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# A change is a tuple of the name of an action and its arguments, e.g.
+# ('cell', recname, colname, value). The model records, before each edit,
+# the change that would take it back. Applying a change performs it and
+# returns the change that reverses it, so undo and redo are the same
+# operation run on different stacks. Only what an edit touched is kept:
+# the old value of a cell, the values of deleted rows or of a deleted
+# column, or the record order before a sort.
+
+from collections import deque
+from contextlib import contextmanager
+from TableStorage import MISSING, RecordList
+
+
+def insertNames(names, added, positions):
+    """A RecordList of names with each of added put back at the position it
+       had before being removed"""
+    pairs = sorted(zip(positions, added), key=lambda p: p[0])
+    if len(pairs) == 1:
+        names = RecordList(names)
+        names.insert(pairs[0][0], pairs[0][1])
+        return names
+    result = []
+    rest = iter(names)
+    for position, name in pairs:
+        while len(result) < position:
+            result.append(next(rest))
+        result.append(name)
+    result.extend(rest)
+    return RecordList(result)
+
+
+class Journal(object):
+    """Undo and redo for a TableModel. Entries are groups of changes, a
+       single edit or every edit made inside group(), and at most size of
+       them are kept, the oldest being dropped first"""
+
+    def __init__(self, model, size=100):
+        self.model = model
+        self.undos = deque(maxlen=size)
+        self.redos = deque(maxlen=size)
+        self.current = None     # changes of the group being recorded
+        self.depth = 0          # nesting of group()
+        self.replaying = False
+        self.actions = {'cell': self.setCell,
+                        'cells': self.setCells,
+                        'color': self.setColor,
+                        'colors': self.setColors,
+                        'order': self.setOrder,
+                        'columns': self.setColumnOrder,
+                        'label': self.setLabel,
+                        'rename': self.rename,
+                        'dropRows': self.dropRows,
+                        'addRows': self.addRows,
+                        'dropColumn': self.dropColumn,
+                        'addColumn': self.addColumn}
+        return
+
+    def clear(self):
+        self.undos.clear()
+        self.redos.clear()
+        return
+
+    def canUndo(self):
+        return len(self.undos) > 0
+
+    def canRedo(self):
+        return len(self.redos) > 0
+
+    def record(self, change):
+        """Note the change that reverses an edit about to be made"""
+        if self.replaying:
+            return
+        if self.depth > 0:
+            self.current.append(change)
+            return
+        self.undos.append([change])
+        self.redos.clear()
+        return
+
+    @contextmanager
+    def group(self):
+        """Record every edit made in the with block as one entry"""
+        if self.depth == 0:
+            self.current = []
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                if self.current:
+                    self.undos.append(self.current)
+                    self.redos.clear()
+                self.current = None
+        return
+
+    def undo(self):
+        """Reverse the last entry. returns: False if there was none"""
+        return self.replay(self.undos, self.redos)
+
+    def redo(self):
+        """Make the last undone entry again"""
+        return self.replay(self.redos, self.undos)
+
+    def replay(self, source, target):
+        if not source:
+            return False
+        changes = source.pop()
+        # the reversals come out last change first, so replaying them in
+        # reverse makes the first change first again
+        reverse = []
+        self.replaying = True
+        try:
+            for change in reversed(changes):
+                reverse.append(self.actions[change[0]](*change[1:]))
+        finally:
+            self.replaying = False
+        target.append(reverse)
+        return True
+
+    # --- recording helpers for edits whose reversal needs their data ---
+
+    def recordRows(self, names):
+        """Record records about to be deleted"""
+        if not self.replaying:
+            self.record(self.captureRows(names))
+        return
+
+    def recordColumn(self, colname):
+        """Record a column about to be deleted"""
+        if not self.replaying:
+            self.record(self.captureColumn(colname))
+        return
+
+    def captureRows(self, names):
+        """The change that adds back records about to be deleted"""
+        model = self.model
+        store = model.data
+        names = [n for n in names if n in store]
+        positions = [model.reclist.index(n) for n in names]
+        filtered = None
+        if model.filteredrecs is not None:
+            shown = model.filteredrecs
+            filtered = [shown.index(n) if n in shown else None
+                        for n in names]
+        columns = {c: store.getColumnValues(c, names, MISSING)
+                   for c in store.getColumnNames()}
+        colors = {key: {n: model.colors[key][n] for n in names
+                        if n in model.colors[key]}
+                  for key in model.colors}
+        heights = {n: model.rowheights[n] for n in names
+                   if n in model.rowheights}
+        return ('addRows', names, positions, filtered, columns, colors,
+                heights)
+
+    def captureColumn(self, colname):
+        """The change that adds back a column about to be deleted"""
+        model = self.model
+        store = model.data
+        values = None
+        if store.getColumn(colname) is not None:
+            values = store.getColumnValues(colname, None, MISSING)
+        return ('addColumn', colname, model.columnNames.index(colname),
+                model.columnlabels.get(colname, colname),
+                model.columntypes.get(colname, 'text'), list(store.names),
+                values)
+
+    # --- actions, each returns the change that reverses it ---
+
+    def setCell(self, recname, colname, value):
+        store = self.model.data
+        change = ('cell', recname, colname,
+                  store.getCell(recname, colname, MISSING))
+        if value is MISSING:
+            store.deleteCell(recname, colname)
+        else:
+            store.setCell(recname, colname, value)
+        return change
+
+    def setCells(self, colname, names, values):
+        store = self.model.data
+        change = ('cells', colname, names,
+                  store.getColumnValues(colname, names, MISSING))
+        store.setCells(colname, names, values)
+        return change
+
+    def setColor(self, key, recname, colname, color):
+        colors = self.model.colors[key]
+        cells = colors.setdefault(recname, {})
+        change = ('color', key, recname, colname, cells.get(colname, MISSING))
+        if color is MISSING:
+            cells.pop(colname, None)
+        else:
+            cells[colname] = color
+        if not cells:
+            del colors[recname]
+        self.model.notify('cell', recname, colname)
+        return change
+
+    def setColors(self, colors):
+        model = self.model
+        change = ('colors', model.colors)
+        model.colors = colors
+        model.notify('structure')
+        return change
+
+    def setOrder(self, reclist, sortkey, sortkeys):
+        """Put the records back in an earlier order, a filtered subset
+           keeps its records in the same order"""
+        model = self.model
+        change = ('order', model.reclist, model.sortkey, model.sortkeys)
+        model.reclist = reclist
+        model.sortkey = sortkey
+        model.sortkeys = sortkeys
+        if model.filteredrecs is not None:
+            shown = set(model.filteredrecs)
+            model.filteredrecs = RecordList(n for n in reclist if n in shown)
+        model.notify('structure')
+        return change
+
+    def setColumnOrder(self, columnnames):
+        model = self.model
+        change = ('columns', model.columnNames)
+        model.columnNames = columnnames
+        model.notify('structure')
+        return change
+
+    def setLabel(self, colname, label):
+        model = self.model
+        change = ('label', colname, model.columnlabels[colname])
+        model.columnlabels[colname] = label
+        model.notify('column', colname=colname)
+        return change
+
+    def rename(self, recname, newname):
+        self.model.renameRecord(recname, newname)
+        return ('rename', newname, recname)
+
+    def dropRows(self, names):
+        change = self.captureRows(names)
+        self.model.deleteRecords(names)
+        return change
+
+    def addRows(self, names, positions, filtered, columns, colors, heights):
+        model = self.model
+        model.data.appendColumns(names, columns)
+        model.reclist = insertNames(model.reclist, names, positions)
+        if filtered is not None and model.filteredrecs is not None:
+            shown = [(p, n) for p, n in zip(filtered, names) if p is not None]
+            model.filteredrecs = insertNames(model.filteredrecs,
+                                             [n for p, n in shown],
+                                             [p for p, n in shown])
+        for key in colors:
+            model.colors.setdefault(key, {}).update(colors[key])
+        model.rowheights.update(heights)
+        model.notify('structure')
+        return ('dropRows', names)
+
+    def dropColumn(self, colname):
+        change = self.captureColumn(colname)
+        model = self.model
+        model.columnNames.remove(colname)
+        model.columnlabels.pop(colname, None)
+        model.columntypes.pop(colname, None)
+        model.data.removeColumn(colname)
+        model.notify('structure')
+        return change
+
+    def addColumn(self, colname, position, label, coltype, names, values):
+        model = self.model
+        model.columnNames.insert(position, colname)
+        model.columnlabels[colname] = label
+        model.columntypes[colname] = coltype
+        if values is not None:
+            model.data.setColumnValues(colname, names, values)
+        model.notify('structure')
+        return ('dropColumn', colname)
@@ -23,11 +23,15 @@
     Upated for Python 3 and pylint by Paul Jefferies, January 2018
 """
 
-import operator
 import copy
 import pickle
-from TableFormula import Formula
+from itertools import compress
+from TableFormula import Formula, FormulaEngine
+from TableJournal import Journal
+from TableStorage import ColumnStore, RecordList, SizeDict, MISSING
+from Sorting import SortIndex
 import Filtering
+from Tracing import traced
 # import types
 # import string
 
@@ -38,6 +42,9 @@ class TableModel(object):
     keywords = {'columnnames': 'columnNames', 'columntypes': 'columntypes',
                 'columnlabels': 'columnlabels', 'columnorder': 'columnOrder',
                 'colors': 'colors'}
+    # storage used for the records, any class with the ColumnStore
+    # interface can be plugged in here
+    storeclass = ColumnStore
 
     def __init__(self, newdict=None, rows=None, columns=None):
         """Constructor"""
@@ -45,21 +52,29 @@ class TableModel(object):
         self.setupModel(newdict, rows, columns)
         return
 
-    def setupModel(self, newdict, rows=None, columns=None):
-        """Create table model"""
+    def setupModel(self, newdict, rows=None, columns=None, store=None):
+        """Create table model
+           store: a ColumnStore already holding the records, newdict then
+           only gives the other settings"""
         if newdict is not None:
-            self.data = copy.deepcopy(newdict)
+            newdict = dict(newdict)
             for k in self.keywords:
-                if k in self.data:
-                    self.__dict__[self.keywords[k]] = self.data[k]
-                    del self.data[k]
+                if k in newdict:
+                    self.__dict__[self.keywords[k]] = copy.deepcopy(
+                        newdict.pop(k))
             # read in the record list order
-            if 'reclist' in self.data:
-                temp = self.data['reclist']
-                del self.data['reclist']
-                self.reclist = temp
+            if 'reclist' in newdict:
+                self.reclist = RecordList(newdict.pop('reclist'))
             else:
-                self.reclist = list(self.data.keys())
+                self.reclist = RecordList(newdict.keys())
+            if store is not None:
+                self.data = store
+            else:
+                # the store copies any dict cells so nothing is shared
+                self.data = self.storeclass(newdict)
+            self.formulas = FormulaEngine(self.data)
+            self.sorting = SortIndex(self.data, self.formulas)
+            self.data.addListener(self.dataChanged)
         else:
             # just make a new empty model
             self.createEmptyModel()
@@ -69,10 +84,9 @@ class TableModel(object):
         # restore last column order
         if hasattr(self, 'columnOrder') and self.columnOrder is not None:
             self.columnNames = []
-            for i in self.columnOrder:
-                # self.columnNames.append(self.columnOrder[i])
-                self.columnNames.append(i)
-                # i = i + 1    # WTF???
+            # columnorder maps position -> column name
+            for i in sorted(self.columnOrder):
+                self.columnNames.append(self.columnOrder[i])
         self.defaulttypes = ['text', 'number']
         # setup default display for column types
         self.default_display = {'text': 'showstring',
@@ -82,6 +96,9 @@ class TableModel(object):
             self.sortkey = self.columnNames[0]
         else:
             self.sortkey = None
+        self.sortkeys = []
+        self.longesttext = {}
+        self.lastintkey = None
         # add rows and cols if they are given in the constructor
         if newdict is None:
             if rows is not None:
@@ -89,11 +106,17 @@ class TableModel(object):
             if columns is not None:
                 self.autoAddColumns(columns)
         self.filteredrecs = None
+        # changes to the old data can't be undone
+        self.journal.clear()
+        self.notify('structure')
         return
 
     def initialiseFields(self):
         """Create base fields, some of which are not saved"""
         self.data = None    # holds the table dict
+        self.formulas = None    # evaluates and caches formula cells
+        self.sorting = None     # caches sort orders
+        self.listeners = []     # told about changes, see addListener
         self.colors = {}    # holds cell colors
         self.colors['fg'] = {}
         self.colors['bg'] = {}
@@ -102,12 +125,20 @@ class TableModel(object):
         # list of editable column types
         self.editable = {}
         self.nodisplay = []
-        self.columnwidths = {}  # used to store col widths,
-        #                         not held in saved data
+        # used to store col widths, not held in saved data
+        self.columnwidths = SizeDict()
+        # heights of rows by record name, if not the table's row height
+        self.rowheights = SizeDict()
+        self.longesttext = {}   # longest text shown per column
+        self.lastintkey = None  # largest integer record key handed out
+        self.journal = Journal(self)    # undo and redo of edits
 
     def createEmptyModel(self):
         """Create the basic empty model dict"""
-        self.data = {}
+        self.data = self.storeclass()
+        self.formulas = FormulaEngine(self.data)
+        self.sorting = SortIndex(self.data, self.formulas)
+        self.data.addListener(self.dataChanged)
         # Define the starting column names and locations in the table.
         self.columnNames = []
         self.columntypes = {}
@@ -116,7 +147,49 @@ class TableModel(object):
         self.columnlabels = {}
         for colname in self.columnNames:
             self.columnlabels[colname] = colname
-        self.reclist = list(self.data.keys())
+        self.reclist = RecordList(self.data.keys())
+
+    def addListener(self, func):
+        """Call func(kind, recname, colname) when the model changes, kind
+           is one of
+           'cell': the value of one cell changed
+           'row': a record changed, was added or was removed
+           'column': a column changed, was added or was removed
+           'structure': anything else, e.g. the order of rows or columns.
+           Cell events are also sent for formula cells that depend on a
+           changed cell"""
+        if func not in self.listeners:
+            self.listeners.append(func)
+        return
+
+    def removeListener(self, func):
+        if func in self.listeners:
+            self.listeners.remove(func)
+        return
+
+    def notify(self, kind, recname=None, colname=None):
+        for func in self.listeners:
+            func(kind, recname, colname)
+        return
+
+    def dataChanged(self, recname=None, colname=None):
+        """Store listener, passes changes on as model events"""
+        if self.longesttext:
+            self.updateLongestText(recname, colname)
+        if not self.listeners:
+            return
+        if recname is None and colname is None:
+            self.notify('structure')
+        elif recname is None:
+            self.notify('column', colname=colname)
+        elif colname is None:
+            self.notify('row', recname)
+        else:
+            self.notify('cell', recname, colname)
+            if self.formulas is not None:
+                for rec, col in self.formulas.getDependents(recname, colname):
+                    self.notify('cell', rec, col)
+        return
 
     def importDict(self, newdata):
         """Try to create a table model from a dict of the form
@@ -125,17 +198,11 @@ class TableModel(object):
         # get cols from sub data keys
         if newdata is None:
             return
-        colnames = []
-        for k in newdata:
-            fields = list(newdata[k].keys())
-            for f in fields:
-                if f not in colnames:
-                    colnames.append(f)
-        for c in colnames:
-            self.addColumn(c)
-        # add the data
+        # add the data, the store keeps track of the fields it has seen
         self.data.update(newdata)
-        self.reclist = list(self.data.keys())
+        for c in self.data.getColumnNames():
+            self.addColumn(c)
+        self.reclist = RecordList(self.data.keys())
 
     def getDefaultTypes(self):
         """Get possible field types for this table model"""
@@ -143,11 +210,11 @@ class TableModel(object):
 
     def getData(self):
         """Return the current data for saving"""
-        data = copy.deepcopy(self.data)
+        data = self.data.toDict()
         data['colors'] = self.colors
         data['columnnames'] = self.columnNames
         # we keep original record order
-        data['reclist'] = self.reclist
+        data['reclist'] = list(self.reclist)
         # record current col order
         data['columnorder'] = {}
         i = 0
@@ -175,24 +242,106 @@ class TableModel(object):
         if self.getColumnType(colIndex) == 'Link':
             return ['xxxxxx']
         else:
+            if self.formulas is not None:
+                colname = self.getColumnName(colIndex)
+                self.formulas.evaluateColumn(colname, self.reclist)
             for row in range(len(self.reclist)):
                 v = self.getValueAt(row, colIndex)
                 collist.append(v)
         return collist
 
-    def getlongestEntry(self, columnIndex):
-        """Get the longest cell entry in the col"""
-        collist = self.getColCells(columnIndex)
-        maxw = 5
-        for c in collist:
-            try:
-                w = len(str(c))
-            except UnicodeEncodeError:
-                pass
-            if w > maxw:
-                maxw = w
-        # print 'longest width', maxw
-        return maxw
+    def getDisplayValues(self, colname, names):
+        """The values shown in a column for several records, the same as
+           getValueAt gives but fetched from the store a column at a time.
+           Formulas among them are evaluated together"""
+        cells = self.data.getColumnValues(colname, names, default='')
+        coltype = self.columntypes.get(colname, 'text')
+        if any(isinstance(c, dict) for c in cells):
+            formulas = [n for n, c in zip(names, cells)
+                        if Formula.isFormula(c)]
+            self.formulas.evaluateColumn(colname, formulas)
+            return [self.getDictText(n, colname, c)
+                    if isinstance(c, dict) else self.formatCell(c, coltype)
+                    for n, c in zip(names, cells)]
+        if coltype == 'number':
+            return ['' if c is None else str(c) for c in cells]
+        return [self.formatCell(c, coltype) for c in cells]
+
+    @staticmethod
+    def formatCell(cell, coltype):
+        """How getValueAt shows a stored value that isn't a dict"""
+        if cell is None:
+            return ''
+        if coltype == 'text' or coltype == 'Text':
+            return cell
+        elif coltype == 'number':
+            return str(cell)
+        return 'other'
+
+    def getlongestEntry(self, columnIndex, sample=None):
+        """Get the length of the longest cell entry in the col"""
+        return max(len(self.getLongestText(columnIndex, sample)), 5)
+
+    def getLongestText(self, columnIndex, sample=None):
+        """Get the longest text shown in a column. It is found from the
+           stored values, only formulas are evaluated, and then kept up to
+           date as cells change. It never shrinks while the column is
+           loaded, which is all that fitting column widths needs.
+           sample: look at only this many evenly spaced records of a
+           bigger table"""
+        colname = self.getColumnName(columnIndex)
+        if colname in self.longesttext:
+            return self.longesttext[colname]
+        if self.getColumnType(columnIndex) == 'Link':
+            text = 'xxxxxx'
+        else:
+            names = self.data.names
+            if sample is not None and len(names) > sample:
+                step = len(names) / float(sample)
+                names = [names[int(i * step)] for i in range(sample)]
+            values = self.data.getColumnValues(colname, names)
+            if any(isinstance(v, dict) for v in values):
+                values = [self.getDictText(n, colname, v)
+                          if isinstance(v, dict) else v
+                          for n, v in zip(names, values)]
+            texts = map(str, filter(lambda v: v is not None, values))
+            text = max(texts, key=len, default='')
+        self.longesttext[colname] = text
+        return text
+
+    def getDictText(self, recname, colname, cell):
+        """Text shown for a dict cell, formulas show their result"""
+        if Formula.isFormula(cell):
+            return self.formulas.getValue(recname, colname)
+        return ''
+
+    def updateLongestText(self, recname, colname):
+        """Keep the longest text of columns up to date with a change in
+           the store"""
+        longest = self.longesttext
+        if recname is None:
+            if colname is None:
+                longest.clear()
+            else:
+                longest.pop(colname, None)
+            return
+        if recname not in self.data:
+            return
+        if colname is None:
+            colnames = list(longest)
+        else:
+            colnames = [colname]
+        for col in colnames:
+            if col not in longest:
+                continue
+            cell = self.data.getCell(recname, col)
+            # formulas are left alone, their results are rarely longer
+            if cell is None or isinstance(cell, dict):
+                continue
+            text = str(cell)
+            if len(text) > len(longest[col]):
+                longest[col] = text
+        return
 
     def getRecordAtRow(self, rowIndex):
         """Get the entire record at the specifed row."""
@@ -206,20 +355,17 @@ class TableModel(object):
         colname = self.getColumnName(columnIndex)
         # coltype = self.columntypes[colname]
         rowname = self.getRecName(rowIndex)
-        # print self.data[name]
-        if colname in self.data[rowname]:
-            celldata = self.data[rowname][colname]
-        else:
-            celldata = None
-        return celldata
+        return self.data.getCell(rowname, colname)
 
     def deleteCellRecord(self, rowIndex, columnIndex):
         """Remove the cell data at this row/column"""
         colname = self.getColumnName(columnIndex)
         # coltype = self.columntypes[colname]
         name = self.getRecName(rowIndex)
-        if colname in self.data[name]:
-            del self.data[name][colname]
+        if self.data.hasCell(name, colname):
+            self.journal.record(('cell', name, colname,
+                                 self.data.getCell(name, colname)))
+        self.data.deleteCell(name, colname)
         return
 
     def getRecName(self, rowIndex):
@@ -238,21 +384,28 @@ class TableModel(object):
         if len(self.reclist) == 0:
             return None
         currname = self.getRecName(rowIndex)
-        self.reclist[rowIndex] = newname
-        temp = copy.deepcopy(self.data[currname])
-        self.data[newname] = temp
-        # self.data[newname]['Name'] = newname
-        del self.data[currname]
-        for key in ['bg', 'fg']:
-            if currname in self.colors[key]:
-                temp = copy.deepcopy(self.colors[key][currname])
-                self.colors[key][newname] = temp
-                del self.colors[key][currname]
-        print('renamed')
+        self.renameRecord(currname, newname)
         # would also need to resolve all refs to this rec in formulas here!
 
         return
 
+    def renameRecord(self, currname, newname):
+        """Give a record a new name everywhere it is kept"""
+        self.journal.record(('rename', newname, currname))
+        self.noteKeys([newname])
+        self.reclist[self.reclist.index(currname)] = newname
+        if self.filteredrecs is not None:
+            shown = self.filteredrecs
+            if currname in shown:
+                shown[shown.index(currname)] = newname
+        self.data.renameRecord(currname, newname)
+        for key in ['bg', 'fg']:
+            if currname in self.colors[key]:
+                self.colors[key][newname] = self.colors[key].pop(currname)
+        if currname in self.rowheights:
+            self.rowheights[newname] = self.rowheights.pop(currname)
+        return
+
     def getRecordAttributeAtColumn(self, rowIndex=None, columnIndex=None,
                                    recName=None, columnName=None):
         """Get the attribute of the record at the specified column index.
@@ -260,12 +413,13 @@ class TableModel(object):
 
         value = None
         if columnName is not None and recName is not None:
-            if columnName not in self.data[recName]:
+            cell = self.data.getCell(recName, columnName)
+            if cell is None:
                 return ''
-            cell = self.data[recName][columnName]
         else:
-            cell = self.getCellRecord(rowIndex, columnIndex)
+            recName = self.getRecName(rowIndex)
             columnName = self.getColumnName(columnIndex)
+            cell = self.data.getCell(recName, columnName)
         if cell is None:
             cell = ''
         # Set the value based on the data record field
@@ -274,7 +428,7 @@ class TableModel(object):
         except KeyError:
             coltype = 'text'
         if Formula.isFormula(cell):
-            value = self.doFormula(cell)
+            value = self.formulas.getValue(recName, columnName)
             return value
 
         # if not type(cell) == dict:
@@ -289,44 +443,59 @@ class TableModel(object):
             value = ''
         return value
 
+    def getRecordRow(self, recname):
+        """Row of a record in the current view, which is the filtered
+           records if there are any. returns: None if it isn't shown"""
+        if self.filteredrecs is not None:
+            names = self.filteredrecs
+        else:
+            names = self.reclist
+        try:
+            return names.index(recname)
+        except ValueError:
+            return None
+
     def getRecordIndex(self, recname):
+        """Position of a record in reclist, found through the name map
+           kept by the record list rather than a scan"""
         rowIndex = self.reclist.index(recname)
         return int(rowIndex)
 
-    def setSortOrder(self, columnIndex=None, columnName=None, reverse=0):
+    @traced('model.sort')
+    def setSortOrder(self, columnIndex=None, columnName=None, reverse=0,
+                     sortkeys=None):
         """Changes the order that records are sorted in, which will
-           be reflected in the table upon redrawing"""
-
-        if columnName is not None and columnName in self.columnNames:
-            self.sortkey = columnName
+           be reflected in the table upon redrawing.
+           sortkeys: list of column names to sort by several columns"""
+
+        if sortkeys:
+            sortkeys = [c for c in sortkeys if c in self.columnNames]
+            if not sortkeys:
+                return
+        elif columnName is not None and columnName in self.columnNames:
+            sortkeys = [columnName]
         elif columnIndex is not None:
-            self.sortkey = self.getColumnName(columnIndex)
+            sortkeys = [self.getColumnName(columnIndex)]
         else:
             return
-        self.reclist = self.createSortMap(self.reclist, self.sortkey, reverse)
+        # sorting may reorder the record list in place
+        self.journal.record(('order', RecordList(self.reclist), self.sortkey,
+                             self.sortkeys))
+        self.sortkey = sortkeys[0]
+        self.sortkeys = sortkeys
+        lists = [self.reclist]
+        if self.filteredrecs is not None:
+            lists.append(self.filteredrecs)
+        lists = self.sorting.sortLists(lists, sortkeys, reverse)
+        self.reclist = lists[0]
         if self.filteredrecs is not None:
-            self.filteredrecs = self.createSortMap(self.filteredrecs,
-                                                   self.sortkey, reverse)
+            self.filteredrecs = lists[1]
+        self.notify('structure')
         return
 
     def createSortMap(self, names, sortkey, reverse=0):
         """Create a sort mapping for given list"""
-
-        recdata = []
-        for rec in names:
-            recdata.append(self.getRecordAttributeAtColumn(recName=rec,
-                                                           columnName=sortkey))
-        # try create list of floats if col has numbers only
-        try:
-            recdata = self.toFloats(recdata)
-        except ValueError:
-            pass
-        smap = list(zip(names, recdata))
-        # sort the mapping by the second key
-        smap = sorted(smap, key=operator.itemgetter(1), reverse=reverse)
-        # now sort the main reclist by the mapping order
-        sortmap = list(map(operator.itemgetter(0), smap))
-        return sortmap
+        return self.sorting.sort(names, (sortkey,), bool(reverse))
 
     def toFloats(self, a_list):
         x = []
@@ -346,6 +515,7 @@ class TableModel(object):
 
     def moveColumn(self, oldcolumnIndex, newcolumnIndex):
         """Changes the order of columns"""
+        self.journal.record(('columns', list(self.columnNames)))
         self.oldnames = self.columnNames
         self.columnNames = []
 
@@ -362,6 +532,7 @@ class TableModel(object):
         # if new col is at end just append
         if moved not in self.columnNames:
             self.columnNames.append(moved)
+        self.notify('structure')
         return
 
     def getNextKey(self):
@@ -375,24 +546,102 @@ class TableModel(object):
             return
         if key is None:
             key = self.getNextKey()
-        if key in self.data or key in self.reclist:
+        if key in self.data:
             print('name already present!!')
             return
-        self.data[key] = {}
-        for k in kwargs:
-            if k not in self.columnNames:
-                self.addColumn(k)
-            self.data[key][k] = str(kwargs[k])
-        self.reclist.append(key)
+        record = {k: str(kwargs[k]) for k in kwargs}
+        self.appendRecords([record], keys=[key])
         return key
 
+    def getNextKeys(self, num):
+        """num integer keys not used yet, numbered on from the largest
+           integer key. Only the first call looks through the keys"""
+        if self.lastintkey is None:
+            ints = [n for n in self.data.keys() if isinstance(n, int)]
+            self.lastintkey = max(ints) if ints else -1
+        data = self.data
+        keys = []
+        key = self.lastintkey
+        while len(keys) < num:
+            key += 1
+            if key not in data:
+                keys.append(key)
+        self.lastintkey = key
+        return keys
+
+    def noteKeys(self, keys):
+        """Keep the largest integer key up to date with keys added"""
+        if self.lastintkey is None:
+            return
+        ints = [n for n in keys if isinstance(n, int)]
+        if ints and max(ints) > self.lastintkey:
+            self.lastintkey = max(ints)
+        return
+
+    @traced('model.append')
+    def appendRecords(self, records=None, columns=None, keys=None):
+        """Add many records to the end of the table in one pass, from an
+           iterable of dicts of field values or from columns, a dict of
+           colname -> sequence of values. Values are kept as they are
+           rather than turned into text. keys names the new records, by
+           default they are numbered on from the largest integer key.
+           returns: the keys of the new records"""
+        if records is not None:
+            columns = {}
+            count = 0
+            for record in records:
+                for colname in record:
+                    values = columns.get(colname)
+                    if values is None:
+                        values = columns[colname] = [MISSING] * count
+                    elif len(values) < count:
+                        values.extend([MISSING] * (count - len(values)))
+                    value = record[colname]
+                    if isinstance(value, dict):
+                        value = copy.deepcopy(value)
+                    values.append(value)
+                count += 1
+            for values in columns.values():
+                values.extend([MISSING] * (count - len(values)))
+        elif columns is not None:
+            columns = {c: list(v) for c, v in columns.items()}
+            lengths = set(map(len, columns.values()))
+            if len(lengths) > 1:
+                raise ValueError('columns must all be the same length')
+            count = lengths.pop() if lengths else 0
+        else:
+            columns = {}
+            count = 0 if keys is None else len(keys)
+        if keys is None:
+            keys = self.getNextKeys(count)
+        else:
+            keys = list(keys)
+            if len(keys) != count:
+                raise ValueError('there must be one key for each record')
+            self.noteKeys(keys)
+        if not keys:
+            return keys
+        with self.journal.group():
+            self.journal.record(('dropRows', keys))
+            self.data.appendColumns(keys, columns)
+            if not isinstance(self.reclist, RecordList):
+                self.reclist = RecordList(self.reclist)
+            self.reclist.extend(keys)
+            for colname in columns:
+                if colname not in self.columnNames:
+                    column = self.data.getColumn(colname)
+                    coltype = 'number' if column.kind == 'float' else None
+                    self.addColumn(colname, coltype)
+        return keys
+
     def deleteRow(self, rowIndex=None, key=None, update=True):
         """Delete a row"""
         if key is None or key not in self.reclist:
             key = self.getRecName(rowIndex)
-        del self.data[key]
         if update:
-            self.reclist.remove(key)
+            self.deleteRecords([key])
+            return
+        del self.data[key]
         return
 
     def deleteRows(self, rowlist=None):
@@ -400,10 +649,67 @@ class TableModel(object):
         if rowlist is None:
             rowlist = list(range(len(self.reclist)))
         names = [self.getRecName(i) for i in rowlist]
-        for name in names:
-            self.deleteRow(key=name, update=True)
+        self.deleteRecords(names)
+        return
+
+    @traced('model.delete')
+    def deleteRecords(self, names):
+        """Delete many records by name, the record order is rebuilt in
+           one pass instead of removing them one at a time"""
+        names = [n for n in names if n in self.data]
+        if names:
+            self.journal.recordRows(names)
+        self.data.removeRecords(names)
+        if not isinstance(self.reclist, RecordList):
+            self.reclist = RecordList(self.reclist)
+        self.reclist.removeMany(names)
+        if self.filteredrecs is not None:
+            removed = set(names)
+            self.filteredrecs = RecordList(n for n in self.filteredrecs
+                                           if n not in removed)
+        for key in ['bg', 'fg']:
+            for name in names:
+                self.colors[key].pop(name, None)
+        if self.rowheights:
+            for name in names:
+                self.rowheights.pop(name, None)
         return
 
+    def insertRecords(self, names, position=None, records=None):
+        """Add many new records at once before row position, or at the end
+           if position is None. records optionally holds a dict of field
+           values for each name. returns: the names that were added"""
+        names = [n for n in names if n not in self.data]
+        if not names:
+            return names
+        self.journal.record(('dropRows', names))
+        newcols = []
+        # listeners are told once, after the rows are in the record list
+        with self.data.quiet() as listeners:
+            self.data.addRecords(names)
+            if records is not None:
+                for name in names:
+                    if name in records:
+                        self.data.setRecord(name, records[name])
+                        for k in records[name]:
+                            if k not in self.columnNames and \
+                                    k not in newcols:
+                                newcols.append(k)
+            if not isinstance(self.reclist, RecordList):
+                self.reclist = RecordList(self.reclist)
+            if position is None:
+                self.reclist.extend(names)
+            else:
+                self.reclist.insertMany(position, names)
+        for k in newcols:
+            self.addColumn(k)
+        if listeners:
+            if len(names) == 1:
+                self.data.notify(names[0])
+            else:
+                self.data.notify()
+        return names
+
     def addColumn(self, colname=None, coltype=None):
         """Add a column"""
         index = self.getColumnCount() + 1
@@ -412,28 +718,33 @@ class TableModel(object):
         if colname in self.columnNames:
             # print 'name is present!'
             return
+        self.journal.record(('dropColumn', colname))
         self.columnNames.append(colname)
         self.columnlabels[colname] = colname
         if coltype is None:
             self.columntypes[colname] = 'text'
         else:
             self.columntypes[colname] = coltype
+        self.notify('structure')
         return
 
     def deleteColumn(self, columnIndex):
         """delete a column"""
         colname = self.getColumnName(columnIndex)
-        self.columnNames.remove(colname)
-        del self.columnlabels[colname]
-        del self.columntypes[colname]
-        # remove this field from every record
-        for recname in self.reclist:
-            if colname in self.data[recname]:
-                del self.data[recname][colname]
-        if self.sortkey is not None:
-            currIndex = self.getColumnIndex(self.sortkey)
-            if columnIndex == currIndex:
-                self.setSortOrder(0)
+        with self.journal.group():
+            self.journal.recordColumn(colname)
+            self.columnNames.remove(colname)
+            del self.columnlabels[colname]
+            del self.columntypes[colname]
+            # remove this field from every record
+            self.data.removeColumn(colname)
+            if self.sortkey == colname:
+                if self.columnNames:
+                    self.setSortOrder(0)
+                else:
+                    self.journal.record(('order', self.reclist, self.sortkey,
+                                         self.sortkeys))
+                    self.sortkey = None
         # print 'column deleted'
         # print 'new cols:', self.columnNames
         return
@@ -444,28 +755,14 @@ class TableModel(object):
             cols = self.columnNames
         if self.getColumnCount() == 0:
             return
-        for col in cols:
-            self.deleteColumn(col)
+        with self.journal.group():
+            for col in cols:
+                self.deleteColumn(col)
         return
 
     def autoAddRows(self, numrows=None):
         """Automatically add x number of records"""
-        # rows = self.getRowCount()
-        ints = [i for i in self.reclist if isinstance(i, int)]
-        if len(ints) > 0:
-            start = max(ints)+1
-        else:
-            start = 0
-        # we don't use addRow as it's too slow
-        keys = list(range(start, start+numrows))
-        # make sure no keys are present already
-        keys = list(set(keys)-set(self.reclist))
-        newdata = {}
-        for k in keys:
-            newdata[k] = {}
-        self.data.update(newdata)
-        self.reclist.extend(list(newdata.keys()))
-        return keys
+        return self.appendRecords(keys=self.getNextKeys(numrows))
 
     def autoAddColumns(self, numcols=None):
         """Automatically add x number of cols"""
@@ -488,7 +785,9 @@ class TableModel(object):
     def relabel_Column(self, columnIndex, newname):
         """Change the column label - can be used in a table header"""
         colname = self.getColumnName(columnIndex)
+        self.journal.record(('label', colname, self.columnlabels[colname]))
         self.columnlabels[colname] = newname
+        self.notify('column', colname=colname)
         return
 
     def getColumnType(self, columnIndex):
@@ -524,9 +823,8 @@ class TableModel(object):
             filters is a tuple of the form (key,value,operator,bool)"""
         if columnIndex is not None and columnIndex < len(self.columnNames):
             columnName = self.getColumnName(columnIndex)
-        names = Filtering.doFiltering(searchfunc=self.filterBy,
-                                      filters=filters)
-        coldata = [self.data[n][columnName] for n in names]
+        names = self.filterRecords(filters)
+        coldata = self.data.getColumnValues(columnName, names)
         return coldata
 
     def getColumns(self, colnames, filters=None, allowempty=True):
@@ -568,32 +866,40 @@ class TableModel(object):
            This is used in Filtering.doFiltering to find the required recs
            according to column, value and an operator"""
 
-        funcs = Filtering.operatornames
-        floatops = ['=', '>', '<']
-        func = funcs[op]
-        data = self.data
-        # coltype = self.columntypes[filtercol]
-        names = []
-        for rec in self.reclist:
-            if filtercol in data[rec]:
-                # try to do float comparisons if required
-                if op in floatops:
-                    try:
-                        # print float(data[rec][filtercol])
-                        item = float(data[rec][filtercol])
-                        v = float(value)
-                        if func(v, item):
-                            names.append(rec)
-                        continue
-                    except ValueError:
-                        pass
-                if filtercol == 'name' and userecnames:
-                    item = rec
-                else:
-                    item = str(data[rec][filtercol])
-                if func(value, item):
-                    names.append(rec)
-        return names
+        mask = self.getFilterMask(filtercol, value, op, userecnames)
+        return list(compress(self.reclist, mask))
+
+    def getFilterMask(self, filtercol, value, op='contains',
+                      userecnames=False, names=None, cells=None):
+        """Evaluate one filter over a whole column at once.
+           returns: a 0/1 bytearray aligned with names (default reclist)"""
+
+        if names is None:
+            names = self.reclist
+        if cells is None:
+            cells = self.data.getColumnValues(filtercol, names)
+        if filtercol == 'name' and userecnames:
+            return Filtering.filterMask(cells, value, op, names=names)
+        return Filtering.filterMask(cells, value, op)
+
+    @traced('model.filter')
+    def filterRecords(self, filters=None, names=None):
+        """Apply a list of filters of the form (key,value,operator,bool) to
+           the records in one pass, each column is fetched only once.
+           returns: the matching record names in reclist order"""
+
+        if names is None:
+            names = self.reclist
+        if filters is None:
+            return RecordList(names)
+        columns = {}
+
+        def maskfunc(col, value, op):
+            if col not in columns:
+                columns[col] = self.data.getColumnValues(col, names)
+            return self.getFilterMask(col, value, op, names=names,
+                                      cells=columns[col])
+        return RecordList(Filtering.doMaskFiltering(maskfunc, names, filters))
 
     def getRowCount(self):
         """Returns the number of rows in the table model."""
@@ -610,16 +916,31 @@ class TableModel(object):
         name = self.getRecName(rowIndex)
         colname = self.getColumnName(columnIndex)
         coltype = self.columntypes[colname]
-        if coltype == 'number':
+        if coltype == 'number' and value != '':
+            # need '' to allow deletion of values
             try:
-                if value == '':  # need this to allow deletion of values
-                    self.data[name][colname] = ''
-                else:
-                    self.data[name][colname] = float(value)
+                value = float(value)
             except (ValueError, TypeError):
-                pass
-        else:
-            self.data[name][colname] = value
+                return
+        self.setCell(name, colname, value)
+        return
+
+    def setCell(self, recname, colname, value):
+        """Set a cell by record and column name, recording the old value
+           so the change can be undone"""
+        self.journal.record(('cell', recname, colname,
+                             self.data.getCell(recname, colname, MISSING)))
+        self.data.setCell(recname, colname, value)
+        return
+
+    def setCells(self, colname, names, values):
+        """Set a column for many records at once, as one undoable edit.
+           MISSING in values clears a cell"""
+        names = list(names)
+        self.journal.record(('cells', colname, names,
+                             self.data.getColumnValues(colname, names,
+                                                       MISSING)))
+        self.data.setCells(colname, names, values)
         return
 
     def setFormulaAt(self, f, rowIndex, columnIndex):
@@ -629,7 +950,7 @@ class TableModel(object):
         # coltype = self.columntypes[colname]
         rec = {}
         rec['formula'] = f
-        self.data[name][colname] = rec
+        self.setCell(name, colname, rec)
         return
 
     def getColorAt(self, rowIndex, columnIndex, key='bg'):
@@ -647,14 +968,19 @@ class TableModel(object):
         colname = self.getColumnName(columnIndex)
         if name not in self.colors[key]:
             self.colors[key][name] = {}
+        self.journal.record(('color', key, name, colname,
+                             self.colors[key][name].get(colname, MISSING)))
         self.colors[key][name][colname] = str(color)
+        self.notify('cell', name, colname)
         return
 
     def resetcolors(self):
         """Remove all color formatting"""
+        self.journal.record(('colors', self.colors))
         self.colors = {}
         self.colors['fg'] = {}
         self.colors['bg'] = {}
+        self.notify('structure')
         return
 
     def getRecColNames(self, rowIndex, ColIndex):
@@ -677,8 +1003,6 @@ class TableModel(object):
             ncol = thiscol + offset
 
         newrecname, newcolname = self.getRecColNames(nrow, ncol)
-        print('recname, colname', recname, colname)
-        print('thisrow, col', thisrow, thiscol)
         return newrecname, newcolname
 
     def appendtoFormula(self, formula, rowIndex, colIndex):
@@ -689,7 +1013,7 @@ class TableModel(object):
 
     def doFormula(self, cellformula):
         """Evaluate the formula for a cell and return the result"""
-        value = Formula.doFormula(cellformula, self.data)
+        value = self.formulas.evaluate(cellformula)
         return value
 
     def copyFormula(self, cellval, row, col, offset=1, dim='y'):
@@ -702,7 +1026,6 @@ class TableModel(object):
         cells, ops = Formula.readExpression(frmla)
 
         for c in cells:
-            print(c)
             # if type(c) is not list:
             if not isinstance(c, list):
                 nc = c
@@ -714,50 +1037,177 @@ class TableModel(object):
         newformula = Formula.doExpression(newcells, ops, getvalues=False)
         return newformula
 
-    def merge(self, model, key='name', fields=None):
-        """Merge another table model with this one based on a key field,
-           we only add records from the new model where the key is present
-           in both models"""
+    @traced('model.merge')
+    def merge(self, model, key='name', fields=None, how='left',
+              suffix=None, chunksize=50000):
+        """Merge the fields of another table model into this one, matching
+           records on the values of a key column, or a list of them, with
+           a hash join so the time taken grows linearly with table size.
+           how: 'left' fills in the fields of records with a match,
+                'inner' also removes the records without one and
+                'outer' also adds the records of model without one
+           suffix: if given, fields this model has already go into a new
+                column named field + suffix instead of overwriting it
+           Where records of model share a key the last one is used. Values
+           are copied chunksize records at a time, the whole merge is one
+           undoable edit"""
+        if how not in ('left', 'inner', 'outer'):
+            raise ValueError('how should be left, inner or outer')
+        keys = [key] if isinstance(key, str) else list(key)
         if fields is None:
             fields = model.columnNames
-        for rec in self.reclist:
-            if key not in self.data[rec]:
+        fields = [f for f in fields if f not in keys]
+        targets = {}
+        for f in fields:
+            if suffix is not None and f in self.columnNames:
+                targets[f] = f + suffix
+            else:
+                targets[f] = f
+
+        def keyValues(M):
+            columns = [M.data.getColumnValues(k, M.reclist, MISSING)
+                       for k in keys]
+            return zip(M.reclist, zip(*columns))
+
+        # build a table of the keys of model
+        lookup = {}
+        for name, value in keyValues(model):
+            if MISSING in value:
                 continue
-            for new in model.reclist:
-                if key not in model.data[new]:
-                    continue
-                if self.data[rec][key] == model.data[new][key]:
-                    # if new == rec:
-                    for f in fields:
-                        if f not in model.data[rec]:
-                            continue
-                        if f not in self.columnNames:
-                            self.addColumn(f)
-                        self.data[rec][f] = model.data[rec][f]
+            try:
+                lookup[value] = name
+            except TypeError:
+                # formula cells can't be keys
+                continue
+        # then look up the key of each record here
+        matched = []
+        unmatched = []
+        found = set()
+        for name, value in keyValues(self):
+            try:
+                other = lookup.get(value)
+            except TypeError:
+                other = None
+            if other is None:
+                unmatched.append(name)
+            else:
+                matched.append((name, other))
+                found.add(value)
+        added = []
+        if how == 'outer':
+            for name, value in keyValues(model):
+                try:
+                    if value in found:
+                        continue
+                except TypeError:
+                    pass
+                added.append(name)
+
+        store = model.data
+
+        def copyColumn(f, target, pairs):
+            """Copy field f of model into target for (here, there) pairs"""
+            column = store.getColumn(f)
+            if column is None:
+                return
+            for start in range(0, len(pairs), chunksize):
+                chunk = pairs[start:start + chunksize]
+                values = column.take([store.index[b] for a, b in chunk],
+                                     MISSING)
+                # cells missing in model are left as they are
+                cells = [(a, v) for (a, b), v in zip(chunk, values)
+                         if v is not MISSING]
+                if cells:
+                    self.setCells(target, [a for a, v in cells],
+                                  [v for a, v in cells])
+            return
+
+        with self.journal.group():
+            for f in fields:
+                if targets[f] not in self.columnNames:
+                    self.addColumn(targets[f], model.columntypes.get(f))
+            if how == 'inner':
+                self.deleteRecords(unmatched)
+            if added:
+                for k in keys:
+                    if k not in self.columnNames:
+                        self.addColumn(k, model.columntypes.get(k))
+                # keep the names used in model where they are free here
+                names = []
+                taken = set(self.data.keys())
+                newkey = self.getNextKey()
+                for name in added:
+                    if name in taken:
+                        while newkey in taken:
+                            newkey += 1
+                        name = newkey
+                    taken.add(name)
+                    names.append(name)
+                self.insertRecords(names)
+                added = list(zip(names, added))
+                for k in keys:
+                    copyColumn(k, k, added)
+            for f in fields:
+                copyColumn(f, targets[f], matched + added)
         return
 
+    @traced('io.save')
     def save(self, filename=None):
-        """Save model to file"""
+        """Save model to file, in the columnar format of TableFile"""
         if filename is None:
             return
-        data = self.getData()
-        fd = open(filename, 'w')
-        pickle.dump(data, fd)
-        fd.close()
+        from TableFile import writeTables
+        writeTables(filename, {'table': self})
         return
 
+    @traced('io.load')
     def load(self, filename):
-        """Load model from pickle file"""
-        fd = open(filename, 'r')
-        data = pickle.load(fd)
+        """Load model from a file saved by save, or an older pickle file.
+           Columns are read from the file as they are used"""
+        from TableFile import TableFile, isTableFile
+        if isTableFile(filename):
+            tablefile = TableFile(filename)
+            tablefile.loadModel(tablefile.getSheetNames()[0], model=self)
+            return
+        with open(filename, 'rb') as fd:
+            data = pickle.load(fd)
         self.setupModel(data)
         return
 
+    def undo(self):
+        """Undo the last edit, or group of edits. returns: False if there
+           was nothing to undo"""
+        return self.journal.undo()
+
+    def redo(self):
+        """Redo the last undone edit"""
+        return self.journal.redo()
+
     def copy(self):
-        """Return a copy of this model"""
+        """Return a copy of this model, holding all its records"""
+        M = self.snapshot()
+        M.filteredrecs = None
+        return M
+
+    def snapshot(self):
+        """A copy of this model that is safe to read from another thread
+           while this one changes, e.g. to export it. The store is copied
+           on write, so this is quick to take whatever the table size and
+           a column is only duplicated once either model changes it"""
         M = TableModel()
-        data = self.getData()
-        M.setupModel(data)
+        M.data = self.data.copy()
+        M.formulas = FormulaEngine(M.data)
+        M.sorting = SortIndex(M.data, M.formulas)
+        M.data.addListener(M.dataChanged)
+        M.reclist = RecordList(self.reclist)
+        if self.filteredrecs is not None:
+            M.filteredrecs = RecordList(self.filteredrecs)
+        M.columnNames = list(self.columnNames)
+        M.columntypes = dict(self.columntypes)
+        M.columnlabels = dict(self.columnlabels)
+        M.colors = copy.deepcopy(self.colors)
+        M.sortkey = self.sortkey
+        M.sortkeys = list(self.sortkeys)
         return M
 
     def __repr__(self):
@@ -0,0 +1,850 @@
+# -*- coding: utf-8 -*-
+"""
+    Module implements column oriented storage for the TableModel class.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import copy
+from array import array
+from contextlib import contextmanager
+from collections.abc import Mapping, MutableMapping
+
+# marks a cell that has no value in a record
+MISSING = object()
+
+
+class Column(object):
+    """Holds the values of one field for every record slot.
+       Columns holding only floats are kept in a typed array with a
+       presence mask, anything else falls back to a plain list"""
+
+    # copies share their storage until one of them changes, owners is
+    # then a list holding the number of columns sharing it
+    owners = None
+
+    def __init__(self, size=0):
+        self.kind = 'float'
+        self.values = array('d', bytes(8 * size))
+        self.present = bytearray(size)
+        return
+
+    def __len__(self):
+        return len(self.values)
+
+    def copy(self):
+        """A copy that shares storage with this column until either of
+           them is changed, so taking it costs nothing"""
+        if self.owners is None:
+            self.owners = [1]
+        self.owners[0] += 1
+        column = Column.__new__(Column)
+        column.kind = self.kind
+        column.values = self.values
+        column.present = self.present
+        column.owners = self.owners
+        return column
+
+    def own(self):
+        """Copy storage shared with other columns before changing it"""
+        owners = self.owners
+        if owners is None:
+            return
+        if owners[0] > 1:
+            owners[0] -= 1
+            self.values = self.values[:]
+            if self.present is not None:
+                self.present = bytearray(self.present)
+        self.owners = None
+        return
+
+    def toObjects(self):
+        """Convert a typed column into a list column"""
+        if self.kind == 'object':
+            return
+        self.own()
+        self.values = [v if p else MISSING
+                       for v, p in zip(self.values, self.present)]
+        self.present = None
+        self.kind = 'object'
+        return
+
+    def get(self, slot, default=MISSING):
+        """Get the value held at slot"""
+        if self.kind == 'float':
+            if self.present[slot]:
+                return self.values[slot]
+            return default
+        value = self.values[slot]
+        if value is MISSING:
+            return default
+        return value
+
+    def has(self, slot):
+        """True if there is a value at slot"""
+        if self.kind == 'float':
+            return self.present[slot] == 1
+        return self.values[slot] is not MISSING
+
+    def set(self, slot, value):
+        """Set the value at slot"""
+        if self.owners is not None:
+            self.own()
+        if self.kind == 'float':
+            if type(value) is float:
+                self.values[slot] = value
+                self.present[slot] = 1
+                return
+            self.toObjects()
+        self.values[slot] = value
+        return
+
+    def delete(self, slot):
+        """Remove the value at slot"""
+        self.own()
+        if self.kind == 'float':
+            self.present[slot] = 0
+        else:
+            self.values[slot] = MISSING
+        return
+
+    def grow(self, num=1):
+        """Add num empty slots to the end of the column"""
+        self.own()
+        if self.kind == 'float':
+            self.values.frombytes(bytes(8 * num))
+            self.present.extend(bytes(num))
+        else:
+            self.values.extend([MISSING] * num)
+        return
+
+    def extend(self, values):
+        """Append a sequence of values, MISSING is allowed"""
+        values = list(values)
+        self.own()
+        if (self.kind == 'float' and
+                all(type(v) is float or v is MISSING for v in values)):
+            self.values.extend([0.0 if v is MISSING else v for v in values])
+            self.present.extend([v is not MISSING for v in values])
+            return
+        self.toObjects()
+        self.values.extend(values)
+        return
+
+    def moveLast(self, slot):
+        """Move the value in the last slot into slot and shrink by one,
+           used to delete a slot without shifting the others"""
+        self.own()
+        last = len(self.values) - 1
+        if slot != last:
+            self.values[slot] = self.values[last]
+            if self.kind == 'float':
+                self.present[slot] = self.present[last]
+        self.values.pop()
+        if self.kind == 'float':
+            self.present.pop()
+        return
+
+    def take(self, slots, default=None):
+        """Return the values at the given slots as a list"""
+        values = self.values
+        if self.kind == 'float':
+            present = self.present
+            return [values[s] if present[s] else default for s in slots]
+        return [default if values[s] is MISSING else values[s]
+                for s in slots]
+
+    def count(self):
+        """Number of slots holding a value"""
+        if self.kind == 'float':
+            return self.present.count(1)
+        return len(self.values) - self.values.count(MISSING)
+
+
+class DeferredColumn(object):
+    """Stands in for a Column that has not been read yet, load is called
+       with no arguments to get it"""
+
+    def __init__(self, load):
+        self.load = load
+        return
+
+
+class LazyColumns(dict):
+    """Dict of colname -> Column for a ColumnStore whose columns are read
+       from a file the first time they are used, see DeferredColumn"""
+
+    def __getitem__(self, colname):
+        column = dict.__getitem__(self, colname)
+        if isinstance(column, DeferredColumn):
+            column = column.load()
+            dict.__setitem__(self, colname, column)
+        return column
+
+    def get(self, colname, default=None):
+        if colname in self:
+            return self[colname]
+        return default
+
+    def pop(self, colname, *default):
+        if colname in self:
+            column = self[colname]
+            dict.__delitem__(self, colname)
+            return column
+        return dict.pop(self, colname, *default)
+
+    def values(self):
+        return [self[c] for c in self]
+
+    def items(self):
+        return [(c, self[c]) for c in self]
+
+    def isLoaded(self, colname):
+        return not isinstance(dict.get(self, colname), DeferredColumn)
+
+    def copy(self):
+        """Copies of the columns read so far, the others stay deferred"""
+        columns = LazyColumns()
+        for colname, column in dict.items(self):
+            if not isinstance(column, DeferredColumn):
+                column = column.copy()
+            dict.__setitem__(columns, colname, column)
+        return columns
+
+
+class SizeDict(dict):
+    """Dict of name -> size in pixels, such as the column widths of a
+       model, that counts its changes in version so that geometry built
+       from it knows when to rebuild"""
+
+    version = 0
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version += 1
+        return
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version += 1
+        return
+
+    def pop(self, key, *default):
+        self.version += 1
+        return dict.pop(self, key, *default)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
+        return
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+        return
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return dict.setdefault(self, key, default)
+
+
+class RecordView(MutableMapping):
+    """A dict-like view of a single record in a ColumnStore, so that
+       model.data[rec][col] keeps working on the columnar layout"""
+
+    __slots__ = ('store', 'name')
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def __getitem__(self, colname):
+        value = self.store.getCell(self.name, colname, MISSING)
+        if value is MISSING:
+            raise KeyError(colname)
+        return value
+
+    def __setitem__(self, colname, value):
+        self.store.setCell(self.name, colname, value)
+
+    def __delitem__(self, colname):
+        if not self.store.hasCell(self.name, colname):
+            raise KeyError(colname)
+        self.store.deleteCell(self.name, colname)
+
+    def __contains__(self, colname):
+        return self.store.hasCell(self.name, colname)
+
+    def __iter__(self):
+        return iter(self.store.getRecordFields(self.name))
+
+    def __len__(self):
+        return len(self.store.getRecordFields(self.name))
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ColumnStore(MutableMapping):
+    """Columnar storage behind a TableModel.
+       Each field is held in one Column and every record owns a slot
+       number that indexes into all the columns. The store behaves like the
+       old dict of record dicts so that existing code using
+       model.data[rec][col] continues to work. Dict cells (formulas and
+       links) are copied when records are added so they are never shared
+       with the caller.
+       Listeners are called as func(recname, colname) after every change,
+       with colname None when a whole record changed, recname None when a
+       whole column changed and both None when everything did"""
+
+    # copies share the record names and slots until one of them adds,
+    # removes or renames a record, see Column.owners
+    owners = None
+
+    def __init__(self, data=None):
+        self.columns = {}
+        self.index = {}     # record name -> slot
+        self.names = []     # slot -> record name
+        self.listeners = []
+        if data is not None:
+            self.update(data)
+        return
+
+    # --- Mapping interface ---
+
+    def __getitem__(self, name):
+        if name not in self.index:
+            raise KeyError(name)
+        return RecordView(self, name)
+
+    def __setitem__(self, name, fields):
+        if name in self.index:
+            slot = self.index[name]
+            for column in self.columns.values():
+                column.delete(slot)
+            if self.listeners:
+                self.notify(name)
+        else:
+            self.addRecord(name)
+        self.setRecord(name, fields)
+
+    def __delitem__(self, name):
+        if name not in self.index:
+            raise KeyError(name)
+        self.removeRecord(name)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __deepcopy__(self, memo):
+        return self.__class__(self.toDict())
+
+    def copy(self):
+        """A copy of the store that shares all its storage with this one,
+           each column and the record names are only copied when one of
+           the stores changes them. Dict cells are shared, they are
+           replaced rather than changed when a cell is set. Listeners
+           aren't copied"""
+        store = self.__class__()
+        if isinstance(self.columns, LazyColumns):
+            store.columns = self.columns.copy()
+        else:
+            store.columns = {c: column.copy() for c, column in
+                             self.columns.items()}
+        if self.owners is None:
+            self.owners = [1]
+        self.owners[0] += 1
+        store.index = self.index
+        store.names = self.names
+        store.owners = self.owners
+        return store
+
+    def ownRecords(self):
+        """Copy the record names and slots before changing them if they
+           are shared with a copy"""
+        owners = self.owners
+        if owners is None:
+            return
+        if owners[0] > 1:
+            owners[0] -= 1
+            self.index = dict(self.index)
+            self.names = list(self.names)
+        self.owners = None
+        return
+
+    def __repr__(self):
+        return 'ColumnStore with {0:d} records, {1:d} columns'.format(
+            len(self.names), len(self.columns))
+
+    def addListener(self, func):
+        """Call func(recname, colname) whenever the data changes"""
+        self.listeners.append(func)
+        return
+
+    def removeListener(self, func):
+        if func in self.listeners:
+            self.listeners.remove(func)
+        return
+
+    def notify(self, name=None, colname=None):
+        """Tell listeners that a cell, record or column changed"""
+        for func in self.listeners:
+            func(name, colname)
+        return
+
+    @contextmanager
+    def quiet(self):
+        """Hold back notifications, for bulk changes that notify once
+           when they are done. yields the listeners"""
+        listeners = self.listeners
+        self.listeners = []
+        try:
+            yield listeners
+        finally:
+            self.listeners = listeners
+
+    def update(self, other=None, **kwargs):
+        """Add or replace several records at once, other is a dict of
+           the form {rec: {col: value}}"""
+        if other is None:
+            other = {}
+        if isinstance(other, Mapping):
+            items = other.items()
+        else:
+            items = other
+        for name, fields in items:
+            self[name] = fields
+        for name in kwargs:
+            self[name] = kwargs[name]
+        return
+
+    def clear(self):
+        self.ownRecords()
+        self.columns = {}
+        self.index = {}
+        self.names = []
+        if self.listeners:
+            self.notify()
+        return
+
+    # --- records ---
+
+    def addRecord(self, name, fields=None):
+        """Add a new empty record, optionally with field values"""
+        if name in self.index:
+            raise KeyError('record {0} already present'.format(name))
+        self.ownRecords()
+        self.index[name] = len(self.names)
+        self.names.append(name)
+        for column in self.columns.values():
+            column.grow()
+        if fields is not None:
+            self.setRecord(name, fields)
+        elif self.listeners:
+            self.notify(name)
+        return
+
+    def addRecords(self, names):
+        """Add many empty records in one pass, listeners are told once"""
+        names = [n for n in names if n not in self.index]
+        self.ownRecords()
+        start = len(self.names)
+        for i, name in enumerate(names):
+            self.index[name] = start + i
+        self.names.extend(names)
+        for column in self.columns.values():
+            column.grow(len(names))
+        if len(names) == 1 and self.listeners:
+            self.notify(names[0])
+        elif names and self.listeners:
+            self.notify()
+        return names
+
+    def appendColumns(self, names, columns):
+        """Add many records at once from their values by column.
+           columns is a dict of colname -> sequence with a value for each
+           name, MISSING for no value, and is stored as given. Fields not
+           in columns are left empty. Listeners are told once"""
+        names = list(names)
+        if len(set(names)) != len(names) or any(map(self.index.__contains__,
+                                                    names)):
+            raise KeyError('record names must be new and unique')
+        self.ownRecords()
+        start = len(self.names)
+        self.index.update(zip(names, range(start, start + len(names))))
+        self.names.extend(names)
+        for colname, column in self.columns.items():
+            if colname in columns:
+                column.extend(columns[colname])
+            else:
+                column.grow(len(names))
+        for colname in columns:
+            if colname not in self.columns:
+                column = self.columns[colname] = Column(start)
+                column.extend(columns[colname])
+        if names and self.listeners:
+            self.notify()
+        return names
+
+    def setRecord(self, name, fields):
+        """Set the field values of an existing record"""
+        for colname in fields:
+            value = fields[colname]
+            if isinstance(value, dict):
+                value = copy.deepcopy(value)
+            self.setCell(name, colname, value)
+        return
+
+    def getRecord(self, name):
+        """Return a plain dict of the values in a record"""
+        slot = self.index[name]
+        record = {}
+        for colname, column in self.columns.items():
+            value = column.get(slot)
+            if value is not MISSING:
+                record[colname] = value
+        return record
+
+    def getRecordFields(self, name):
+        """Return the names of the fields present in a record"""
+        slot = self.index[name]
+        return [c for c, column in self.columns.items() if column.has(slot)]
+
+    def removeRecord(self, name):
+        """Delete a record, the last slot is moved into the freed one"""
+        self.ownRecords()
+        slot = self.index.pop(name)
+        last = len(self.names) - 1
+        if slot != last:
+            moved = self.names[last]
+            self.names[slot] = moved
+            self.index[moved] = slot
+        self.names.pop()
+        for column in self.columns.values():
+            column.moveLast(slot)
+        if self.listeners:
+            self.notify(name)
+        return
+
+    def removeRecords(self, names):
+        """Delete several records, listeners are told once that
+           everything changed rather than once per record"""
+        names = [n for n in names if n in self.index]
+        if len(names) == 1:
+            self.removeRecord(names[0])
+            return
+        with self.quiet() as listeners:
+            for name in names:
+                self.removeRecord(name)
+        if names and listeners:
+            self.notify()
+        return
+
+    def renameRecord(self, name, newname):
+        """Give a record a new name without copying its values"""
+        if newname in self.index:
+            raise KeyError('record {0} already present'.format(newname))
+        self.ownRecords()
+        slot = self.index.pop(name)
+        self.index[newname] = slot
+        self.names[slot] = newname
+        if self.listeners:
+            self.notify(name)
+            self.notify(newname)
+        return
+
+    # --- cells ---
+
+    def getColumn(self, colname, create=False):
+        """Get the Column object for a field"""
+        if colname not in self.columns:
+            if not create:
+                return None
+            self.columns[colname] = Column(len(self.names))
+        return self.columns[colname]
+
+    def getCell(self, name, colname, default=None):
+        """Get a single cell value"""
+        column = self.columns.get(colname)
+        if column is None:
+            return default
+        return column.get(self.index[name], default)
+
+    def hasCell(self, name, colname):
+        column = self.columns.get(colname)
+        if column is None or name not in self.index:
+            return False
+        return column.has(self.index[name])
+
+    def setCell(self, name, colname, value):
+        """Set a single cell value"""
+        slot = self.index[name]
+        self.getColumn(colname, create=True).set(slot, value)
+        if self.listeners:
+            self.notify(name, colname)
+        return
+
+    def setCells(self, colname, names, values):
+        """Set a field for many records at once, MISSING clears a cell.
+           Listeners are told once that the column changed"""
+        column = self.getColumn(colname, create=True)
+        index = self.index
+        for name, value in zip(names, values):
+            if value is MISSING:
+                column.delete(index[name])
+            else:
+                column.set(index[name], value)
+        if self.listeners:
+            self.notify(None, colname)
+        return
+
+    def deleteCell(self, name, colname):
+        """Clear a single cell, missing cells are ignored"""
+        column = self.columns.get(colname)
+        if column is not None:
+            column.delete(self.index[name])
+            if self.listeners:
+                self.notify(name, colname)
+        return
+
+    # --- columns ---
+
+    def getColumnNames(self):
+        """Field names in the order they were first seen"""
+        return list(self.columns.keys())
+
+    def getColumnValues(self, colname, names=None, default=None):
+        """Return the values of a field for the given records (all records
+           in slot order if names is None), missing cells give default"""
+        column = self.columns.get(colname)
+        if names is None:
+            names = self.names
+        if column is None:
+            return [default] * len(names)
+        index = self.index
+        return column.take([index[n] for n in names], default)
+
+    def setColumnValues(self, colname, names, values):
+        """Replace a field with a value for each of names, MISSING for no
+           value. Records not in names are left without one"""
+        if names != self.names:
+            full = [MISSING] * len(self.names)
+            index = self.index
+            for name, value in zip(names, values):
+                slot = index.get(name)
+                if slot is not None:
+                    full[slot] = value
+            values = full
+        column = Column(0)
+        column.extend(values)
+        self.columns[colname] = column
+        if self.listeners:
+            self.notify(None, colname)
+        return
+
+    def removeColumn(self, colname):
+        """Remove a field from every record"""
+        if colname in self.columns:
+            del self.columns[colname]
+            if self.listeners:
+                self.notify(None, colname)
+        return
+
+    def toDict(self):
+        """Return the records as a plain dict of dicts"""
+        records = [{} for _ in self.names]
+        slots = range(len(self.names))
+        for colname, column in self.columns.items():
+            for record, value in zip(records, column.take(slots, MISSING)):
+                if value is MISSING:
+                    continue
+                if isinstance(value, dict):
+                    value = copy.deepcopy(value)
+                record[colname] = value
+        return dict(zip(self.names, records))
+
+
+class RecordList(list):
+    """A list of record names that also maps each name to its position,
+       so index and remove don't scan the list. Positions are filled in
+       lazily: valid is the length of the prefix whose positions are known,
+       changes only move it back to the first position they touch"""
+
+    def __init__(self, names=()):
+        list.__init__(self, names)
+        self.positions = {}
+        self.valid = 0
+        return
+
+    def invalidate(self, start=0):
+        """Forget positions from start onwards"""
+        if start < self.valid:
+            self.valid = start
+        return
+
+    def forget(self, names):
+        """Drop names that are no longer in the list from the map"""
+        if len(names) > len(self) // 2:
+            self.positions = {}
+            self.valid = 0
+            return
+        positions = self.positions
+        for name in names:
+            positions.pop(name, None)
+        return
+
+    def index(self, name, *args):
+        if args:
+            return list.index(self, name, *args)
+        pos = self.positions.get(name)
+        if pos is None or pos >= self.valid:
+            n = len(self)
+            if self.valid < n:
+                start = self.valid
+                self.positions.update(zip(self[start:], range(start, n)))
+                self.valid = n
+            pos = self.positions.get(name)
+        if pos is not None and pos < len(self) and self[pos] == name:
+            return pos
+        if pos is None and len(self.positions) == len(self):
+            # every name is mapped and none is repeated, so it is not here
+            raise ValueError('{0!r} is not in list'.format(name))
+        # duplicates or a stale entry, look it up the slow way
+        pos = list.index(self, name)
+        self.positions[name] = pos
+        return pos
+
+    def __contains__(self, name):
+        try:
+            self.index(name)
+        except (ValueError, TypeError):
+            return False
+        return True
+
+    def remove(self, name):
+        del self[self.index(name)]
+        return
+
+    def removeMany(self, names):
+        """Remove many names in one pass, names not present are ignored"""
+        names = set(names)
+        keep = [n for n in self if n not in names]
+        removed = len(self) - len(keep)
+        if removed:
+            list.__setitem__(self, slice(None), keep)
+            self.positions = {}
+            self.valid = 0
+        return removed
+
+    def insertMany(self, position, names):
+        """Insert a sequence of names before position in one pass"""
+        names = list(names)
+        list.__setitem__(self, slice(position, position), names)
+        self.invalidate(min(position, len(self)))
+        return
+
+    def pop(self, i=-1):
+        if i < 0:
+            i += len(self)
+        name = list.pop(self, i)
+        self.positions.pop(name, None)
+        self.invalidate(i)
+        return name
+
+    def insert(self, i, name):
+        list.insert(self, i, name)
+        if i < 0:
+            i += len(self)
+        self.invalidate(max(i, 0))
+        return
+
+    def __delitem__(self, key):
+        if isinstance(key, slice):
+            self.forget(self[key])
+            start = 0 if key.step not in (None, 1) else \
+                key.indices(len(self))[0]
+        else:
+            if key < 0:
+                key += len(self)
+            self.forget([self[key]])
+            start = key
+        list.__delitem__(self, key)
+        self.invalidate(start)
+        return
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            value = list(value)
+            self.forget(self[key])
+            start = 0 if key.step not in (None, 1) else \
+                key.indices(len(self))[0]
+        else:
+            if key < 0:
+                key += len(self)
+            self.forget([self[key]])
+            start = key
+        list.__setitem__(self, key, value)
+        self.invalidate(start)
+        return
+
+    def __iadd__(self, names):
+        self.extend(names)
+        return self
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self.positions = {}
+        self.valid = 0
+        return self
+
+    def clear(self):
+        list.clear(self)
+        self.positions = {}
+        self.valid = 0
+        return
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self.invalidate()
+        return
+
+    def reverse(self):
+        list.reverse(self)
+        self.invalidate()
+        return
+
+    def __reduce_ex__(self, protocol):
+        # save as a plain list so files don't depend on this class
+        return (list, (list(self),))
+
+    def __copy__(self):
+        return RecordList(self)
+
+    def __deepcopy__(self, memo):
+        return RecordList(copy.deepcopy(list(self), memo))
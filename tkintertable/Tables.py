@@ -19,15 +19,20 @@
     Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 import os
-import math
+import re
 import copy
 import platform
+from time import perf_counter
 
 import tkinter as tk
 import tkinter.font as Font
+from tkinter import ttk
 from TableModels import TableModel
 from TableFormula import Formula
 from Prefs import Preferences
+from Rendering import Axis, ItemPool, RedrawScheduler, TextWidths
+from Tracing import span, traced, tracer
+from Monitoring import StallMonitor, StatusHUD
 
 import tkinter.filedialog
 import tkinter.messagebox
@@ -61,6 +66,10 @@ class TableCanvas(tk.Canvas):
         self.vertlines = 1
         self.alternaterows = 0
         self.autoresizecols = 0
+        # fit column widths to a sample of this many rows, None for all
+        self.widthsample = 10000
+        # search tables with more cells than this on a worker thread
+        self.backgroundsearch = 2000000
         self.inset = 2
         self.x_start = 0
         self.y_start = 1
@@ -87,19 +96,26 @@ class TableCanvas(tk.Canvas):
         self.multiplerowlist = []
         self.multiplecollist = []
         self.col_positions = []       # record current column grid positions
+        self.colaxis = None     # cached column and row geometry, see Axis
+        self.rowaxis = None
         self.mode = 'normal'
         self.editable = True
         self.filtered = False
+        # reuse canvas items between redraws rather than recreating them
+        self.recycleitems = 1
 
         self.loadPrefs()
         # set any options passed in kwargs to overwrite defaults and prefs
         for key in kwargs:
             self.__dict__[key] = kwargs[key]
 
+        self.model = None
+        self.searchindex = None
+        self.monitor = None
+        self.hud = None
         if model is None:
-            self.model = TableModel(rows=rows, columns=cols)
-        else:
-            self.model = model
+            model = TableModel(rows=rows, columns=cols)
+        self.watchModel(model)
 
         self.rows = self.model.getRowCount()
         self.cols = self.model.getColumnCount()
@@ -121,7 +137,7 @@ class TableCanvas(tk.Canvas):
         self.rowrange = None
         self.visiblerows = None
         self.visiblecols = None
-        self.foundlist = None
+        self.foundcell = None
         self.fontbox = None
         self.align = None
         self.bar = None
@@ -136,6 +152,13 @@ class TableCanvas(tk.Canvas):
         self.cellentry = None
         self.entrywin = None
         self.prefswindow = None
+        # recycled items for cell text, cell colors and grid lines
+        self.textpool = ItemPool(self, 'text', ('text', 'celltext'))
+        self.fillpool = ItemPool(self, 'rectangle', ('fillrect',))
+        self.gridpool = ItemPool(self, 'line', ('gridline',))
+        self.linkcells = set()
+        # coalesces redraw requests into one draw per idle cycle
+        self.redraws = RedrawScheduler(self)
 
     def set_defaults(self):
         """Set default settings"""
@@ -146,6 +169,10 @@ class TableCanvas(tk.Canvas):
         self.vertlines = 1
         self.alternaterows = 0
         self.autoresizecols = 0
+        # fit column widths to a sample of this many rows, None for all
+        self.widthsample = 10000
+        # search tables with more cells than this on a worker thread
+        self.backgroundsearch = 2000000
         self.inset = 2
         self.x_start = 0
         self.y_start = 1
@@ -203,6 +230,8 @@ class TableCanvas(tk.Canvas):
         self.bind("<Control-n>", self.addRow)
         self.bind("<Delete>", self.clearData)
         self.bind("<Control-v>", self.paste)
+        self.bind("<Control-z>", self.undo)
+        self.bind("<Control-y>", self.redo)
 
         # if not hasattr(self,'parentapp'):
         #    self.parentapp = self.parentframe
@@ -223,13 +252,69 @@ class TableCanvas(tk.Canvas):
         self.focus_set()
         return
 
+    def destroy(self):
+        # a pending idle redraw or heartbeat must not run on the destroyed
+        # canvas
+        self.redraws.close()
+        self.stopMonitor()
+        tk.Canvas.destroy(self)
+        return
+
     def getModel(self):
         """Get the current table model"""
         return self.model
 
     def setModel(self, model):
         """Set a new model - requires redraw to reflect changes"""
+        self.watchModel(model)
+        return
+
+    def watchModel(self, model):
+        """Use this model, listening to it for changes to redraw"""
+        if self.model is not None:
+            self.model.removeListener(self.modelChanged)
+        if self.searchindex is not None:
+            self.searchindex.close()
+            self.searchindex = None
         self.model = model
+        model.addListener(self.modelChanged)
+        self.invalidateGeometry()
+        return
+
+    def modelChanged(self, kind, recname=None, colname=None):
+        """Model listener, marks only the visible parts of the table that
+           a change affects for redrawing"""
+        if kind in ('structure', 'column'):
+            self.invalidateGeometry()
+        elif kind == 'row' and self.model.rowheights:
+            self.invalidateGeometry(cols=False)
+        redraws = self.redraws
+        if redraws.full or self.visiblerows is None:
+            # a full redraw is coming anyway
+            return
+        model = self.model
+        visible = self.visiblerows
+        if kind == 'cell':
+            if colname not in model.columnNames:
+                return
+            row = model.getRecordRow(recname)
+            if row is not None and visible and \
+                    visible[0] <= row <= visible[-1]:
+                redraws.markCell(row, model.getColumnIndex(colname))
+        elif kind == 'row':
+            row = None
+            if recname in model.data:
+                row = model.getRecordRow(recname)
+            if row is None:
+                # rows were added or removed
+                redraws.markAll()
+            elif visible and visible[0] <= row <= visible[-1]:
+                redraws.markRows(row, row + 1)
+        elif kind == 'column' and colname in model.columnNames:
+            redraws.markColumn(model.getColumnIndex(colname))
+            redraws.markHeader()
+        else:
+            redraws.markAll()
         return
 
     def createfromDict(self, data):
@@ -239,7 +324,7 @@ class TableCanvas(tk.Canvas):
             namefield = self.namefield
         except AttributeError:
             namefield = list(data.keys())[0]
-        self.model = TableModel()
+        self.watchModel(TableModel())
         self.model.importDict(data, namefield=namefield)
         self.model.setSortOrder(0, reverse=self.reverseorder)
         return
@@ -274,8 +359,8 @@ class TableCanvas(tk.Canvas):
         self.grid(row=1, column=1, rowspan=1, sticky='news', pady=0, ipady=0)
 
         self.adjustColumnWidths()
-        self.redrawTable(callback=callback)
-        self.parentframe.bind("<Configure>", self.redrawVisible)
+        self.redrawVisible(callback=callback)
+        self.parentframe.bind("<Configure>", self.redrawTable)
         self.tablecolheader.xview("moveto", 0)
         self.xview("moveto", 0)
         return
@@ -292,9 +377,7 @@ class TableCanvas(tk.Canvas):
 
     def getRowPosition(self, y):
         """Get current row from canvas position"""
-        h = self.rowheight
-        y_start = self.y_start
-        row = (int(y)-y_start)/h
+        row = self.getRowAxis().getIndex(y)
         if row < 0:
             return 0
         if row > self.rows:
@@ -303,17 +386,70 @@ class TableCanvas(tk.Canvas):
 
     def getColPosition(self, x):
         """Get current col from canvas position"""
-        # x_start = self.x_start
-        w = self.cellwidth
-        i = 0
-        col = 0
-        for c in self.col_positions:
-            col = i
-            if c + w >= x:
-                break
-            i += 1
+        col = self.getColumnAxis().getIndex(x)
+        if col < 0:
+            return 0
+        if col >= self.cols:
+            col = max(self.cols - 1, 0)
         return col
 
+    def getColumnAxis(self):
+        """Column geometry, rebuilt only after the widths, the number
+           or order of columns change. Widths in a plain dict rather than
+           a SizeDict can't be followed, so then it is always rebuilt"""
+        axis = self.colaxis
+        widths = self.model.columnwidths
+        version = getattr(widths, 'version', None)
+        key = (self.cols, self.cellwidth, self.x_start, id(widths), version)
+        if axis is None or self.colaxiskey != key or version is None:
+            model = self.model
+            widths = model.columnwidths
+            sizes = {}
+            for col, colname in enumerate(model.columnNames[:self.cols]):
+                if colname in widths:
+                    sizes[col] = widths[colname]
+            axis = self.colaxis = Axis(self.x_start, self.cellwidth,
+                                       self.cols, sizes)
+            self.colaxiskey = key
+        return axis
+
+    def getRowAxis(self):
+        """Row geometry, rows have the row height unless the model gives
+           their record another one in rowheights"""
+        axis = self.rowaxis
+        model = self.model
+        if self.filtered and model.filteredrecs is not None:
+            names = model.filteredrecs
+        else:
+            names = model.reclist
+        heights = model.rowheights
+        version = getattr(heights, 'version', None)
+        key = (self.rows, self.rowheight, self.y_start, id(names),
+               id(heights), version)
+        if axis is None or self.rowaxiskey != key or version is None:
+            sizes = {}
+            for recname, h in model.rowheights.items():
+                row = model.getRecordRow(recname)
+                if row is not None:
+                    sizes[row] = h
+            axis = self.rowaxis = Axis(self.y_start, self.rowheight,
+                                       self.rows, sizes)
+            self.rowaxiskey = key
+        return axis
+
+    def invalidateGeometry(self, rows=True, cols=True):
+        """Forget the cached row or column geometry"""
+        if rows:
+            self.rowaxis = None
+        if cols:
+            self.colaxis = None
+        return
+
+    def getTableHeight(self):
+        """Height of all the rows"""
+        axis = self.getRowAxis()
+        return axis.getEnd() - axis.start
+
     def getVisibleRows(self, y1, y2):
         """Get the visible row range"""
         start = self.getRowPosition(y1)
@@ -330,8 +466,11 @@ class TableCanvas(tk.Canvas):
             end = self.cols
         return start, end
 
+    @traced('redraw')
     def redrawVisible(self, event=None, callback=None):
         """Redraw the visible portion of the canvas"""
+        # this draws everything that was waiting to be redrawn
+        self.redraws.reset()
         model = self.model
         self.rows = self.model.getRowCount()
         self.cols = self.model.getColumnCount()
@@ -347,7 +486,7 @@ class TableCanvas(tk.Canvas):
 
         self.rowrange = list(range(0, self.rows))
         self.configure(scrollregion=(0, 0, self.tablewidth + self.x_start,
-                                     self.rowheight * self.rows + 10))
+                                     self.getTableHeight() + 10))
 
         x1, y1, x2, y2 = self.getVisibleRegion()
         startvisiblerow, endvisiblerow = self.getVisibleRows(y1, y2)
@@ -362,45 +501,92 @@ class TableCanvas(tk.Canvas):
             self.delete('rowrect')
             self.delete('currentrect')
             self.delete('gridline', 'text')
+            for pool in (self.textpool, self.fillpool, self.gridpool):
+                pool.clear()
+            self.linkcells = set()
             self.tablerowheader.redraw()
             return
 
-        self.drawGrid(startvisiblerow, endvisiblerow)
+        with span('redraw.grid'):
+            self.drawGrid(startvisiblerow, endvisiblerow)
         align = self.align
-        self.delete('fillrect')
+        if self.recycleitems:
+            self.delete('hlink')
+            self.linkcells = set()
+            self.textpool.begin()
+            self.fillpool.begin()
+        else:
+            self.delete('fillrect')
+        # the time of the text and colors of the cells is added up only
+        # while tracing, so the loop costs the same as ever when it is off
+        timed = tracer.enabled
+        texttime = colortime = 0.0
         for row in self.visiblerows:
             if callback is not None:
                 callback()
             for col in self.visiblecols:
-                # colname = model.getColumnName(col)
-                bgcolor = model.getColorAt(row, col, 'bg')
+                if timed:
+                    start = perf_counter()
                 fgcolor = model.getColorAt(row, col, 'fg')
                 text = model.getValueAt(row, col)
                 self.drawText(row, col, text, fgcolor, align)
+                if timed:
+                    middle = perf_counter()
+                    texttime += middle - start
+                bgcolor = model.getColorAt(row, col, 'bg')
                 if bgcolor is not None:
                     self.drawRect(row, col, color=bgcolor)
+                if timed:
+                    colortime += perf_counter() - middle
+        if timed:
+            tracer.addTime('redraw.text', texttime)
+            tracer.addTime('redraw.colors', colortime)
+        if self.recycleitems:
+            with span('redraw.pools'):
+                self.textpool.end()
+                self.fillpool.end()
+                self.lower('fillrect')
 
         # self.drawSelectedCol()
-        self.tablecolheader.redraw()
-        self.tablerowheader.redraw(align=self.align,
-                                   showkeys=self.showkeynamesinheader)
-        # self.setSelectedRow(self.currentrow)
-        self.drawSelectedRow()
-        self.drawSelectedRect(self.currentrow, self.currentcol)
-        # print self.multiplerowlist
-
-        if len(self.multiplerowlist) > 1:
-            self.tablerowheader.drawSelectedRows(self.multiplerowlist)
-            self.drawMultipleRows(self.multiplerowlist)
-            self.drawMultipleCells()
+        with span('redraw.headers'):
+            self.tablecolheader.redraw()
+            self.tablerowheader.redraw(align=self.align,
+                                       showkeys=self.showkeynamesinheader)
+        with span('redraw.selection'):
+            self.drawSelectedRow()
+            self.drawSelectedRect(self.currentrow, self.currentcol)
+            if len(self.multiplerowlist) > 1:
+                self.tablerowheader.drawSelectedRows(self.multiplerowlist)
+                self.drawMultipleRows(self.multiplerowlist)
+                self.drawMultipleCells()
         return
 
     def redrawTable(self, event=None, callback=None):
-        """
-        """
-        self.redrawVisible(event, callback)
+        """Redraw the table the next time Tk is idle, so that several
+           calls in a row draw only once. A callback forces an immediate
+           redraw as it is called for every row drawn"""
+        if callback is not None:
+            self.redrawVisible(event, callback)
+        else:
+            self.redraws.markAll()
+        return
+
+    def undo(self, event=None):
+        """Undo the last edit to the model"""
+        self.model.undo()
         return
 
+    def redo(self, event=None):
+        """Redo the last undone edit"""
+        self.model.redo()
+        return
+
+    def batchUpdate(self):
+        """Context manager that defers all drawing until it exits, e.g.
+           with table.batchUpdate():
+               ...many edits..."""
+        return self.redraws.batch()
+
     def redrawCell(self, row=None, col=None, recname=None, colname=None):
         """Redraw a specific cell only"""
         if row is None and recname is not None:
@@ -411,8 +597,11 @@ class TableCanvas(tk.Canvas):
         fgcolor = self.model.getColorAt(row, col, 'fg')
         text = self.model.getValueAt(row, col)
         self.drawText(row, col, text, fgcolor)
-        if bgcolor is not None:
-            self.drawRect(row, col, color=bgcolor)
+        self.drawRect(row, col, color=bgcolor)
+        # keep the text of selected cells above the selection
+        if (row == self.currentrow and col == self.currentcol) or \
+                (row in self.multiplerowlist and col in self.multiplecollist):
+            self.liftCellText(row, col)
         return
 
     def adjustColumnWidths(self):
@@ -423,23 +612,28 @@ class TableCanvas(tk.Canvas):
             fontsize = self.thefont[1]
         except AttributeError:
             fontsize = self.fontsize
-        scale = 8.5 * float(fontsize)/12
+        widths = self.getTextWidths()
         for col in range(self.cols):
             colname = self.model.getColumnName(col)
             if colname in self.model.columnwidths:
                 w = self.model.columnwidths[colname]
             else:
                 w = self.cellwidth
-            maxlen = self.model.getlongestEntry(col)
-            size = maxlen * scale
+            text = self.model.getLongestText(col, sample=self.widthsample)
+            size = widths.measure(text)
             if size < w:
                 continue
             # print col, size, self.cellwidth
             if size >= self.maxcellwidth:
                 size = self.maxcellwidth
             self.model.columnwidths[colname] = size + float(fontsize)/12*6
+        self.invalidateGeometry(rows=False)
         return
 
+    def getTextWidths(self):
+        """Glyph width table of the table font"""
+        return TextWidths.forFont(self.thefont, self)
+
     def autoResizeColumns(self):
         """Automatically set nice column widths and draw"""
         self.adjustColumnWidths()
@@ -448,25 +642,17 @@ class TableCanvas(tk.Canvas):
 
     def setColPositions(self):
         """Determine current column grid positions"""
-        self.col_positions = []
-        w = self.cellwidth
-        x_pos = self.x_start
-        self.col_positions.append(x_pos)
-        for col in range(self.cols):
-            colname = self.model.getColumnName(col)
-            if colname in self.model.columnwidths:
-                x_pos = x_pos + self.model.columnwidths[colname]
-            else:
-                x_pos = x_pos + w
-            self.col_positions.append(x_pos)
-        self.tablewidth = self.col_positions[len(self.col_positions)-1]
+        self.col_positions = self.getColumnAxis().getPositions()
+        self.tablewidth = self.col_positions[-1]
         return
 
-    def sortTable(self, columnIndex=0, columnName=None, reverse=0):
-        """Set up sort order dict based on currently selected field"""
+    def sortTable(self, columnIndex=0, columnName=None, reverse=0,
+                  sortkeys=None):
+        """Set up sort order dict based on currently selected field,
+           or on several fields if a list of sortkeys is given"""
         # if columnName is not None:
         #    columnIndex = self.model.getColumnIndex(columnName)
-        self.model.setSortOrder(columnIndex, columnName, reverse)
+        self.model.setSortOrder(columnIndex, columnName, reverse, sortkeys)
         self.redrawTable()
         return
 
@@ -505,6 +691,13 @@ class TableCanvas(tk.Canvas):
         self.setSelectedRow(self.model.getRecordIndex(keys[0]))
         return
 
+    def appendRecords(self, records=None, columns=None, keys=None):
+        """Add many records at the end of the table and draw them once,
+           see TableModel.appendRecords. returns: the new keys"""
+        with self.batchUpdate():
+            keys = self.model.appendRecords(records, columns, keys)
+        return keys
+
     def addColumn(self, newname=None):
         """Add a new column"""
         if newname is None:
@@ -575,11 +768,11 @@ class TableCanvas(tk.Canvas):
                                    parent=self.parentframe)
         if not n:
             return
-        for col in cols:
-            for row in rows:
-                # absrow = self.get_AbsoluteRow(row)
-                self.model.deleteCellRecord(row, col)
-                self.redrawCell(row, col)
+        with self.model.journal.group():
+            for col in cols:
+                for row in rows:
+                    # absrow = self.get_AbsoluteRow(row)
+                    self.model.deleteCellRecord(row, col)
         return
 
     def clearData(self, evt=None):
@@ -612,46 +805,117 @@ class TableCanvas(tk.Canvas):
                          parent=self.parentframe, table=self, row=row)
         return
 
-    def findValue(self, searchstring=None, findagain=None):
-        """Return the row/col for the input value"""
+    def getSearchIndex(self):
+        """The search index of the model, made when first needed"""
+        if self.searchindex is None:
+            from Filtering import SearchIndex
+            self.searchindex = SearchIndex(self.model)
+        return self.searchindex
+
+    def findValue(self, searchstring=None, findagain=None, regex=False,
+                  case=False):
+        """Return the row/col for the input value, with findagain the next
+           one after the last found"""
         if searchstring is None:
             searchstring = tk.simpledialog.askstring("Search table.",
                                                      "Enter search value",
                                                      parent=self.parentframe)
-        found = 0
-        if findagain is None or not hasattr(self, 'foundlist'):
-            self.foundlist = []
-        if self.model is not None:
-            for row in range(self.rows):
-                for col in range(self.cols):
-                    text = str(self.model.getValueAt(row, col))
-                    if text == '' or text is None:
-                        continue
-                    cell = row, col
-                    if findagain == 1 and cell in self.foundlist:
-                        continue
-                    if text.lower().find(searchstring.lower()) != -1:
-                        print('found in', row, col)
-                        found = 1
-                        # highlight cell
-                        self.delete('searchrect')
-                        self.drawRect(row, col, color='red',
-                                      tag='searchrect', delete=0)
-                        self.lift('searchrect')
-                        self.lift('celltext' + str(col) + '_' + str(row))
-                        # add row/col to foundlist
-                        self.foundlist.append(cell)
-                        # need to scroll to centre the cell here..
-                        x, y = self.getCanvasPos(row, col)
-                        self.xview('moveto', x)
-                        self.yview('moveto', y)
-                        self.tablecolheader.xview('moveto', x)
-                        self.tablerowheader.yview('moveto', y)
-                        return row, col
-        if found == 0:
+        if not searchstring or self.model is None:
+            return None
+        row, col = -1, -1
+        if findagain is not None and self.foundcell is not None:
+            row, col = self.foundcell
+        try:
+            cell = self.getSearchIndex().findNext(searchstring, row, col,
+                                                  regex=regex, case=case)
+        except re.error as e:
+            tk.messagebox.showwarning('Search', 'Bad expression: ' + str(e),
+                                      parent=self.parentframe)
+            return None
+        self.foundcell = cell
+        if cell is None:
             self.delete('searchrect')
-            print('nothing found')
             return None
+        self.delete('searchrect')
+        self.showFound(*cell)
+        return cell
+
+    def findAll(self, searchstring, regex=False, case=False, ondone=None):
+        """Find every cell holding searchstring and mark those in view.
+           Tables with more cells than backgroundsearch are searched on a
+           worker thread from a snapshot of the model.
+           ondone: called with the list of (row, col) found"""
+        def found(cells):
+            self.delete('searchrect')
+            self.foundcell = None
+            if cells:
+                rows = set(self.visiblerows or [])
+                cols = set(self.visiblecols or [])
+                for row, col in cells:
+                    if row in rows and col in cols:
+                        self.drawRect(row, col, color='red',
+                                      tag='searchrect', delete=0)
+                self.showFound(*cells[0])
+                self.foundcell = cells[0]
+            if ondone is not None:
+                ondone(cells)
+            return
+
+        if regex:
+            try:
+                re.compile(searchstring)
+            except re.error as e:
+                tk.messagebox.showwarning('Search',
+                                          'Bad expression: ' + str(e),
+                                          parent=self.parentframe)
+                return
+        model = self.model
+        if model.getRowCount() * model.getColumnCount() > \
+                self.backgroundsearch:
+            from Filtering import SearchIndex
+            index = SearchIndex(model.snapshot())
+            self.runInBackground(index.findAll, searchstring, regex=regex,
+                                 case=case, ondone=found,
+                                 message='Searching..')
+            return
+        found(self.getSearchIndex().findAll(searchstring, regex=regex,
+                                            case=case))
+        return
+
+    def showFound(self, row, col):
+        """Mark a found cell and scroll it into view"""
+        # highlight cell
+        self.drawRect(row, col, color='red', tag='searchrect', delete=0)
+        self.lift('searchrect')
+        self.liftCellText(row, col)
+        # need to scroll to centre the cell here..
+        x, y = self.getCanvasPos(row, col)
+        self.xview('moveto', x)
+        self.yview('moveto', y)
+        self.tablecolheader.xview('moveto', x)
+        self.tablerowheader.yview('moveto', y)
+        return
+
+    def startMonitor(self, threshold=0.2, hud=False):
+        """Watch the main loop for stalls longer than threshold seconds,
+           see Monitoring.StallMonitor. hud: also show redraw time, item
+           count and the last stall in a corner of the table"""
+        if self.monitor is None:
+            self.monitor = StallMonitor(self, threshold=threshold)
+            self.monitor.start()
+        if hud and self.hud is None:
+            self.hud = StatusHUD(self.parentframe, self.monitor,
+                                 lambda: self)
+        return self.monitor
+
+    def stopMonitor(self):
+        if self.hud is not None:
+            self.hud.close()
+            self.hud = None
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.monitor = None
+        return
 
     def showAll(self):
         self.model.filteredrecs = None
@@ -667,8 +931,10 @@ class TableCanvas(tk.Canvas):
         """
         if self.model is None:
             return
-        names = self.filterframe.doFiltering(searchfunc=self.model.filterBy)
-        # create a list of filtered recs
+        filters = self.filterframe.getFilters()
+        names = self.model.filterRecords(filters)
+        self.filterframe.updateResults(len(names))
+        # create a list of filtered recs, kept in the current record order
         self.model.filteredrecs = names
         self.filtered = True
         self.redrawTable()
@@ -712,6 +978,7 @@ class TableCanvas(tk.Canvas):
         # recalculate all col positions..
         colname = self.model.getColumnName(col)
         self.model.columnwidths[colname] = width
+        self.invalidateGeometry(rows=False)
         self.setColPositions()
         self.redrawTable()
         self.drawSelectedCol(self.currentcol)
@@ -747,36 +1014,18 @@ class TableCanvas(tk.Canvas):
 
     def get_row_clicked(self, event):
         """get row where event on canvas occurs"""
-        h = self.rowheight
         # get coord on canvas, not window, need this if scrolling
         y = int(self.canvasy(event.y))
-        y_start = self.y_start
-        rowc = (int(y)-y_start)/h
-        # rowc = math.floor(rowc)
-        # print 'event.y',event.y, 'y',y
-        # print 'rowclicked', rowc
-        return rowc
+        return self.getRowAxis().getIndex(y)
 
     def get_col_clicked(self, event):
         """get col where event on canvas occurs"""
         # w = self.cellwidth
         x = int(self.canvasx(event.x))
-        # x_start = self.x_start    # originally was not commented-out
-        # print self.col_positions
-        for colpos in self.col_positions:
-            try:
-                nextpos = self.col_positions[self.col_positions.index(colpos) +
-                                             1]
-            except (AttributeError, IndexError):
-                nextpos = self.tablewidth
-            if x > colpos and x <= nextpos:
-                # print 'x=', x, 'colpos', colpos,
-                # self.col_positions.index(colpos)
-                return self.col_positions.index(colpos)
-            else:
-                # print None
-                pass
-        # return colc
+        col = self.getColumnAxis().getIndex(x)
+        if 0 <= col < self.cols:
+            return col
+        return None
 
     def setSelectedRow(self, row):
         """Set currently selected row and reset multiple row list"""
@@ -828,21 +1077,8 @@ class TableCanvas(tk.Canvas):
 
     def getCellCoords(self, row, col):
         """Get x-y coordinates to drawing a cell in a given row/col"""
-        colname = self.model.getColumnName(col)
-        if colname in self.model.columnwidths:
-            w = self.model.columnwidths[colname]
-        else:
-            w = self.cellwidth
-        h = self.rowheight
-        x_start = self.x_start
-        y_start = self.y_start
-
-        # get nearest rect co-ords for that row/col
-        x1 = x_start + w * col
-        x1 = self.col_positions[col]
-        y1 = y_start+h*row
-        x2 = x1 + w
-        y2 = y1 + h
+        x1, x2 = self.getColumnAxis().getSpan(col)
+        y1, y2 = self.getRowAxis().getSpan(row)
         return x1, y1, x2, y2
 
     def getCanvasPos(self, row, col):
@@ -852,21 +1088,26 @@ class TableCanvas(tk.Canvas):
         # x1, y1, x2, y2 = self.getCellCoords(row, col)
         x1, y1, _, _ = self.getCellCoords(row, col)
         cx = float(x1) / self.tablewidth
-        cy = float(y1) / (self.rows * self.rowheight)
+        cy = float(y1) / self.getTableHeight()
         return cx, cy
 
     def isInsideTable(self, x, y):
         """Returns true if x-y coord is inside table bounds"""
         if (self.x_start < x < self.tablewidth and
-                self.y_start < y < self.rows * self.rowheight):
+                self.y_start < y < self.getTableHeight()):
             return 1
         else:
             return 0
         # return answer
 
-    def setRowHeight(self, h):
-        """Set the row height"""
-        self.rowheight = h
+    def setRowHeight(self, h, row=None):
+        """Set the row height, or the height of one row only"""
+        if row is None:
+            self.rowheight = h
+        else:
+            recname = self.model.getRecName(row)
+            self.model.rowheights[recname] = h
+        self.invalidateGeometry(cols=False)
         return
 
     def clearSelected(self):
@@ -1188,10 +1429,8 @@ class TableCanvas(tk.Canvas):
             """ get text area contents and do formula """
             f = self.formulaText.get(1.0, 'end')
             f = f.strip('\n')
+            # the model change redraws the cell
             self.model.setFormulaAt(f, row, col)
-            value = self.model.doFormula(f)
-            color = self.model.getColorAt(row, col, 'fg')
-            self.drawText(row, col, value, color)
             close()
             self.mode = 'normal'
 
@@ -1228,14 +1467,14 @@ class TableCanvas(tk.Canvas):
         if len(self.multiplerowlist) == 0 or len(self.multiplecollist) == 0:
             return None
 
-        print(rows, cols)
         if cols is None:
             cols = list(range(self.cols))
-        for r in rows:
-            # absr=self.get_AbsoluteRow(r)
-            for c in cols:
-                val = self.model.getValueAt(r, c)
-                self.model.setValueAt(val, r, c)
+        with self.model.journal.group():
+            for r in rows:
+                # absr=self.get_AbsoluteRow(r)
+                for c in cols:
+                    val = self.model.getValueAt(r, c)
+                    self.model.setValueAt(val, r, c)
         return
 
     def paste(self, event=None):
@@ -1258,7 +1497,6 @@ class TableCanvas(tk.Canvas):
         # absrow = self.get_AbsoluteRow(row)
         val = self.clipboard
         self.model.setValueAt(val, row, col)
-        self.redrawTable()
         return
 
     def copyColumns(self):
@@ -1273,16 +1511,16 @@ class TableCanvas(tk.Canvas):
     def pasteColumns(self, coldata):
         """Paste new cols, overwrites existing names"""
         M = self.model
-        for name in coldata:
-            if name not in M.columnNames:
-                M.addColumn(name)
-            for r in range(len(coldata[name])):
-                val = coldata[name][r]
-                col = M.columnNames.index(name)
-                if r >= self.rows:
-                    break
-                M.setValueAt(val, r, col)
-        self.redrawTable()
+        with M.journal.group():
+            for name in coldata:
+                if name not in M.columnNames:
+                    M.addColumn(name)
+                for r in range(len(coldata[name])):
+                    val = coldata[name][r]
+                    col = M.columnNames.index(name)
+                    if r >= self.rows:
+                        break
+                    M.setValueAt(val, r, col)
         return coldata
 
     # --- Some cell specific actions here ---
@@ -1309,13 +1547,14 @@ class TableCanvas(tk.Canvas):
             rows = list(range(0, self.rows))
         if cols is None:
             cols = list(range(self.cols))
-        for col in cols:
-            for row in rows:
-                # absrow = self.get_AbsoluteRow(row)
-                model.setColorAt(row, col, color=newColor, key=key)
-                # setcolor(absrow, col)
+        with model.journal.group():
+            for col in cols:
+                for row in rows:
+                    # absrow = self.get_AbsoluteRow(row)
+                    model.setColorAt(row, col, color=newColor, key=key)
+                    # setcolor(absrow, col)
         if redraw:
-            self.redrawTable()
+            self.redraws.markCells(rows, cols)
         return
 
     def popupMenu(self, event, rows=None, cols=None, outside=None):
@@ -1337,6 +1576,8 @@ class TableCanvas(tk.Canvas):
             "View Record": lambda: self.getRecordInfo(row),
             "Clear Data": lambda: self.deleteCells(rows, cols),
             "Select All": self.select_All,
+            "Undo": self.undo,
+            "Redo": self.redo,
             "Auto Fit Columns": self.autoResizeColumns,
             "Filter Records": self.showFilteringBar,
             "New": self.new,
@@ -1344,6 +1585,7 @@ class TableCanvas(tk.Canvas):
             "Save": self.save,
             "Import text": self.importTable,
             "Export csv": self.exportTable,
+            "Export Selected": lambda: self.exportTable(selection=True),
             "Plot Selected": self.plotSelected,
             "Plot Options": self.plotSetup,
             "Export Table": self.exportTable,
@@ -1352,9 +1594,11 @@ class TableCanvas(tk.Canvas):
 
         main = ["Set Fill Color", "Set Text Color", "Copy", "Paste",
                 "Fill Down", "Fill Right", "Clear Data"]
-        general = ["Select All", "Add Row(s)", "Delete Row(s)",
-                   "Auto Fit Columns", "Filter Records", "Preferences"]
-        filecommands = ['New', 'Load', 'Save', 'Import text', 'Export csv']
+        general = ["Undo", "Redo", "Select All", "Add Row(s)",
+                   "Delete Row(s)", "Auto Fit Columns", "Filter Records",
+                   "Preferences"]
+        filecommands = ['New', 'Load', 'Save', 'Import text', 'Export csv',
+                        'Export Selected']
         plotcommands = ['Plot Selected', 'Plot Options']
         utilcommands = ["View Record", "Formulae->Value"]
 
@@ -1427,21 +1671,20 @@ class TableCanvas(tk.Canvas):
         rowlist.remove(rowlist[0])
 
         # if this is a formula, we have to treat it specially
-        for col in collist:
-            val = self.model.getCellRecord(row, col)
-            f = val  # formula to copy
-            # i = 1
-            for i, r in enumerate(rowlist, 1):
-                # absr = self.get_AbsoluteRow(r)
-                if Formula.isFormula(f):
-                    newval = model.copyFormula(f, r, col, offset=i)
-                    model.setFormulaAt(newval, r, col)
-                else:
-                    model.setValueAt(val, r, col)
-                # print 'setting', val, 'at row', r
-                # i += 1
-
-        self.redrawTable()
+        with model.journal.group():
+            for col in collist:
+                val = self.model.getCellRecord(row, col)
+                f = val  # formula to copy
+                # i = 1
+                for i, r in enumerate(rowlist, 1):
+                    # absr = self.get_AbsoluteRow(r)
+                    if Formula.isFormula(f):
+                        newval = model.copyFormula(f, r, col, offset=i)
+                        model.setFormulaAt(newval, r, col)
+                    else:
+                        model.setValueAt(val, r, col)
+                    # print 'setting', val, 'at row', r
+                    # i += 1
         return
 
     def fillAcross(self, collist, rowlist):
@@ -1452,23 +1695,25 @@ class TableCanvas(tk.Canvas):
         frstcol = collist[0]
         collist.remove(frstcol)
 
-        for row in rowlist:
-            # absr = self.get_AbsoluteRow(row)  # was commented out but req'd?
-            # val = self.model.getCellRecord(absr, frstcol)  # original
-            val = self.model.getCellRecord(row, frstcol)
-            f = val     # formula to copy
-            # i = 1
-            for i, c in enumerate(collist):
-                if Formula.isFormula(f):
-                    # newval = model.copyFormula(f, r, c, offset=i, dim='x')
-                    newval = model.copyFormula(f, row, c, offset=i, dim='x')
-                    # model.setFormulaAt(newval, r, c)
-                    model.setFormulaAt(newval, row, c)
-                else:
-                    # model.setValueAt(val, r, c)
-                    model.setValueAt(val, row, c)
-                # i += 1
-        self.redrawTable()
+        with model.journal.group():
+            for row in rowlist:
+                # absr = self.get_AbsoluteRow(row)  # was commented out
+                # val = self.model.getCellRecord(absr, frstcol)  # original
+                val = self.model.getCellRecord(row, frstcol)
+                f = val     # formula to copy
+                # i = 1
+                for i, c in enumerate(collist):
+                    if Formula.isFormula(f):
+                        # newval = model.copyFormula(f, r, c, offset=i,
+                        #                            dim='x')
+                        newval = model.copyFormula(f, row, c, offset=i,
+                                                   dim='x')
+                        # model.setFormulaAt(newval, r, c)
+                        model.setFormulaAt(newval, row, c)
+                    else:
+                        # model.setValueAt(val, r, c)
+                        model.setValueAt(val, row, c)
+                    # i += 1
         return
 
     def getSelectionValues(self):
@@ -1530,7 +1775,6 @@ class TableCanvas(tk.Canvas):
             self.pyplot = pylabPlotter()
         plotdata = self.getSelectionValues()
         if not self.pyplot.hasData() and plotdata is not None:
-            print('has data')
             plotdata = self.getSelectionValues()
             pltlabels = self.getplotlabels()
             self.pyplot.setDataSeries(pltlabels)
@@ -1550,39 +1794,69 @@ class TableCanvas(tk.Canvas):
 
     def drawGrid(self, startrow, endrow):
         """Draw the table grid lines"""
+        if self.recycleitems:
+            self.drawPooledGrid(startrow, endrow)
+            return
         self.delete('gridline', 'text')
-        rows = len(self.rowrange)
         cols = self.cols
         # w = self.cellwidth  # Not originally commented-out
-        h = self.rowheight
+        rowaxis = self.getRowAxis()
         x_start = self.x_start
         y_start = self.y_start
+        y_end = rowaxis.getEnd()
         # x_pos = x_start  # Not originally commented-out
 
         if self.vertlines == 1:
             for col in range(cols+1):
                 x = self.col_positions[col]
-                self.create_line(x, y_start, x, y_start + rows * h,
+                self.create_line(x, y_start, x, y_end,
                                  tag='gridline', fill=self.grid_color,
                                  width=self.linewidth)
         if self.horizlines == 1:
             for row in range(int(startrow), int(endrow + 1)):
-                y_pos = y_start + row * h
+                y_pos = rowaxis.getPosition(row)
                 self.create_line(x_start, y_pos, self.tablewidth, y_pos,
                                  tag='gridline', fill=self.grid_color,
                                  width=self.linewidth)
         return
 
+    def drawPooledGrid(self, startrow, endrow):
+        """Draw the grid lines reusing the line items of the last redraw"""
+        pool = self.gridpool
+        rowaxis = self.getRowAxis()
+        x_start = self.x_start
+        y_start = self.y_start
+        y_end = rowaxis.getEnd()
+        options = {'fill': self.grid_color, 'width': self.linewidth}
+        pool.begin()
+        if self.vertlines == 1:
+            # only the lines of the visible columns
+            if self.visiblecols:
+                cols = range(self.visiblecols[0], self.visiblecols[-1] + 2)
+            else:
+                cols = range(self.cols + 1)
+            for col in cols:
+                x = self.col_positions[col]
+                pool.place(('v', col), (x, y_start, x, y_end), **options)
+        if self.horizlines == 1:
+            for row in range(int(startrow), int(endrow + 1)):
+                y_pos = rowaxis.getPosition(row)
+                pool.place(('h', row),
+                           (x_start, y_pos, self.tablewidth, y_pos),
+                           **options)
+        pool.end()
+        return
+
     def drawRowHeader(self):
         """User has clicked to select a cell"""
         self.delete('rowheader')
         x_start = self.x_start
         # y_start = self.y_start  # Not originally commented-out
-        h = self.rowheight
         # rowpos = 0
         for rowpos, row in enumerate(self.rowrange):
             # x1, y1, x2, y2 = self.getCellCoords(rowpos, 0)
             _, y1, _, y2 = self.getCellCoords(rowpos, 0)
+            h = y2 - y1
             self.create_rectangle(0,
                                   y1,
                                   x_start - 2,
@@ -1604,7 +1878,6 @@ class TableCanvas(tk.Canvas):
         """User has clicked to select a cell"""
         if col >= self.cols:
             return
-        self.delete('currentrect')
         bg = self.selectedcolor
         if color is None:
             color = 'gray25'
@@ -1619,22 +1892,47 @@ class TableCanvas(tk.Canvas):
         #                              width=w,
         #                              stipple='gray50',
         #                              tag='currentrect')
-        self.create_rectangle(x1 + w / 2,
-                              y1 + w / 2,
-                              x2 - w / 2,
-                              y2 - w / 2,
-                              fill=bg,
-                              outline=color,
-                              width=w,
-                              stipple='gray50',
-                              tag='currentrect')
-        # self.lower('currentrect')
+        self.placeRectangle('currentrect',
+                            x1 + w / 2,
+                            y1 + w / 2,
+                            x2 - w / 2,
+                            y2 - w / 2,
+                            fill=bg,
+                            outline=color,
+                            width=w,
+                            stipple='gray50')
+        self.lift('currentrect')
         # raise text above all
-        self.lift('celltext' + str(col) + '_' + str(row))
+        self.liftCellText(row, col)
+        return
+
+    def placeRectangle(self, tag, x1, y1, x2, y2, **kwargs):
+        """Move the rectangle with tag to the coordinates given, creating
+           it if there is none, so the selection isn't made again on
+           every redraw"""
+        items = self.find_withtag(tag)
+        if not items:
+            return self.create_rectangle(x1, y1, x2, y2, tag=tag, **kwargs)
+        if len(items) > 1:
+            self.delete(*items[1:])
+        self.coords(items[0], x1, y1, x2, y2)
+        self.itemconfigure(items[0], **kwargs)
+        return items[0]
+
+    def liftCellText(self, row, col):
+        """Raise the text of a cell above other items"""
+        item = self.textpool.get((row, col)) if self.recycleitems else None
+        if item is not None:
+            self.lift(item)
+        else:
+            self.lift('celltext' + str(col) + '_' + str(row))
         return
 
     def drawRect(self, row, col, color=None, tag=None, delete=1):
         """Cell is colored"""
+        if tag is None and self.recycleitems:
+            self.drawPooledRect(row, col, color)
+            return
         if delete == 1:
             self.delete('cellbg'+str(row)+str(col))
         if color is None or color == self.cellbackgr:
@@ -1664,6 +1962,20 @@ class TableCanvas(tk.Canvas):
         self.lower(recttag)
         return
 
+    def drawPooledRect(self, row, col, color=None):
+        """Color a cell with a recycled rectangle"""
+        if color is None or color == self.cellbackgr:
+            self.fillpool.release((row, col))
+            return
+        w = 1
+        x1, y1, x2, y2 = self.getCellCoords(row, col)
+        self.fillpool.place((row, col),
+                            (x1 + w / 2, y1 + w / 2, x2 - w / 2, y2 - w / 2),
+                            fill=color, outline=color, width=w)
+        if self.fillpool.old is None:
+            self.lower('fillrect')
+        return
+
     def drawCellEntry(self, row, col, text=None):
         """When the user single/double clicks on a text/number cell,
            bring up entry window"""
@@ -1671,7 +1983,6 @@ class TableCanvas(tk.Canvas):
         if not self.editable:
             return
         # absrow = self.get_AbsoluteRow(row)
-        h = self.rowheight
         model = self.getModel()
         cellvalue = self.model.getCellRecord(row, col)
         if Formula.isFormula(cellvalue):
@@ -1679,8 +1990,9 @@ class TableCanvas(tk.Canvas):
         else:
             text = self.model.getValueAt(row, col)
         # x1, y1, x2, y2 = self.getCellCoords(row, col)
-        x1, y1, x2, _ = self.getCellCoords(row, col)
+        x1, y1, x2, y2 = self.getCellCoords(row, col)
         w = x2 - x1
+        h = y2 - y1
         # Draw an entry window
         txtvar = tk.StringVar()
         txtvar.set(text)
@@ -1703,9 +2015,6 @@ class TableCanvas(tk.Canvas):
                     model.setValueAt(value, row, col)
             elif coltype == 'text':
                 model.setValueAt(value, row, col)
-
-            color = self.model.getColorAt(row, col, 'fg')
-            self.drawText(row, col, value, color, align=self.align)
             if e.keysym == 'Return':
                 self.delete('entry')
                 # self.drawRect(row, col)
@@ -1749,11 +2058,15 @@ class TableCanvas(tk.Canvas):
 
     def drawText(self, row, col, celltxt, fgcolor=None, align=None):
         """Draw the text inside a cell area"""
-        self.delete('celltext'+str(col)+'_'+str(row))
-        h = self.rowheight
+        if not self.recycleitems:
+            self.delete('celltext'+str(col)+'_'+str(row))
+        elif (row, col) in self.linkcells:
+            self.delete('celltext'+str(col)+'_'+str(row))
+            self.linkcells.discard((row, col))
         # x1, y1, x2, y2 = self.getCellCoords(row, col)
-        x1, y1, x2, _ = self.getCellCoords(row, col)
+        x1, y1, x2, y2 = self.getCellCoords(row, col)
         w = x2 - x1
+        h = y2 - y1
         # wrap = False  # Not originally commented-out
         pad = 5
         # If celltxt is a number then we make it a string
@@ -1761,10 +2074,10 @@ class TableCanvas(tk.Canvas):
         if isinstance(celltxt, (float, int)):
             celltxt = str(celltxt)
         length = len(celltxt)
-        if length == 0:
-            return
         # if cell width is less than x, print nothing
-        if w <= 10:
+        if length == 0 or w <= 10:
+            if self.recycleitems:
+                self.textpool.release((row, col))
             return
 
         if fgcolor is None or fgcolor == "None":
@@ -1776,25 +2089,20 @@ class TableCanvas(tk.Canvas):
         elif align == 'e':
             x1 = x1+w/2-pad
 
+        widths = self.getTextWidths()
         if w < 18:
             celltxt = '.'
-        else:
-            fontsize = self.fontsize
-            # colname = self.model.getColumnName(col)  # Not orig. commented
-            # scaling between canvas and text normalised to about font 14
-            scale = 8.5 * float(fontsize) / 12
-            size = length * scale
-            if size > w:
-                newlength = w / scale
-                # print w, size, length, newlength
-                celltxt = celltxt[0:int(math.floor(newlength))]
+        elif isinstance(celltxt, str):
+            # cut the text to what fits in the cell
+            celltxt = widths.fit(celltxt, w - pad)
 
         # if celltxt is dict then we are drawing a hyperlink
         if self.isLink(celltxt):
             haslink = 0
             linktext = celltxt['text']
-            if len(linktext) > w / scale or w < 28:
-                linktext = linktext[0:int(w / fontsize * 1.2) - 2] + '..'
+            if widths.measure(linktext) > w - pad or w < 28:
+                linktext = widths.fit(linktext,
+                                      w - pad - widths.measure('..')) + '..'
             if celltxt['link'] is not None and celltxt['link'] != '':
                 f, s = self.thefont
                 linkfont = (f, s, 'underline')
@@ -1804,6 +2112,9 @@ class TableCanvas(tk.Canvas):
                 linkfont = self.thefont
                 linkcolor = fgcolor
 
+            if self.recycleitems:
+                self.textpool.release((row, col))
+                self.linkcells.add((row, col))
             rect = self.create_text(x1 + w / 2,
                                     y1 + h / 2,
                                     text=linktext,
@@ -1814,7 +2125,11 @@ class TableCanvas(tk.Canvas):
             if haslink == 1:
                 self.tag_bind(rect, '<Double-Button-1>', self.check_hyperlink)
 
-        # just normal text
+        # just normal text, on a recycled item if we can
+        elif self.recycleitems:
+            self.textpool.place((row, col), (x1 + w / 2, y1 + h / 2),
+                                text=celltxt, fill=fgcolor,
+                                font=self.thefont, anchor=align)
         else:
             rect = self.create_text(x1 + w / 2,
                                     y1 + h / 2,
@@ -1836,7 +2151,6 @@ class TableCanvas(tk.Canvas):
 
     def drawSelectedRow(self):
         """Draw the highlight rect for the currently selected row"""
-        self.delete('rowrect')
         row = self.currentrow
         x1, y1, x2, y2 = self.getCellCoords(row, 0)
         x2 = self.tablewidth
@@ -1844,10 +2158,11 @@ class TableCanvas(tk.Canvas):
         #                              fill=self.rowselectedcolor,
         #                              outline=self.rowselectedcolor,
         #                              tag='rowrect')
-        self.create_rectangle(x1, y1, x2, y2,
-                              fill=self.rowselectedcolor,
-                              outline=self.rowselectedcolor,
-                              tag='rowrect')
+        # the multiple row selection is tagged rowrect too
+        self.delete('multiplesel')
+        self.placeRectangle('rowrect', x1, y1, x2, y2,
+                            fill=self.rowselectedcolor,
+                            outline=self.rowselectedcolor)
         self.lower('rowrect')
         self.lower('fillrect')
         self.tablerowheader.drawSelectedRows(self.currentrow)
@@ -1861,7 +2176,7 @@ class TableCanvas(tk.Canvas):
             col = self.currentcol
         w = 2
         x1, y1, x2, y2 = self.getCellCoords(0, col)
-        y2 = self.rows * self.rowheight
+        y2 = self.getRowAxis().getEnd()
         # rect = self.create_rectangle(x1 + w / 2, y1 + w / 2,
         #                              x2, y2 + w / 2,
         #                              outline='blue',
@@ -2311,14 +2626,15 @@ class TableCanvas(tk.Canvas):
             pass
         return
 
-    def show_progressbar(self, message=None):
-        """Show progress bar window for loading of data"""
+    def show_progressbar(self, message=None, cancel=None):
+        """Show progress bar window for loading of data, the bar is
+           self.bar and takes values from 0 to 100. The window is not
+           modal so the rest of the application stays usable.
+           cancel: called by a Cancel button if given"""
         progress_win = tk.Toplevel()  # Open a new window
         progress_win.title("Please Wait")
         # progress_win.geometry('+%d+%d' %(self.parentframe.rootx+200,
         # self.parentframe.rooty+200))
-        # force on top
-        progress_win.grab_set()
         progress_win.transient(self.parentframe)
         if message is None:
             message = 'Working'
@@ -2329,15 +2645,55 @@ class TableCanvas(tk.Canvas):
         progrlbl = tk.Label(progress_win, text='Progress:')
         # progrlbl.grid(row=1, column=0, sticky='news', padx=2, pady=4)
         progrlbl.pack(side='left', padx=2, pady=4)
-        import progressbar
-        self.bar = progressbar.ProgressBar(progress_win)
-        # self.bar.frame.grid(row=1, column=1, columnspan=2, padx=2, pady=4)
-        # self.bar.pack(side='right', padx=2, pady=4)  # doesn't work either
+        self.bar = ttk.Progressbar(progress_win, orient='horizontal',
+                                   length=200, mode='determinate',
+                                   maximum=100)
+        self.bar.pack(side='left', fill='x', expand=1, padx=2, pady=4)
+        if cancel is not None:
+            tk.Button(progress_win, text='Cancel',
+                      command=cancel).pack(side='right', padx=2, pady=4)
+            progress_win.protocol('WM_DELETE_WINDOW', cancel)
         return progress_win
 
+    def runInBackground(self, func, *args, **kwargs):
+        """Run func(*args, progress=..., cancel=..., **kwargs) on a worker
+           thread, e.g. an import or export, showing its progress.
+           message: text for the progress window
+           ondone: called on the Tk thread with the result unless the task
+           was cancelled.
+           returns: the BackgroundTask"""
+        from Tables_IO import BackgroundTask
+        message = kwargs.pop('message', None)
+        ondone = kwargs.pop('ondone', None)
+        win = None
+        bar = None
+
+        def setprogress(fraction):
+            bar['value'] = 100 * fraction
+            return
+
+        def finished(result):
+            win.destroy()
+            if result is not None and ondone is not None:
+                ondone(result)
+            return
+
+        def failed(error):
+            win.destroy()
+            tk.messagebox.showwarning('Error', str(error),
+                                      parent=self.parentframe)
+            return
+
+        task = BackgroundTask(self, func, args, kwargs,
+                              onprogress=setprogress, ondone=finished,
+                              onerror=failed)
+        win = self.show_progressbar(message, cancel=task.cancel)
+        bar = self.bar
+        return task.start()
+
     def updateModel(self, model):
         """Call this method to update the table model"""
-        self.model = model
+        self.watchModel(model)
         self.rows = self.model.getRowCount()
         self.cols = self.model.getColumnCount()
         self.tablewidth = (self.cellwidth)*self.cols
@@ -2369,7 +2725,7 @@ class TableCanvas(tk.Canvas):
                 parent=self.master,
                 defaultextension='.table',
                 initialdir=os.getcwd(),
-                filetypes=[('pickle', '*.table'),
+                filetypes=[('Table file', '*.table'),
                            ('All files', '*.*')])
         if not os.path.exists(filename):
             print('file does not exist')
@@ -2380,34 +2736,37 @@ class TableCanvas(tk.Canvas):
         return
 
     def save(self, filename=None):
-        """Save model to pickle file"""
+        """Save model to a table file"""
         if filename is None:
             filename = tk.filedialog.asksaveasfilename(
                 parent=self.master,
                 defaultextension='.table',
                 initialdir=os.getcwd(),
-                filetypes=[('pickle', '*.table'),
+                filetypes=[('Table file', '*.table'),
                            ('All files', '*.*')])
         if filename:
             self.model.save(filename)
         return
 
     def importTable(self):
-        """Import from csv file"""
-        from .Tables_IO import TableImporter
+        """Import from csv file, the file is read on a worker thread"""
+        from Tables_IO import TableImporter
         importer = TableImporter()
         importdialog = importer.import_Dialog(self.master)
         self.master.wait_window(importdialog)
-        model = TableModel()
-        model.importDict(importer.data)
-        self.updateModel(model)
+        if importer.datafile is None or importer.sep is None:
+            return
+        self.runInBackground(importer.importCSV, importer.datafile,
+                             sep=importer.sep, ondone=self.updateModel,
+                             message='Importing ' +
+                             os.path.basename(importer.datafile))
         return
 
-    def exportTable(self, filename=None):
+    def exportTable(self, filename=None, selection=False):
         """Do a simple export of the cell contents to csv"""
-        from .Tables_IO import TableExporter
+        from Tables_IO import TableExporter
         exporter = TableExporter()
-        exporter.ExportTableData(self)
+        exporter.ExportTableData(self, selection=selection)
         return
 
     @classmethod
@@ -2581,7 +2940,7 @@ class ColumnHeader(tk.Canvas):
             self.table.delete('resizeline')
             self.delete('resizeline')
             self.table.create_line(x, 0, x,
-                                   self.table.rowheight * self.table.rows,
+                                   self.table.getRowAxis().getEnd(),
                                    width=2, fill='gray', tag='resizeline')
             self.create_line(x, 0, x, self.height,
                              width=2, fill='gray', tag='resizeline')
@@ -2674,6 +3033,11 @@ class ColumnHeader(tk.Canvas):
         popupmenu.add_command(label="Sort by " + collabel + ' (descending)',
                               command=lambda: self.table.sortTable(currcol,
                                                                    reverse=1))
+        sortkeys = self.model.sortkeys
+        if sortkeys and colname not in sortkeys:
+            popupmenu.add_command(label="Then sort by " + collabel,
+                                  command=lambda: self.table.sortTable(
+                                      sortkeys=sortkeys + [colname]))
         popupmenu.add_command(label="Delete This Column",
                               command=self.table.deleteColumn)
         popupmenu.add_command(label="Add New Column",
@@ -2696,7 +3060,7 @@ class ColumnHeader(tk.Canvas):
                 return
             else:
                 self.model.relabel_Column(col, ans)
-                self.redraw()
+                self.table.redraws.markHeader()
         return
 
     def draw_resize_symbol(self, col):
@@ -2774,17 +3138,23 @@ class RowHeader(tk.Canvas):
             self.bind('<Button-3>', self.handle_right_click)
             self.bind('<B1-Motion>', self.handle_mouse_drag)
             # self.bind('<Shift-Button-1>', self.handle_left_shift_click)
-            self.height = self.table.rowheight * self.table.rows+10
+            self.height = self.table.getTableHeight() + 10
+            self.rectpool = ItemPool(self, 'rectangle', ('rowheader',))
+            self.textpool = ItemPool(self, 'text', ('text',))
         return
 
     def redraw(self, align='center', showkeys=False):
         """Redraw row header"""
-        self.height = self.table.rowheight * self.table.rows+10
+        self.height = self.table.getTableHeight() + 10
         self.configure(scrollregion=(0, 0, self.width, self.height))
-        self.delete('rowheader', 'text')
+        recycle = self.table.recycleitems
+        if recycle:
+            self.rectpool.begin()
+            self.textpool.begin()
+        else:
+            self.delete('rowheader', 'text')
         self.delete('rect')
         w = float(self.width)
-        h = self.table.rowheight
         x = self.x_start+w/2
         if align == 'w':
             x = x-w/2+3
@@ -2797,6 +3167,14 @@ class RowHeader(tk.Canvas):
                 text = row + 1
             # x1, y1, x2, y2 = self.table.getCellCoords(row, 0)
             _, y1, _, y2 = self.table.getCellCoords(row, 0)
+            h = y2 - y1
+            if recycle:
+                self.rectpool.place(row, (0, y1, w - 1, y2), fill='gray75',
+                                    outline='white', width=1)
+                self.textpool.place(row, (x, y1 + h / 2), text=text,
+                                    fill='black', font=self.table.thefont,
+                                    anchor=align)
+                continue
             self.create_rectangle(0, y1, w - 1, y2,
                                   fill='gray75',
                                   outline='white',
@@ -2807,6 +3185,9 @@ class RowHeader(tk.Canvas):
                              fill='black',
                              font=self.table.thefont,
                              tag='text', anchor=align)
+        if recycle:
+            self.rectpool.end()
+            self.textpool.end()
         return
 
     def setWidth(self, w):
@@ -26,12 +26,15 @@ import Pmw
 # import tk.filedialog, tk.messagebox, tk.simpledialog
 # import re
 import os
+import tempfile
 # import time
-import pickle
 from Custom import MyTable
 from TableModels import TableModel
 from Tables_IO import TableImporter
+from TableFile import (TableFile, TableWriter, isTableFile, readTables,
+                       writeTables)
 from Prefs import Preferences
+from Monitoring import StallMonitor, StatusHUD
 
 
 class TablesApp(tk.Frame):
@@ -65,6 +68,8 @@ class TablesApp(tk.Frame):
         self.tablesapp_win.geometry('+200+200')
         self.x_size = 800
         self.y_size = 600
+        self.monitor = None
+        self.hud = None
         self.createMenuBar()
         self.apptoolBar = ToolBar(self.tablesapp_win, self)
         self.apptoolBar.pack(fill='both', expand='no')
@@ -104,7 +109,9 @@ class TablesApp(tk.Frame):
             '04Delete Column': {'cmd': self.delete_Column},
             '05Auto Add Rows': {'cmd': self.autoAdd_Rows},
             '06Auto Add Columns': {'cmd': self.autoAdd_Columns},
-            '07Find': {'cmd': self.createSearchBar}}
+            '07Find': {'cmd': self.createSearchBar},
+            '08Undo': {'cmd': self.undo},
+            '09Redo': {'cmd': self.redo}}
 
         self.records_menu = self.create_pulldown(self.menu, self.records_menu)
         self.menu.add_cascade(label='Records', menu=self.records_menu['var'])
@@ -124,7 +131,9 @@ class TablesApp(tk.Frame):
 
         # Help menu
         self.help_menu = {'01Online Help': {'cmd': self.online_documentation},
-                          '02About': {'cmd': self.about_Tables}}
+                          '02About': {'cmd': self.about_Tables},
+                          '03Performance Monitor':
+                          {'cmd': self.toggleMonitor}}
         self.help_menu = self.create_pulldown(self.menu, self.help_menu)
         self.menu.add_cascade(label='Help', menu=self.help_menu['var'])
 
@@ -183,8 +192,18 @@ class TablesApp(tk.Frame):
                                          command=self.do_find_again)
         self.findagainbutton.grid(row=row, column=3,
                                   sticky='news', padx=2, pady=2)
+        self.findallbutton = tk.Button(frame, text='Find All',
+                                       command=self.do_find_all)
+        self.findallbutton.grid(row=row, column=4,
+                                sticky='news', padx=2, pady=2)
+        self.findregex = tk.IntVar()
+        tk.Checkbutton(frame, text='Regex',
+                       variable=self.findregex).grid(row=row, column=5)
+        self.findcase = tk.IntVar()
+        tk.Checkbutton(frame, text='Match case',
+                       variable=self.findcase).grid(row=row, column=6)
         self.cbutton = tk.Button(frame, text='Close', command=close)
-        self.cbutton.grid(row=row, column=4, sticky='news', padx=2, pady=2)
+        self.cbutton.grid(row=row, column=7, sticky='news', padx=2, pady=2)
         frame.pack(fill="both", expand="no")
         return
 
@@ -192,7 +211,9 @@ class TablesApp(tk.Frame):
         """Setup default prefs file if any of the keys are not present"""
         defaultprefs = {'textsize': 14,
                         'windowwidth': 800,
-                        'windowheight': 600}
+                        'windowheight': 600,
+                        # most sheets with a table built, 0 for no limit
+                        'opensheets': 0}
         for prop in defaultprefs:
             try:
                 self.preferences.get(prop)
@@ -210,19 +231,21 @@ class TablesApp(tk.Frame):
         if hasattr(self, 'currenttable'):
             self.notebook.destroy()
             self.currenttable.destroy()
+            self.closeSources()
 
-        # Create the sheets dict
+        # Create the sheets dict, sheets hold a table once they are shown
+        # and a SheetSource until then
         self.sheets = {}
+        self.sources = {}   # sheet -> SheetSource its table was built from
+        self.opened = []    # sheets with a table, last shown at the end
         self.notebook = Pmw.NoteBook(self.tablesapp_win,
                                      raisecommand=self.setcurrenttable)
         self.notebook.pack(fill='both', expand=1, padx=4, pady=4)
-        if data is not None:
+        if data:
             for s in list(data.keys()):
-                sdata = data[s]
-                try:
-                    self.add_Sheet(s, sdata)
-                except (AttributeError, TypeError, tk.TclError):
-                    print('skipping')
+                self.add_Sheet(s, data[s], lazy=True)
+            # only the first sheet is built, the others when raised
+            self.showSheet(list(self.sheets.keys())[0])
         else:
             # do the table adding stuff for the initial sheet
             self.add_Sheet('sheet1')
@@ -238,10 +261,16 @@ class TablesApp(tk.Frame):
                 filetypes=[("TableApp project", "*.tblprj"),
                            ("All files", "*.*")],
                 parent=self.tablesapp_win)
-        if os.path.isfile(filename):
-            fd = open(filename)
-            data = pickle.load(fd)
-            fd.close()
+        if not filename or not os.path.isfile(filename):
+            return
+        if isTableFile(filename):
+            # sheets are read from the file as they are shown
+            tablefile = TableFile(filename)
+            data = {name: SheetSource(tablefile=tablefile, name=name)
+                    for name in tablefile.getSheetNames()}
+        else:
+            # older projects are pickled dicts of sheet data
+            data = readTables(filename)
         self.new_project(data)
         self.filename = filename
         return
@@ -271,18 +300,21 @@ class TablesApp(tk.Frame):
         return
 
     def do_save_project(self, filename):
-        """Get model dicts and write all to pickle file"""
-        data = {}
-        for sheet in self.sheets:
-            currtable = self.sheets[sheet]
-            model = currtable.getModel()
-            data[sheet] = model.getData()
-
-        with open(filename, 'w') as fd:
-            pickle.dump(data, fd)
-        # fd = open(filename, 'w')
-        # pickle.dump(data, fd)
-        # fd.close()
+        """Write the models of all sheets to a table file"""
+        writer = TableWriter(filename)
+        try:
+            for sheet in self.sheets:
+                currtable = self.sheets[sheet]
+                if isinstance(currtable, SheetSource):
+                    currtable.save(writer, sheet)
+                else:
+                    writer.addModel(sheet, currtable.getModel())
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+        self.saved = 1
+        return
 
     def close_project(self):
         if hasattr(self, 'currenttable'):
@@ -295,11 +327,28 @@ class TablesApp(tk.Frame):
         # just use the dialog to load and import the file
         importdialog = importer.import_Dialog(self.tablesapp_win)
         self.tablesapp_win.wait_window(importdialog)
-        model = TableModel()
-        model.importDict(importer.data)
-        sheetdata = {}
-        sheetdata['sheet1'] = model.getData()
-        self.new_project(sheetdata)
+        if importer.datafile is None or importer.sep is None:
+            return
+        filename = importer.datafile
+
+        def loaded(model):
+            """Put the model in a new sheet named after the file"""
+            name = os.path.splitext(os.path.basename(filename))[0]
+            sheetname = name
+            i = 1
+            while sheetname in self.sheets:
+                i += 1
+                sheetname = '{0}_{1:d}'.format(name, i)
+            self.add_Sheet(sheetname, model)
+            return
+
+        # the file is read on a worker thread, other sheets stay usable
+        if not hasattr(self, 'currenttable'):
+            self.new_project()
+        self.currenttable.runInBackground(importer.importCSV, filename,
+                                          sep=importer.sep, ondone=loaded,
+                                          message='Importing ' +
+                                          os.path.basename(filename))
         return
 
     def export_csv(self):
@@ -308,8 +357,9 @@ class TablesApp(tk.Frame):
         exporter.ExportTableData(self.currenttable)
         return
 
-    def add_Sheet(self, sheetname=None, sheetdata=None):
-        """Add a new sheet - handles all the table creation stuff"""
+    def add_Sheet(self, sheetname=None, sheetdata=None, lazy=False):
+        """Add a new sheet - handles all the table creation stuff.
+           If lazy the table is only built when the sheet is first shown"""
         def checksheet_name(name):
             if name == '':
                 tk.messagebox.showwarning('Whoops',
@@ -327,33 +377,105 @@ class TablesApp(tk.Frame):
                                                   str(noshts+1))
         checksheet_name(sheetname)
         page = self.notebook.add(sheetname)
+        self.saved = 0
+        if lazy:
+            if not isinstance(sheetdata, SheetSource):
+                sheetdata = SheetSource(sheetdata)
+            self.sheets[sheetname] = sheetdata
+            return sheetname
+        self.currenttable = self.createTable(sheetname, page, sheetdata)
+        # add the table to the sheet dict
+        self.sheets[sheetname] = self.currenttable
+        self.touchSheet(sheetname)
+        return sheetname
+
+    def createTable(self, sheetname, page, sheetdata=None):
+        """Build the table of a sheet in its page"""
         # Create the table and model if data present
-        if sheetdata is not None:
+        if isinstance(sheetdata, SheetSource):
+            model = sheetdata.getModel()
+            sheetdata.watch(model)
+            self.sources[sheetname] = sheetdata
+            table = MyTable(page, model)
+        elif isinstance(sheetdata, TableModel):
+            table = MyTable(page, sheetdata)
+        elif sheetdata is not None:
             model = TableModel(sheetdata)
-            self.currenttable = MyTable(page, model)
+            table = MyTable(page, model)
         else:
-            self.currenttable = MyTable(page)
+            table = MyTable(page)
 
         # Load preferences into table
-        self.currenttable.loadPrefs(self.preferences)
+        table.loadPrefs(self.preferences)
         # This handles all the canvas and header in
         # the frame passed to constructor
-        self.currenttable.createTableFrame()
-        # add the table to the sheet dict
-        self.sheets[sheetname] = self.currenttable
-        self.saved = 0
-        return sheetname
+        table.createTableFrame()
+        return table
+
+    def showSheet(self, sheetname):
+        """Make a sheet the current table, building its table if this is
+           the first time it is shown"""
+        table = self.sheets[sheetname]
+        if isinstance(table, SheetSource):
+            page = self.notebook.page(sheetname)
+            table = self.createTable(sheetname, page, table)
+            self.sheets[sheetname] = table
+        self.currenttable = table
+        self.touchSheet(sheetname)
+        return
+
+    def touchSheet(self, sheetname):
+        """Note a sheet was shown, evicting the tables of the sheets shown
+           longest ago when more are open than the opensheets preference"""
+        if sheetname in self.opened:
+            self.opened.remove(sheetname)
+        self.opened.append(sheetname)
+        limit = self.preferences.get('opensheets')
+        while limit > 0 and len(self.opened) > limit:
+            self.evictSheet(self.opened[0])
+        return
+
+    def evictSheet(self, sheetname):
+        """Drop the table of a sheet, leaving its model on disk until the
+           sheet is shown again. A sheet that is as it was read from a file
+           is read from there again, others are written to a temporary
+           file first"""
+        table = self.sheets[sheetname]
+        if isinstance(table, SheetSource):
+            return
+        model = table.getModel()
+        source = self.sources.pop(sheetname, None)
+        if source is None or source.tablefile is None or source.changed:
+            fd, filename = tempfile.mkstemp(suffix='.table')
+            os.close(fd)
+            writeTables(filename, {sheetname: model})
+            if source is not None:
+                # a temporary file the sheet was read from before
+                source.close()
+            source = SheetSource(tablefile=TableFile(filename, delete=True),
+                                 name=sheetname)
+        model.removeListener(table.modelChanged)
+        for widget in self.notebook.page(sheetname).winfo_children():
+            widget.destroy()
+        self.sheets[sheetname] = source
+        self.opened.remove(sheetname)
+        return
 
     def delete_Sheet(self):
         """Delete a sheet"""
         s = self.notebook.getcurselection()
         self.notebook.delete(s)
+        source = self.sources.pop(s, self.sheets[s])
+        if isinstance(source, SheetSource):
+            source.close()
         del self.sheets[s]
+        if s in self.opened:
+            self.opened.remove(s)
         return
 
     def copy_Sheet(self, newname=None):
         """Copy a sheet"""
-        newdata = self.currenttable.getModel().getData().copy()
+        newdata = self.currenttable.getModel().copy()
         if newname is None:
             self.add_Sheet(None, newdata)
         else:
@@ -376,9 +498,10 @@ class TablesApp(tk.Frame):
         """Set the currenttable so that menu items work with visible sheet"""
         try:
             s = self.notebook.getcurselection()
-            self.currenttable = self.sheets[s]
-        except (AttributeError, tk.TclError, KeyError):
-            pass
+        except (AttributeError, tk.TclError):
+            return
+        if s in self.sheets:
+            self.showSheet(s)
         return
 
     def add_Row(self):
@@ -407,7 +530,7 @@ class TablesApp(tk.Frame):
 
     def autoAdd_Rows(self):
         """Auto add x rows"""
-        self.currenttable.autoAddRows()
+        self.currenttable.addRows()
         self.saved = 0
         return
 
@@ -417,6 +540,18 @@ class TablesApp(tk.Frame):
         self.saved = 0
         return
 
+    def undo(self):
+        """Undo the last edit in the current sheet"""
+        self.currenttable.undo()
+        self.saved = 0
+        return
+
+    def redo(self):
+        """Redo the last undone edit in the current sheet"""
+        self.currenttable.redo()
+        self.saved = 0
+        return
+
     def findValue(self):
         self.currenttable.findValue()
         return
@@ -430,7 +565,9 @@ class TablesApp(tk.Frame):
             return
         searchstring = self.findtext.get()
         if self.currenttable is not None:
-            self.currenttable.findValue(searchstring)
+            self.currenttable.findValue(searchstring,
+                                        regex=self.findregex.get(),
+                                        case=self.findcase.get())
         return
 
     def do_find_again(self, event=None):
@@ -439,7 +576,20 @@ class TablesApp(tk.Frame):
             return
         searchstring = self.findtext.get()
         if self.currenttable is not None:
-            self.currenttable.findValue(searchstring, findagain=1)
+            self.currenttable.findValue(searchstring, findagain=1,
+                                        regex=self.findregex.get(),
+                                        case=self.findcase.get())
+        return
+
+    def do_find_all(self, event=None):
+        """Mark every cell holding the text"""
+        if not hasattr(self, 'currenttable'):
+            return
+        searchstring = self.findtext.get()
+        if self.currenttable is not None and searchstring.strip() != '':
+            self.currenttable.findAll(searchstring,
+                                      regex=self.findregex.get(),
+                                      case=self.findcase.get())
         return
 
     def plot(self, event=None):
@@ -483,11 +633,96 @@ class TablesApp(tk.Frame):
         webbrowser.open(link, autoraise=1)
         return
 
+    def startMonitor(self, hud=True):
+        """Watch the application for stalls of the main loop, showing
+           them with the redraw time of the current table in a HUD"""
+        if self.monitor is None:
+            self.monitor = StallMonitor(self.tablesapp_win)
+            self.monitor.start()
+        if hud and self.hud is None:
+            self.hud = StatusHUD(self.tablesapp_win, self.monitor,
+                                 lambda: getattr(self, 'currenttable', None))
+        return
+
+    def stopMonitor(self):
+        if self.hud is not None:
+            self.hud.close()
+            self.hud = None
+        if self.monitor is not None:
+            self.monitor.stop()
+            self.monitor = None
+        return
+
+    def toggleMonitor(self):
+        if self.hud is None:
+            self.startMonitor()
+        else:
+            self.stopMonitor()
+        return
+
+    def closeSources(self, keep=True):
+        """Remove the temporary files of evicted sheets, see
+           SheetSource.close"""
+        sources = list(self.sources.values())
+        sources.extend(s for s in self.sheets.values()
+                       if isinstance(s, SheetSource))
+        for source in sources:
+            source.close(keep)
+        return
+
     def quit(self):
+        self.closeSources(keep=False)
         self.tablesapp_win.destroy()
         return
 
 
+class SheetSource(object):
+    """A sheet whose table has not been built. Holds what its model is
+       built from: a TableModel, a dict of table data or a sheet of an
+       open TableFile, whose columns are read only once they are used"""
+
+    def __init__(self, data=None, tablefile=None, name=None):
+        self.data = data
+        self.tablefile = tablefile
+        self.name = name
+        self.changed = False
+        return
+
+    def getModel(self):
+        """Build the model of the sheet"""
+        if self.tablefile is not None:
+            return self.tablefile.loadModel(self.name)
+        if isinstance(self.data, TableModel):
+            return self.data
+        return TableModel(self.data)
+
+    def watch(self, model):
+        """Note when a model built from this source is changed"""
+        def changed(kind, recname, colname):
+            self.changed = True
+            return
+        model.addListener(changed)
+        return
+
+    def close(self, keep=True):
+        """Close and remove the file of a sheet that was written to a
+           temporary file, the file of a project is shared by its sheets
+           and is left open. keep: read the file into memory first, for
+           models built from it that may still read columns"""
+        if self.tablefile is not None and self.tablefile.delete:
+            self.tablefile.close(keep)
+        return
+
+    def save(self, writer, sheetname):
+        """Write the sheet with a TableWriter, a sheet of a file is copied
+           without reading its columns"""
+        if self.tablefile is not None:
+            writer.copySheet(self.tablefile, self.name, sheetname)
+        else:
+            writer.addModel(sheetname, self.getModel())
+        return
+
+
 class ToolBar(tk.Frame):
     """Uses the parent instance to provide the functions"""
     def __init__(self, parent=None, parentapp=None):
@@ -537,12 +772,33 @@ def main():
     parser = OptionParser()
     parser.add_option("-f", "--file", dest="tablefile",
                       help="Open a table file", metavar="FILE")
+    parser.add_option("-t", "--trace", dest="tracefile",
+                      help="Time redraws, model operations and file "
+                      "access, writing a Chrome trace to FILE on exit",
+                      metavar="FILE")
+    parser.add_option("-s", "--trace-stats", dest="statsfile",
+                      help="Write the time spent in each traced span to "
+                      "FILE on exit", metavar="FILE")
+    parser.add_option("-m", "--monitor", dest="monitorfile",
+                      help="Watch for stalls of the user interface, "
+                      "writing them to FILE on exit", metavar="FILE")
     opts, remainder = parser.parse_args()
+    if opts.tracefile is not None or opts.statsfile is not None:
+        import Tracing
+        Tracing.enable(events=opts.tracefile is not None)
     if opts.tablefile is not None:
         app = TablesApp(datafile=opts.tablefile)
     else:
         app = TablesApp()
+    if opts.monitorfile is not None:
+        app.startMonitor()
     app.mainloop()
+    if opts.monitorfile is not None and app.monitor is not None:
+        app.monitor.saveJSON(opts.monitorfile)
+    if opts.tracefile is not None:
+        Tracing.tracer.saveChromeTrace(opts.tracefile)
+    if opts.statsfile is not None:
+        Tracing.tracer.saveJSON(opts.statsfile)
     return
 
 if __name__ == '__main__':
@@ -20,12 +20,134 @@
 """
 
 import os
+import io
 import csv
+import gzip
+import queue
+import threading
+from itertools import islice, zip_longest
 import tkinter as tk
 import Pmw
+from TableModels import TableModel
+from TableStorage import MISSING, RecordList
+from Tracing import traced
 # import tkinter.filedialog
 
 
+def isNumber(value):
+    """True if a csv field reads as a number"""
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+
+def guessColumnTypes(columns):
+    """Guess the type of each column from a sample of its csv fields,
+       a column is a number if all its fields that aren't blank are"""
+    types = []
+    for values in columns:
+        values = [v for v in values if v != '']
+        if values and all(map(isNumber, values)):
+            types.append('number')
+        else:
+            types.append('text')
+    return types
+
+
+def toNumbers(values):
+    """Convert the csv fields of a number column, blanks become missing
+       cells and fields that are not numbers are kept as text"""
+    try:
+        return [float(v) if v != '' else MISSING for v in values]
+    except ValueError:
+        return [(float(v) if isNumber(v) else v) if v != '' else MISSING
+                for v in values]
+
+
+class BackgroundTask(object):
+    """Runs func(*args, progress=..., cancel=..., **kwargs) on a worker
+       thread so the GUI stays responsive. The worker sends its progress
+       and result back through a queue which the Tk thread polls with
+       after(), so the callbacks given here all run on the Tk thread:
+       onprogress(fraction), ondone(result) and onerror(exception).
+       func should call progress with the fraction done and stop when
+       cancel() returns True. It must not touch Tk or objects the GUI
+       may change while it runs"""
+
+    # ms between polls of the queue
+    interval = 50
+
+    def __init__(self, widget, func, args=(), kwargs=None, onprogress=None,
+                 ondone=None, onerror=None):
+        self.widget = widget
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.onprogress = onprogress
+        self.ondone = ondone
+        self.onerror = onerror
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        return
+
+    def start(self):
+        self.thread.start()
+        self.widget.after(self.interval, self.poll)
+        return self
+
+    def run(self):
+        """Worker thread"""
+        try:
+            result = self.func(*self.args, progress=self.progress,
+                               cancel=self.cancelled.is_set, **self.kwargs)
+        except Exception as e:
+            self.queue.put(('error', e))
+        else:
+            self.queue.put(('done', result))
+        return
+
+    def progress(self, fraction):
+        self.queue.put(('progress', fraction))
+        return
+
+    def cancel(self):
+        """Ask the worker to stop, it finishes with a None result"""
+        self.cancelled.set()
+        return
+
+    def isRunning(self):
+        return self.thread.is_alive()
+
+    def poll(self):
+        """Handle the messages from the worker, on the Tk thread"""
+        fraction = None
+        while True:
+            try:
+                kind, value = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                fraction = value
+                continue
+            if kind == 'done' and self.ondone is not None:
+                self.ondone(value)
+            elif kind == 'error' and self.onerror is not None:
+                self.onerror(value)
+            return
+        # only the latest progress matters
+        if fraction is not None and self.onprogress is not None:
+            self.onprogress(fraction)
+        try:
+            self.widget.after(self.interval, self.poll)
+        except tk.TclError:
+            # the widget has gone, there is no one to report to
+            self.cancel()
+        return
+
+
 class TableImporter:
     """Provides import utility methods for the Table and Table Model classes"""
 
@@ -37,7 +159,9 @@ class TableImporter:
         self.var_sep = tk.StringVar()
         self.var_sep.set(',')
         self.data = None
+        self.model = None
         self.datafile = None
+        self.sep = None
         self.CancelButton = None
         self.importButton = None
         self.openButton = None
@@ -137,8 +261,12 @@ class TableImporter:
         return
 
     def do_ModelImport(self):
-        """imports and places the result in self.modeldata"""
-        self.data = self.ImportTableModel(self.datafile)
+        """Keeps the chosen file and separator, the import itself is left
+           to the caller, see importCSV"""
+        try:
+            self.sep = self.var_sep.get()
+        except tk.TclError:
+            self.sep = ','
         self.close()
         return
 
@@ -162,6 +290,70 @@ class TableImporter:
             dictdata[count] = rec
         return dictdata
 
+    @traced('io.importCSV')
+    def importCSV(self, filename, sep=',', chunksize=10000, samplesize=1000,
+                  progress=None, cancel=None):
+        """Import a comma separated file into a new table model, reading
+           it in chunks of rows that go straight into the model's store so
+           the whole file is never held as dicts. Column types are guessed
+           from the first samplesize rows, the first row gives the column
+           names and records are named by row number as with
+           ImportTableModel. This is reusable outside the GUI dialog also.
+           progress: called with the fraction of the file read after each
+           chunk
+           cancel: called after each chunk, the import stops if it returns
+           True
+           returns: the model, or None if there was no file or the import
+           was cancelled"""
+
+        if filename is None or not os.path.isfile(filename):
+            return None
+        filesize = float(os.path.getsize(filename)) or 1.0
+        model = TableModel()
+        store = model.data
+        readsize = [0]
+
+        def lines(csvfile):
+            # count what is read, tell() can't be used with csv
+            for line in csvfile:
+                readsize[0] += len(line)
+                yield line
+
+        with open(filename, 'r', newline='') as csvfile:
+            reader = csv.reader(lines(csvfile), delimiter=sep)
+            header = next(reader, None)
+            if header is None:
+                return model
+            ncols = len(header)
+            chunk = list(islice(reader, samplesize))
+            coltypes = guessColumnTypes(
+                islice(zip_longest(*chunk, fillvalue=''), ncols))
+            for colname, coltype in zip(header, coltypes):
+                model.addColumn(colname, coltype)
+            count = 0
+            while chunk:
+                # transpose the rows, short rows are padded with blanks
+                columns = list(islice(zip_longest(*chunk, fillvalue=''),
+                                      ncols))
+                values = {}
+                for colname, coltype, column in zip(header, coltypes,
+                                                    columns):
+                    if coltype == 'number':
+                        values[colname] = toNumbers(column)
+                    else:
+                        values[colname] = column
+                names = range(count, count + len(chunk))
+                store.appendColumns(names, values)
+                count += len(chunk)
+                chunk = None
+                if progress is not None:
+                    progress(min(readsize[0] / filesize, 1.0))
+                if cancel is not None and cancel():
+                    return None
+                chunk = list(islice(reader, chunksize))
+        model.reclist = RecordList(store.names)
+        return model
+
     def close(self):
         """ close """
         self.master.destroy()
@@ -174,29 +366,98 @@ class TableExporter:
     def __init__(self):
         return
 
-    def ExportTableData(self, table, sep=None):
-        """Export table data to a comma separated file"""
+    def ExportTableData(self, table, sep=None, background=True,
+                        selection=False, filtered=True):
+        """Export table data to a comma separated file, gzipped if the
+           name ends in .gz. Rows are written in the order the table shows
+           them. The file is written on a worker thread from a snapshot
+           of the model unless background is False.
+           selection: only write the selected rows and columns
+           filtered: only write the rows left by the current filter"""
 
         parent = table.parentframe
         filename = tk.filedialog.asksaveasfilename(
             parent=parent,
             defaultextension='.csv',
-            filetypes=[("CSV files", "*.csv")])
+            filetypes=[("CSV files", "*.csv"),
+                       ("Compressed CSV files", "*.csv.gz")])
         if not filename:
             return
         if sep is None:
             sep = ','
-        with open(filename, 'w') as csv_file:
-            writer = csv.writer(csv_file, delimiter=sep)
-            model = table.getModel()
-            recs = model.getAllCells()
-            # take column labels as field names
-            colnames = model.columnNames
-            collabels = model.columnlabels
-            row = []
-            for col in colnames:
-                row.append(collabels[col])
-            writer.writerow(row)
-            for row in list(recs.keys()):
-                writer.writerow(recs[row])
+        model = table.getModel()
+        names = None
+        colnames = None
+        if selection and not table.multiplerowlist:
+            # a single cell is selected
+            names = [model.getRecName(table.currentrow)]
+            colnames = [model.getColumnName(table.currentcol)]
+        elif selection:
+            rows = sorted(set(table.multiplerowlist))
+            names = [model.getRecName(row) for row in rows]
+            if table.multiplecollist:
+                cols = sorted(set(table.multiplecollist))
+                colnames = [model.getColumnName(col) for col in cols]
+        elif not filtered:
+            names = list(model.reclist)
+        if not background:
+            self.exportCSV(model, filename, sep=sep, names=names,
+                           colnames=colnames)
+            return
+        table.runInBackground(self.exportCSV, model.snapshot(), filename,
+                              sep=sep, names=names, colnames=colnames,
+                              message='Exporting ' +
+                              os.path.basename(filename))
         return
+
+    @traced('io.exportCSV')
+    def exportCSV(self, model, filename, sep=',', names=None, colnames=None,
+                  compress=None, chunksize=10000, progress=None, cancel=None):
+        """Write the cell contents of a model to a comma separated file.
+           Rows are fetched a chunk at a time, column by column, and each
+           chunk is written in one block, so memory use does not grow with
+           the table. This is reusable outside the GUI.
+           names: records to write in order, by default the rows the model
+           shows, i.e. sorted and filtered
+           colnames: columns to write, by default all of them
+           compress: gzip the file, by default if the name ends in .gz
+           progress: called with the fraction of rows written
+           cancel: checked after each chunk, if it returns True the
+           partial file is removed
+           returns: the filename, or None if cancelled"""
+        if names is None:
+            if model.filteredrecs is not None:
+                names = model.filteredrecs
+            else:
+                names = model.reclist
+        if colnames is None:
+            colnames = model.columnNames
+        if compress is None:
+            compress = filename.endswith('.gz')
+        if compress:
+            out = gzip.open(filename, 'wt', newline='')
+        else:
+            out = open(filename, 'w', newline='')
+        block = io.StringIO()
+        writer = csv.writer(block, delimiter=sep)
+        rows = len(names)
+        with out:
+            # take column labels as field names
+            writer.writerow([model.columnlabels[c] for c in colnames])
+            for start in range(0, rows, chunksize):
+                end = min(start + chunksize, rows)
+                chunk = names[start:end]
+                columns = [model.getDisplayValues(c, chunk) for c in colnames]
+                writer.writerows(zip(*columns))
+                out.write(block.getvalue())
+                block.seek(0)
+                block.truncate()
+                if progress is not None:
+                    progress(float(end) / rows)
+                if cancel is not None and cancel():
+                    break
+            else:
+                out.write(block.getvalue())
+                return filename
+        os.remove(filename)
+        return None
@@ -23,6 +23,7 @@
 
 import random
 import string
+from types import SimpleNamespace
 import tkinter as tk
 from Tables import TableCanvas
 from TableModels import TableModel
@@ -185,6 +186,141 @@ def test5():
     return
 
 
+def evalFormula(cellformula, data):
+    """A formula evaluated the way it was before formulas were compiled,
+       splitting the text and using eval on each part and on the result.
+       Kept only to compare against in formulaBenchmark, eval is unsafe
+       on formulas from files"""
+    import re
+    from TableFormula import Formula
+    cellformula = cellformula['formula']
+    p = re.compile('[()*/+-]')
+    ops = p.findall(cellformula)
+    vals = []
+    for i in p.split(cellformula):
+        if i == '':
+            vals.append(i)
+            continue
+        cell = eval(i)
+        if isinstance(cell, list):
+            recname, col = cell
+            v = data[recname][col]
+            if Formula.isFormula(v):
+                v = evalFormula(v, data)
+            cell = v
+        vals.append(cell)
+    result = eval(Formula.doExpression(vals, ops))
+    return str(round(result, 3))
+
+
+def formulaBenchmark(rows=10000):
+    """Time formula evaluation of a filled down column, by the old eval
+       based path, one cell at a time and as a single batch over the
+       column"""
+    import time
+    from TableFormula import Formula
+    model = TableModel()
+    data = createData(rows, 2)
+    model.importDict(data)
+    a, b = [c for c in model.columnNames if c != 'label'][:2]
+    model.addColumn('result')
+    col = model.getColumnIndex('result')
+    for row, rec in enumerate(model.reclist):
+        f = '([{0!r}, {1!r}]+[{0!r}, {2!r}])*2/3-1'.format(rec, a, b)
+        model.setFormulaAt(f, row, col)
+    results = {}
+    Formula.parsed = {}
+    st = time.time()
+    for rec in model.reclist:
+        Formula.parse(model.data[rec]['result'])
+    results['parse'] = time.time() - st
+    st = time.time()
+    old = [evalFormula(model.data[rec]['result'], model.data)
+           for rec in model.reclist]
+    results['eval'] = time.time() - st
+    model.formulas.clear()
+    st = time.time()
+    new = [model.getValueAt(row, col) for row in range(len(model.reclist))]
+    results['cell by cell'] = time.time() - st
+    assert [float(v) for v in old] == [float(v) for v in new]
+    model.formulas.clear()
+    st = time.time()
+    model.formulas.evaluateColumn('result', model.reclist)
+    results['batch'] = time.time() - st
+    st = time.time()
+    model.getColCells(col)
+    results['cached'] = time.time() - st
+    for k in results:
+        print('{0:>14s} {1:.4f}s'.format(k, results[k]))
+    return results
+
+
+def renderCostTest(rows=5000, cols=8):
+    """Count the canvas commands that common updates make, on a recording
+       root so no display is needed, and check them against budgets.
+       returns: a dict of update -> Counter of canvas commands"""
+    from Recording import RecordingRoot, countOps
+    root = RecordingRoot()
+    frame = tk.Frame(root)
+    frame.pack(fill='both', expand=1)
+    model = TableModel()
+    model.importDict(createData(rows, cols))
+    table = TableCanvas(frame, model, width=700, height=500)
+    table.createTableFrame()
+    # the first scroll brings one more, partly shown, row into view
+    table.set_yviews('scroll', 1, 'units')
+    root.update_idletasks()
+    colname = model.getColumnName(1)
+
+    def edit():
+        model.setValueAt(1.5, 3, 1)
+
+    def select():
+        # a click in the middle of a cell, as the canvas would report it
+        x1, y1, x2, y2 = table.getCellCoords(6, 2)
+        event = SimpleNamespace(x=(x1 + x2) / 2,
+                                y=(y1 + y2) / 2 - table.canvasy(0))
+        table.handle_left_click(event)
+
+    def filterrows():
+        table.model.filteredrecs = model.filterRecords(
+            [(colname, '100', '>', 'AND')])
+        table.filtered = True
+        table.redrawTable()
+
+    updates = [('redraw', table.redrawVisible),
+               ('edit', edit),
+               ('scroll', lambda: table.set_yviews('scroll', 1, 'units')),
+               ('select', select),
+               ('sort', lambda: table.sortTable(columnName=colname)),
+               ('filter', filterrows)]
+    # most canvas commands each update may make. Items are moved rather
+    # than made again, the deletes are of selection tags that are usually
+    # empty and the one item a click makes is the cell entry
+    budgets = {'redraw': {'create': 0, 'delete': 2},
+               'edit': {'itemconfigure': 1, 'create': 0, 'delete': 0},
+               'scroll': {'create': 0, 'delete': 2},
+               'select': {'create': 1, 'delete': 7},
+               'sort': {'create': 0, 'delete': 2},
+               'filter': {'create': 0, 'delete': 3}}
+    results = {}
+    for name, func in updates:
+        items = len(root.getItems(table))
+        with root.recording() as calls:
+            func()
+            root.update_idletasks()
+        counts = results[name] = countOps(calls, table)
+        print('{0:>8s} {1}'.format(name, dict(counts)))
+        for op, most in budgets[name].items():
+            assert counts[op] <= most, \
+                '{0} made {1} {2} calls, the budget is {3}'.format(
+                    name, counts[op], op, most)
+        assert len(root.getItems(table)) <= items + budgets[name]['create'], \
+            '{0} left more canvas items than it made'.format(name)
+    root.destroy()
+    return results
+
+
 def GUITests():
     """Run standard tests"""
     root = tk.Tk()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+    Module implements timing of named spans of work, such as the phases
+    of a redraw, for finding where time goes.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# Code marks its work with
+#     with span('redraw.grid'):
+#         ...
+# or a whole function with the @traced('model.sort') decorator. Tracing
+# is off until enable() is called, a span is then a shared object that
+# does nothing, so the marks can stay in hot paths. When on, the time of
+# each span goes into a histogram per name and, optionally, a list of
+# events that saveChromeTrace writes for chrome://tracing or Perfetto.
+# Spans are named area.phase, e.g. redraw.text, io.exportCSV.
+
+import os
+import json
+import threading
+import functools
+from collections import deque
+from time import perf_counter
+
+
+class Histogram(object):
+    """Latencies of one span name, in buckets of powers of two
+       microseconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.total = 0.0
+        self.least = None
+        self.most = 0.0
+        self.buckets = {}   # n -> count of spans under 2**n microseconds
+        return
+
+    def add(self, seconds):
+        self.count += 1
+        self.last = seconds
+        self.total += seconds
+        if self.least is None or seconds < self.least:
+            self.least = seconds
+        if seconds > self.most:
+            self.most = seconds
+        n = int(seconds * 1e6).bit_length()
+        self.buckets[n] = self.buckets.get(n, 0) + 1
+        return
+
+    def percentile(self, q):
+        """Upper bound in seconds of the bucket holding the q quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for n in sorted(self.buckets):
+            seen += self.buckets[n]
+            if seen >= rank:
+                return min(2 ** n / 1e6, self.most)
+        return self.most
+
+    def toDict(self):
+        return {'count': self.count,
+                'last': self.last,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else 0.0,
+                'min': self.least or 0.0,
+                'max': self.most,
+                'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99),
+                'buckets': {str(2 ** n): c
+                            for n, c in sorted(self.buckets.items())}}
+
+
+class NullSpan(object):
+    """The span given out while tracing is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class Span(object):
+
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        return
+
+    def __enter__(self):
+        self.tracer.getActive().append(self.name)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        end = perf_counter()
+        self.tracer.getActive().pop()
+        self.tracer.record(self.name, self.start, end)
+        return False
+
+
+class Tracer(object):
+    """Collects spans while enabled, see the module comment"""
+
+    nullspan = NullSpan()
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stats = {}     # name -> Histogram
+        self.events = None  # (name, start, end, thread) of each span
+        self.active = {}    # thread -> names of the spans it is in
+        self.origin = perf_counter()
+        return
+
+    def enable(self, events=True, maxevents=200000):
+        """Start collecting. events: also keep each span, the latest
+           maxevents of them, for saveChromeTrace"""
+        self.events = deque(maxlen=maxevents) if events else None
+        self.origin = perf_counter()
+        self.enabled = True
+        return
+
+    def disable(self):
+        self.enabled = False
+        return
+
+    def reset(self):
+        """Drop what has been collected"""
+        with self.lock:
+            self.stats = {}
+            if self.events is not None:
+                self.events.clear()
+            self.origin = perf_counter()
+        return
+
+    def span(self, name):
+        if not self.enabled:
+            return self.nullspan
+        return Span(self, name)
+
+    def getActive(self, thread=None):
+        """Names of the spans a thread, by default this one, is in, the
+           innermost last. Kept while tracing is enabled"""
+        if thread is None:
+            thread = threading.get_ident()
+        active = self.active.get(thread)
+        if active is None:
+            active = self.active[thread] = []
+        return active
+
+    def getHistogram(self, name):
+        """The histogram of a span name, call with the lock held"""
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = Histogram()
+        return stats
+
+    def record(self, name, start, end):
+        with self.lock:
+            self.getHistogram(name).add(end - start)
+            if self.events is not None:
+                self.events.append((name, start, end,
+                                    threading.get_ident()))
+        return
+
+    def addTime(self, name, seconds):
+        """Count time spent in a phase that is not one block of code, such
+           as the part of each pass of a loop, as one span of name. It is
+           added to the statistics only, there is no event for it"""
+        with self.lock:
+            self.getHistogram(name).add(seconds)
+        return
+
+    def getStats(self):
+        """A dict of span name -> count, total, mean, min, max and
+           percentile times in seconds, and the histogram buckets"""
+        with self.lock:
+            return {name: stats.toDict()
+                    for name, stats in sorted(self.stats.items())}
+
+    def getChromeTrace(self):
+        """The events in the Chrome trace event format"""
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events or ())
+        trace = []
+        for name, start, end, thread in events:
+            trace.append({'name': name,
+                          'cat': name.split('.')[0],
+                          'ph': 'X',
+                          'ts': (start - self.origin) * 1e6,
+                          'dur': (end - start) * 1e6,
+                          'pid': pid,
+                          'tid': thread})
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def saveJSON(self, filename):
+        """Write the statistics of each span to a json file"""
+        with open(filename, 'w') as fd:
+            json.dump(self.getStats(), fd, indent=2)
+        return
+
+    def saveChromeTrace(self, filename):
+        """Write the events to a json file chrome://tracing can open"""
+        with open(filename, 'w') as fd:
+            json.dump(self.getChromeTrace(), fd)
+        return
+
+
+tracer = Tracer()
+span = tracer.span
+enable = tracer.enable
+disable = tracer.disable
+reset = tracer.reset
+getStats = tracer.getStats
+
+
+def traced(name):
+    """Decorator putting every call of a function in a span"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with Span(tracer, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+    Synthetic tables for the benchmarks.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import random
+import string
+from TableModels import TableModel
+from TableStorage import MISSING
+
+# kinds of column and the table type each is shown as
+KINDS = {'number': 'number',    # floats
+         'sparse': 'number',    # floats with half the cells empty
+         'text': 'text'}        # short words from a small vocabulary
+
+MIXES = {'numbers': {'number': 1.0},
+         'text': {'text': 1.0},
+         'mixed': {'number': 0.6, 'text': 0.3, 'sparse': 0.1}}
+
+
+def parseMix(mix):
+    """A mix of column kinds from a preset name or text such as
+       'number=0.5,text=0.5'. returns: a dict of kind -> weight"""
+    if isinstance(mix, dict):
+        return mix
+    if mix in MIXES:
+        return MIXES[mix]
+    weights = {}
+    for part in mix.split(','):
+        kind, weight = part.split('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError('unknown column kind {0}'.format(kind))
+        weights[kind] = float(weight)
+    return weights
+
+
+def columnKinds(cols, mix):
+    """The kind of each of cols columns in proportion to the weights of
+       mix, interleaved so that the first few columns hold each kind"""
+    mix = parseMix(mix)
+    total = float(sum(mix.values()))
+    counts = dict.fromkeys(mix, 0)
+    kinds = []
+    for i in range(1, cols + 1):
+        # the kind furthest behind its share so far
+        kind = max(sorted(mix),
+                   key=lambda k: mix[k] / total * i - counts[k])
+        counts[kind] += 1
+        kinds.append(kind)
+    return kinds
+
+
+def createData(rows=1000, cols=10, mix='mixed', formulas=0.0, seed=0):
+    """Random columns for a table of rows x cols, built a whole column
+       at a time. formulas is the fraction of cells in the number columns,
+       other than the first, that hold a formula using the first number
+       column of their row.
+       returns: the record names, a dict of colname -> list of values and
+       a dict of colname -> column type"""
+    rand = random.Random(seed)
+    names = list(range(rows))
+    vocabulary = [''.join(rand.choices(string.ascii_lowercase, k=8))
+                  for _ in range(500)]
+    columns = {}
+    coltypes = {}
+    for i, kind in enumerate(columnKinds(cols, mix)):
+        colname = '{0}{1}'.format(kind, i)
+        if kind == 'text':
+            values = rand.choices(vocabulary, k=rows)
+        else:
+            gauss = rand.gauss
+            values = [round(gauss(100, 50), 2) for _ in names]
+            if kind == 'sparse':
+                for row in rand.sample(names, rows // 2):
+                    values[row] = MISSING
+        columns[colname] = values
+        coltypes[colname] = KINDS[kind]
+    numbers = [c for c in columns if c.startswith('number')]
+    if formulas and numbers:
+        base = numbers[0]
+        count = int(rows * formulas)
+        for colname in numbers[1:]:
+            values = columns[colname]
+            for row in rand.sample(names, count):
+                f = '[{0!r}, {1!r}]*2+1'.format(names[row], base)
+                values[row] = {'formula': f}
+    return names, columns, coltypes
+
+
+def createModel(rows=1000, cols=10, mix='mixed', formulas=0.0, seed=0):
+    """A TableModel filled by createData"""
+    names, columns, coltypes = createData(rows, cols, mix, formulas, seed)
+    model = TableModel()
+    for colname in columns:
+        model.addColumn(colname, coltypes[colname])
+    model.appendRecords(columns=columns, keys=names)
+    model.journal.clear()
+    return model
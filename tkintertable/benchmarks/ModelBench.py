@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmarks of table model operations, these need no display.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+# Each benchmark is a function taking the model, a working directory and
+# the table settings. It returns the function to time and a setup function
+# whose result is passed to it, or None if it does not apply to the table.
+# Setup usually takes a copy of the model, which costs nothing as the store
+# is copied on write, so that every run starts without the caches of the
+# one before.
+
+import os
+import shutil
+import tempfile
+from benchmarks import timeCall
+from benchmarks.Datasets import createData, createModel
+from TableModels import TableModel
+from TableFile import TableFile, writeTables
+from Filtering import SearchIndex
+from Tables_IO import TableExporter, TableImporter
+
+
+def getColumnOfType(model, coltype):
+    for colname in model.columnNames:
+        if model.columntypes[colname] == coltype:
+            return colname
+    return None
+
+
+def benchAppend(model, workdir, params):
+    names, columns = createData(params['rows'], params['cols'],
+                                params['mix'], params['formulas'])[:2]
+
+    def run(_):
+        TableModel().appendRecords(columns=columns, keys=names)
+    return run, None
+
+
+def benchSortNumber(model, workdir, params):
+    colname = getColumnOfType(model, 'number')
+    if colname is None:
+        return None
+    return lambda m: m.setSortOrder(columnName=colname), model.copy
+
+
+def benchSortText(model, workdir, params):
+    colname = getColumnOfType(model, 'text')
+    if colname is None:
+        return None
+    return lambda m: m.setSortOrder(columnName=colname), model.copy
+
+
+def benchSortKeys(model, workdir, params):
+    sortkeys = model.columnNames[:2]
+    return lambda m: m.setSortOrder(sortkeys=sortkeys), model.copy
+
+
+def benchFilter(model, workdir, params):
+    filters = []
+    number = getColumnOfType(model, 'number')
+    if number is not None:
+        filters.append((number, '100', '>', 'AND'))
+    text = getColumnOfType(model, 'text')
+    if text is not None:
+        filters.append((text, 'a', 'contains', 'AND'))
+    return lambda m: m.filterRecords(filters), model.copy
+
+
+def benchFormulas(model, workdir, params):
+    if not params['formulas']:
+        return None
+    colnames = [c for c in model.columnNames
+                if model.columntypes[c] == 'number']
+
+    def run(m):
+        for colname in colnames:
+            m.formulas.evaluateColumn(colname, m.reclist)
+    return run, model.copy
+
+
+def benchSearch(model, workdir, params):
+    return lambda m: SearchIndex(m).findAll('ab'), model.copy
+
+
+def benchExport(model, workdir, params):
+    filename = os.path.join(workdir, 'export.csv')
+    return lambda _: TableExporter().exportCSV(model, filename), None
+
+
+def benchImport(model, workdir, params):
+    filename = os.path.join(workdir, 'import.csv')
+    TableExporter().exportCSV(model, filename)
+    # importCSV uses none of the dialog state that needs a Tk root
+    importer = TableImporter.__new__(TableImporter)
+    return lambda _: importer.importCSV(filename), None
+
+
+def benchSave(model, workdir, params):
+    filename = os.path.join(workdir, 'save.table')
+    return lambda _: writeTables(filename, {'sheet': model}), None
+
+
+def benchLoad(model, workdir, params):
+    filename = os.path.join(workdir, 'load.table')
+    writeTables(filename, {'sheet': model})
+
+    def run(_):
+        # columns are read when first used, so use them all
+        m = TableFile(filename).loadModel('sheet')
+        for colname in m.columnNames:
+            m.data.getColumnValues(colname)
+    return run, None
+
+
+BENCHMARKS = [('append', benchAppend),
+              ('sort.number', benchSortNumber),
+              ('sort.text', benchSortText),
+              ('sort.keys', benchSortKeys),
+              ('filter', benchFilter),
+              ('formulas', benchFormulas),
+              ('search', benchSearch),
+              ('csv.export', benchExport),
+              ('csv.import', benchImport),
+              ('file.save', benchSave),
+              ('file.load', benchLoad)]
+
+
+def runModelBenchmarks(params, only=None):
+    """Time each benchmark on a table made with params.
+       returns: a dict of benchmark name -> times"""
+    model = createModel(params['rows'], params['cols'], params['mix'],
+                        params['formulas'])
+    workdir = tempfile.mkdtemp(prefix='tablebench')
+    results = {}
+    try:
+        for name, bench in BENCHMARKS:
+            if only and name not in only:
+                continue
+            calls = bench(model, workdir, params)
+            if calls is None:
+                continue
+            func, setup = calls
+            if setup is None:
+                setup = lambda: None
+            results[name] = timeCall(func, setup, params['repeat'])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmarks of drawing tables. These need a display, if there is none
+    a virtual one is started with Xvfb.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import os
+import time
+import shutil
+import subprocess
+from benchmarks import timeCall
+from benchmarks.Datasets import createModel
+
+
+def startDisplay(size='1280x1024x24', wait=10):
+    """Start Xvfb on a free display number if DISPLAY isn't set.
+       returns: the Xvfb process, or None if there is a display already"""
+    if os.environ.get('DISPLAY'):
+        return None
+    xvfb = shutil.which('Xvfb')
+    if xvfb is None:
+        raise RuntimeError('there is no display and Xvfb was not found')
+    number = 99
+    while os.path.exists('/tmp/.X{0}-lock'.format(number)):
+        number += 1
+    process = subprocess.Popen([xvfb, ':{0}'.format(number), '-screen', '0',
+                                size, '-nolisten', 'tcp'],
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    socket = '/tmp/.X11-unix/X{0}'.format(number)
+    end = time.time() + wait
+    while not os.path.exists(socket):
+        if process.poll() is not None or time.time() > end:
+            process.kill()
+            raise RuntimeError('Xvfb did not start')
+        time.sleep(0.05)
+    os.environ['DISPLAY'] = ':{0}'.format(number)
+    return process
+
+
+def runRenderBenchmarks(params, only=None, width=1000, height=700):
+    """Time drawing a table made with params.
+       returns: a dict of benchmark name -> times"""
+    process = startDisplay()
+    try:
+        import tkinter as tk
+        from Tables import TableCanvas
+        root = tk.Tk()
+        root.geometry('{0}x{1}'.format(width + 100, height + 100))
+        frame = tk.Frame(root)
+        frame.pack(fill='both', expand=1)
+        model = createModel(params['rows'], params['cols'], params['mix'],
+                            params['formulas'])
+        table = TableCanvas(frame, model, width=width, height=height)
+        table.createTableFrame()
+        root.update()
+
+        def redraw(_):
+            table.redrawVisible()
+            root.update_idletasks()
+
+        def scroll(_):
+            # jump through the table from top to bottom
+            for i in range(20):
+                table.set_yviews('moveto', i / 20.0)
+                root.update_idletasks()
+
+        results = {}
+        for name, func in [('render.redraw', redraw),
+                           ('render.scroll', scroll)]:
+            if only and name not in only:
+                continue
+            results[name] = timeCall(func, lambda: None, params['repeat'])
+        root.destroy()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            del os.environ['DISPLAY']
+    return results
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmarks of the table model and of drawing tables.
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+    Run from the tkintertable directory with
+        python -m benchmarks --rows 100000 --output results.json
+    and compare a later run against it with --compare results.json
+"""
+
+import time
+import platform
+from datetime import datetime
+
+
+def timeCall(func, setup=None, repeat=5):
+    """Time repeat calls of func, passing it what setup returns if given.
+       Setup is not timed. returns: a dict of the fastest, median and
+       mean times in seconds"""
+    times = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    ordered = sorted(times)
+    return {'min': ordered[0],
+            'median': ordered[len(ordered) // 2],
+            'mean': sum(times) / len(times),
+            'repeat': repeat}
+
+
+def runBenchmarks(rows=10000, cols=10, mix='mixed', formulas=0.0,
+                  repeat=5, only=None, render=False, label=None):
+    """Run the model benchmarks, and the drawing ones if render is True,
+       on a table made by Datasets.createModel.
+       only: names of the benchmarks to run, by default all
+       returns: a dict of the settings and results that can be saved as
+       json"""
+    from benchmarks.ModelBench import runModelBenchmarks
+    params = {'rows': rows, 'cols': cols, 'mix': mix,
+              'formulas': formulas, 'repeat': repeat}
+    results = runModelBenchmarks(params, only)
+    if render:
+        from benchmarks.RenderBench import runRenderBenchmarks
+        results.update(runRenderBenchmarks(params, only))
+    return {'label': label,
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': params,
+            'results': results}
+
+
+def compareResults(new, old, tolerance=0.2):
+    """Compare the median times of two runs.
+       returns: a list of (name, old time, new time, ratio) and the names
+       of the benchmarks that are slower by more than tolerance"""
+    rows = []
+    slower = []
+    for name in sorted(new['results']):
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['median']
+        after = new['results'][name]['median']
+        ratio = after / before if before else float('inf')
+        rows.append((name, before, after, ratio))
+        if ratio > 1 + tolerance:
+            slower.append(name)
+    return rows, slower
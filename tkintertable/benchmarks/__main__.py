@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+    Command line for the benchmarks, see benchmarks/__init__.py
+    Created October 2026
+    Copyright (C) Damien Farrell
+
+    This program is free software; you can redistribute it and/or
+    modify it under the terms of the GNU General Public License
+    as published by the Free Software Foundation; either version 2
+    of the License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program; if not, write to the Free Software
+    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import sys
+import json
+from benchmarks import runBenchmarks, compareResults
+
+
+def main():
+    "Run the benchmarks and write the results as json"
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-r", "--rows", dest="rows", type="int", default=10000,
+                      help="Number of rows in the table")
+    parser.add_option("-c", "--cols", dest="cols", type="int", default=10,
+                      help="Number of columns in the table")
+    parser.add_option("-m", "--mix", dest="mix", default="mixed",
+                      help="Column kinds: numbers, text, mixed or weights "
+                      "such as number=0.7,text=0.2,sparse=0.1")
+    parser.add_option("-f", "--formulas", dest="formulas", type="float",
+                      default=0.0,
+                      help="Fraction of number cells holding formulas")
+    parser.add_option("-n", "--repeat", dest="repeat", type="int",
+                      default=5, help="Times each benchmark is run")
+    parser.add_option("-b", "--only", dest="only", action="append",
+                      help="Run only this benchmark, can be given again")
+    parser.add_option("-g", "--render", dest="render", action="store_true",
+                      default=False,
+                      help="Also time drawing, using Xvfb if there is "
+                      "no display")
+    parser.add_option("-l", "--label", dest="label",
+                      help="Label for the run, e.g. the release")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE",
+                      help="Write the results to FILE instead of stdout")
+    parser.add_option("--compare", dest="compare", metavar="FILE",
+                      help="Compare with the results in FILE, exits with "
+                      "status 1 if any benchmark is slower")
+    parser.add_option("--tolerance", dest="tolerance", type="float",
+                      default=0.2,
+                      help="Fraction slower than --compare that is allowed")
+    opts, remainder = parser.parse_args()
+    result = runBenchmarks(opts.rows, opts.cols, opts.mix, opts.formulas,
+                           opts.repeat, opts.only, opts.render, opts.label)
+    text = json.dumps(result, indent=2)
+    if opts.output is not None:
+        with open(opts.output, 'w') as fd:
+            fd.write(text + '\n')
+    elif opts.compare is None:
+        print(text)
+    if opts.compare is None:
+        return 0
+    with open(opts.compare) as fd:
+        old = json.load(fd)
+    rows, slower = compareResults(result, old, opts.tolerance)
+    for name, before, after, ratio in rows:
+        print('{0:>14s} {1:9.4f}s {2:9.4f}s {3:6.2f}x{4}'.format(
+            name, before, after, ratio, ' SLOWER' if name in slower else ''))
+    return 1 if slower else 0
+
+if __name__ == '__main__':
+    sys.exit(main())